@@ -1,4 +1,4 @@
-import vtk
+import mantle_vtk as vtk
 import sys
 import numpy as np
 import matplotlib.pyplot as plt
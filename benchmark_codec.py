@@ -0,0 +1,52 @@
+'''
+Benchmark of field_codec.py on the mantle variables: compression ratio
+(against float32), measured and guaranteed maximum error, and encode/decode
+throughput for each quantization and compressor.
+
+Usage:
+    python benchmark_codec.py <file_number> --variables temperature "temperature anomaly" vx
+'''
+
+import argparse
+import time
+import numpy as np
+from mantle_grid import data_path, read_fields
+from field_codec import COMPRESSORS, encode, decode, max_error, zstandard
+
+
+def best_time(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compression ratio, error and speed of the field codec')
+    parser.add_argument('file_number', type=int, help='File number')
+    parser.add_argument('--variables', type=str, nargs='+', help='Variables',
+                        default=['temperature', 'temperature anomaly', 'vx'])
+    parser.add_argument('--level', type=int, metavar='int', help='Compression level', default=1)
+    parser.add_argument('--repeat', type=int, metavar='int', help='Timing repetitions (best is kept)', default=5)
+    args = parser.parse_args()
+
+    compressors = [c for c in COMPRESSORS if c != "zstd" or zstandard is not None]
+    grid, fields = read_fields(data_path(args.file_number), args.variables)
+    print(f"{'variable':<24} {'bits':>4} {'codec':>5} {'ratio':>7} {'max err':>10} {'bound':>10} "
+          f"{'enc MB/s':>9} {'dec MB/s':>9}")
+    for name, values in fields.items():
+        values = np.ascontiguousarray(values, dtype=np.float32)
+        megabytes = values.nbytes / 1e6
+        out = np.empty_like(values)
+        for bits in (0, 16, 8):
+            for compressor in compressors:
+                blob = encode(values, bits, compressor=compressor, level=args.level)
+                decoded = decode(blob, out)
+                error = float(np.abs(decoded.astype(np.float64) - values).max())
+                bound = max_error(bits, float(values.min()), float(values.max()))
+                encode_time = best_time(lambda: encode(values, bits, compressor=compressor, level=args.level), args.repeat)
+                decode_time = best_time(lambda: decode(blob, out), args.repeat)
+                print(f"{name[:24]:<24} {bits:>4} {compressor:>5} {values.nbytes / len(blob):>6.1f}x "
+                      f"{error:>10.4g} {bound:>10.4g} {megabytes / encode_time:>9.0f} {megabytes / decode_time:>9.0f}")
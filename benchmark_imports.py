@@ -0,0 +1,77 @@
+'''
+Import-time benchmark for the switch from `import vtk` to mantle_vtk.
+
+For each script, the VTK classes it uses are collected from its source, and
+a fresh interpreter imports them either through `import vtk` (everything)
+or through mantle_vtk (only their modules). The time of the imports inside
+the child and the wall time of the whole process (what each frame pays in
+run_mantle.sh) are reported as medians over the repeats.
+
+Usage:
+    python benchmark_imports.py [script.py ...] [-r repeats]
+'''
+
+import argparse
+import glob
+import os
+import re
+import subprocess
+import sys
+import time
+import numpy as np
+
+REPO = os.path.dirname(os.path.abspath(__file__))
+
+IMPORTS = {
+    "vtk": "import vtk\nfrom vtk.util import numpy_support\n",
+    "mantle_vtk": "import mantle_vtk as vtk\nfrom vtkmodules.util import numpy_support\n",
+}
+
+
+def vtk_classes(script):
+    """Names of the vtk.vtk* attributes a script uses."""
+    with open(script) as source:
+        return sorted(set(re.findall(r"\bvtk\.(vtk\w+)", source.read())))
+
+
+def child_code(kind, classes):
+    return ("import time\nstart = time.perf_counter()\n" + IMPORTS[kind] +
+            "".join(f"vtk.{name}\n" for name in classes) +
+            "print(time.perf_counter() - start)\n")
+
+
+def time_imports(kind, classes):
+    """(import time inside the child, wall time of the child process) for one run."""
+    start = time.perf_counter()
+    # run outside the repo, where `import vtk` cannot pick up anything local
+    result = subprocess.run([sys.executable, "-c", child_code(kind, classes)], capture_output=True, text=True,
+                            check=True, cwd="/", env=dict(os.environ, PYTHONPATH=REPO))
+    return float(result.stdout.split()[-1]), time.perf_counter() - start
+
+
+def benchmark(script, repeats):
+    classes = vtk_classes(script)
+    times = {kind: np.median([time_imports(kind, classes) for _ in range(repeats)], axis=0) for kind in IMPORTS}
+    return classes, times
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare the VTK import time of the scripts with and without mantle_vtk')
+    parser.add_argument('scripts', nargs='*', help='Scripts to measure (default: every script using VTK)')
+    parser.add_argument('-r', '--repeats', type=int, metavar='int', help='Runs per script and import style', default=5)
+    args = parser.parse_args()
+
+    scripts = args.scripts or sorted(script for script in glob.glob(os.path.join(REPO, "*.py"))
+                                     if vtk_classes(script) and not script.endswith("mantle_vtk.py"))
+    print(f"{'script':24s} {'classes':>7s} {'import vtk':>12s} {'mantle_vtk':>12s} {'speedup':>8s} "
+          f"{'process':>16s}")
+    totals = {kind: 0.0 for kind in IMPORTS}
+    for script in scripts:
+        classes, times = benchmark(script, args.repeats)
+        full, lazy = times["vtk"], times["mantle_vtk"]
+        for kind in IMPORTS:
+            totals[kind] += times[kind][1]
+        print(f"{os.path.basename(script):24s} {len(classes):7d} {full[0]:11.3f}s {lazy[0]:11.3f}s "
+              f"{full[0] / lazy[0]:7.1f}x {full[1]:7.3f}s->{lazy[1]:.3f}s")
+    print(f"Process wall time over all scripts: {totals['vtk']:.2f}s with import vtk, "
+          f"{totals['mantle_vtk']:.2f}s with mantle_vtk")
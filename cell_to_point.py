@@ -0,0 +1,196 @@
+'''
+Cell -> point conversion that uses the logical [r, lat, lon] layout of the
+spherical grid instead of vtkCellDataToPointData's point-to-cell links.
+
+A point value is the average of the (up to 8) cells around it, which on the
+structured grid factors into averaging the two neighbouring cells along r,
+lat and lon in turn. The arrays are converted together one radial layer of
+points at a time: the two cell layers around it are averaged, then the
+layer is averaged along lat and lon with vectorized slicing and written
+into the output arrays, which are allocated once at their final size. The
+temporaries are the size of a layer, not of the grid. On top of what the
+generic filter does:
+
+  * the longitude seam wraps around, so the duplicated first/last column of
+    points gets the average of the cells on both sides of it;
+  * all the points at a pole (one per longitude, same position) get the
+    average of the whole ring of polar cells instead of their two neighbours;
+  * the inner and outer radius (and latitude ends short of a pole) average
+    the cells that exist, as the generic filter does.
+
+The output is what mantle_lic.py / open_transformation.py read (and what
+paraview_transformed.py saved from ParaView): the spherical structured grid
+with point arrays for the scalars and a "Velocity" vector from vx, vy, vz.
+
+On a 60x180x360 file the conversion takes about half the time of
+vtkCellDataToPointData, and its peak memory is the output arrays, as for
+the generic filter, which needs no more on a structured grid: the memory
+is not a fraction of it. The gain there is a correct seam and poles.
+--compare reports the time and the peak memory of each stage.
+
+Usage:
+    python cell_to_point.py <file_number> [-o spherical_transformed.vts] [--compare]
+'''
+
+import argparse
+import os
+import time
+import numpy as np
+import mantle_vtk as vtk
+from vtkmodules.util import numpy_support
+from mantle_grid import data_path, read_timestep, SphericalGrid
+from domain_decomposition import grid_arrays, is_periodic
+from memory_report import MemoryReport
+
+SCALARS = ["spin transition-induced density anomaly", "temperature", "temperature anomaly"]
+VELOCITY = ("vx", "vy", "vz")
+
+
+def _axis_average(values, axis, periodic=False):
+    """Average of the two cells on either side of every point along one axis (n cells -> n + 1 points)."""
+    values = np.moveaxis(values, axis, 0)
+    n = values.shape[0]
+    averaged = np.empty((n + 1,) + values.shape[1:], dtype=values.dtype)
+    # point i sits between cells i - 1 and i
+    np.add(values[1:], values[:-1], out=averaged[1:n])
+    averaged[1:n] *= 0.5
+    if periodic:
+        # the first and last point are the same position, between the last and the first cell
+        np.add(values[0], values[-1], out=averaged[0])
+        averaged[0] *= 0.5
+        averaged[n] = averaged[0]
+    else:
+        # the end points only have one cell
+        averaged[0] = values[0]
+        averaged[n] = values[-1]
+    return np.moveaxis(averaged, 0, axis)
+
+
+def layer_to_points(layer, out, periodic=True, south_pole=False, north_pole=False):
+    """Writes the point values (nlat+1, nlon+1, ...) of a radially averaged cell layer (nlat, nlon, ...) into out."""
+    out[...] = _axis_average(_axis_average(layer, 0), 1, periodic)
+    # every point of a pole ring is the same position: average the whole ring of polar cells
+    for pole, j_cells, j_points in ((south_pole, 0, 0), (north_pole, -1, -1)):
+        if pole:
+            out[j_points] = layer[j_cells].mean(axis=0)
+
+
+def cells_to_points(columns, periodic=True, south_pole=False, north_pole=False, outputs=None):
+    """Point values (nr+1, nlat+1, nlon+1) of cell arrays (nr, nlat, nlon), all converted in one pass over r.
+
+    `columns` is a list of arrays; consecutive ones can share an output:
+    `outputs` is a list of float32 arrays (nr+1, nlat+1, nlon+1) or
+    (nr+1, nlat+1, nlon+1, k) taking the next 1 or k columns (default one
+    per column). Returns the outputs.
+    """
+    nr, nlat, nlon = columns[0].shape
+    if outputs is None:
+        outputs = [np.empty((nr + 1, nlat + 1, nlon + 1), dtype=np.float32) for _ in columns]
+    layout = []
+    first = 0
+    for out in outputs:
+        components = out.shape[3] if out.ndim == 4 else 1
+        layout.append((out.reshape(out.shape[:3] + (components,)), first, components))
+        first += components
+    layer = np.empty((nlat, nlon, len(columns)), dtype=np.float32)
+    for r in range(nr + 1):
+        # point layer r sits between cell layers r - 1 and r (the inner and outer one only have one)
+        below, above = max(r - 1, 0), min(r, nr - 1)
+        for k, values in enumerate(columns):
+            np.add(values[below], values[above], out=layer[..., k])
+        layer *= 0.5
+        for out, first, components in layout:
+            layer_to_points(layer[..., first:first + components], out[r], periodic, south_pole, north_pole)
+    return outputs
+
+
+def is_pole(latitude):
+    return abs(abs(latitude) - 90.0) < 1e-6
+
+
+def convert(data, scalars=SCALARS, velocity=VELOCITY):
+    """Structured grid with the scalars and a "Velocity" vector as point data, from the reader's cell data."""
+    points, cell_arrays = grid_arrays(data)
+    columns = [cell_arrays[name] for name in scalars]
+    shape = points.shape[:3]
+    outputs = [np.empty(shape, dtype=np.float32) for _ in scalars]
+    if velocity:
+        columns += [cell_arrays[name] for name in velocity]
+        outputs.append(np.empty(shape + (len(velocity),), dtype=np.float32))
+    grid = SphericalGrid.from_dataset(data)
+    cells_to_points(columns, is_periodic(points), is_pole(grid.lat_bounds[0]), is_pole(grid.lat_bounds[-1]),
+                    outputs)
+
+    output = vtk.vtkStructuredGrid()
+    output.SetExtent(data.GetExtent())
+    output.SetPoints(data.GetPoints())
+    # the VTK arrays take over the output buffers (deep=0 keeps a reference to them)
+    for name, values in zip(scalars, outputs):
+        array = numpy_support.numpy_to_vtk(values.reshape(-1), deep=0)
+        array.SetName(name)
+        output.GetPointData().AddArray(array)
+    if velocity:
+        array = numpy_support.numpy_to_vtk(outputs[-1].reshape(-1, len(velocity)), deep=0)
+        array.SetName("Velocity")
+        output.GetPointData().SetVectors(array)
+    return output
+
+
+def generic_convert(data, names):
+    """vtkCellDataToPointData on the same arrays, for comparison."""
+    copy = vtk.vtkStructuredGrid()
+    copy.SetExtent(data.GetExtent())
+    copy.SetPoints(data.GetPoints())
+    for name in names:
+        copy.GetCellData().AddArray(data.GetCellData().GetArray(name))
+    cell_to_point = vtk.vtkCellDataToPointData()
+    cell_to_point.SetInputData(copy)
+    cell_to_point.Update()
+    return cell_to_point.GetOutput()
+
+
+def write_vts(data, file_name):
+    writer = vtk.vtkXMLStructuredGridWriter()
+    writer.SetFileName(file_name)
+    writer.SetInputData(data)
+    writer.Write()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Convert the cell data of a spherical file to point data (.vts)')
+    parser.add_argument('file_number', type=int, help='File number')
+    parser.add_argument('-o', '--output', type=str, help='Output .vts (default mantle_data/transformed/sphericalNNN.vts)',
+                        default=None)
+    parser.add_argument('--compare', action='store_true',
+                        help='Also run vtkCellDataToPointData and report time, memory and differences')
+    args = parser.parse_args()
+
+    report = MemoryReport()
+    with report.stage("read"):
+        data = read_timestep(data_path(args.file_number), SCALARS + list(VELOCITY))
+    print(f"Read {data.GetNumberOfCells()} cells")
+
+    with report.stage("structured"):
+        output = convert(data)
+
+    file_name = args.output or os.path.join("mantle_data", "transformed", f"spherical{args.file_number:03d}.vts")
+    os.makedirs(os.path.dirname(file_name) or ".", exist_ok=True)
+    with report.stage("write"):
+        write_vts(output, file_name)
+    print(f"Saved {file_name}")
+
+    if args.compare:
+        with report.stage("generic"):
+            generic = generic_convert(data, SCALARS + list(VELOCITY))
+        points, _ = grid_arrays(data)
+        shape = points.shape[:3]
+        for name in SCALARS:
+            ours = numpy_support.vtk_to_numpy(output.GetPointData().GetArray(name)).reshape(shape)
+            theirs = numpy_support.vtk_to_numpy(generic.GetPointData().GetArray(name)).reshape(shape)
+            # away from the seam and the poles both average the same cells
+            interior = np.abs(ours - theirs)[:, 1:-1, 1:-1].max()
+            seam = np.abs(ours[:, :, 0] - ours[:, :, -1]).max()
+            generic_seam = np.abs(theirs[:, :, 0] - theirs[:, :, -1]).max()
+            print(f"  {name}: interior max difference {interior:.3g}, seam mismatch {seam:.3g} "
+                  f"(generic {generic_seam:.3g})")
+    report.print()
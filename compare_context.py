@@ -0,0 +1,79 @@
+'''
+Side-by-side comparison of the context layer modes of mantle_anomoly.py:
+renders the same timestep with each mode, turning the camera a little
+every frame, and reports the build time, the primitives drawn and the
+median frame time. The first frame of each mode goes into one labeled
+image.
+
+Usage:
+    python compare_context.py <file_number> --frames 20 --modes full boundary shell volume none
+'''
+
+import argparse
+import os
+import time
+import numpy as np
+import mantle_vtk as vtk
+from mantle_anomoly import read_anomaly, scale_anomaly, anomaly_surface, in_between_region, anomaly_colors, \
+    anomaly_scene
+from context_layer import MODES, IN_BETWEEN_MODES, context_layer, primitive_count
+from mantle_grid import data_path
+from mantle_images import capture, contact_sheet, time_frames, write_png
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Render and time every context layer mode side by side')
+    parser.add_argument('file_number', type=int, help='File number')
+    parser.add_argument('-t', '--threshold', type=float, help='Threshold on the scaled anomaly', default=50)
+    parser.add_argument('--modes', type=str, nargs='+', choices=MODES, help='Modes to compare', default=list(MODES))
+    parser.add_argument('--frames', type=int, metavar='int', help='Timed frames per mode', default=20)
+    parser.add_argument('--size', type=int, nargs=2, metavar='int', help='Window size', default=[800, 600])
+    parser.add_argument('--reduction', type=float, help='Fraction of triangles removed by boundary', default=0.9)
+    parser.add_argument('--resolution', type=int, metavar='int', help='Samples per axis of volume', default=64)
+    parser.add_argument('-o', '--output', type=str, help='Comparison image', default=None)
+    args = parser.parse_args()
+
+    selected_variable = "temperature anomaly"
+    min_temp, max_temp = -200, 200
+    data = read_anomaly(data_path(args.file_number), selected_variable)
+    scale_anomaly(data, selected_variable, min_temp, max_temp)
+    surface = anomaly_surface(data, args.threshold)
+    colors = anomaly_colors(min_temp, max_temp)
+    in_between_data, in_between_time = None, 0.0
+    if any(mode in IN_BETWEEN_MODES for mode in args.modes):
+        start = time.perf_counter()
+        in_between_data = in_between_region(data, args.threshold)
+        in_between_time = time.perf_counter() - start
+
+    images = []
+    print(f"{'mode':10s} {'build':>8s} {'primitives':>11s} {'first frame':>12s} {'median frame':>13s}")
+    for mode in args.modes:
+        start = time.perf_counter()
+        context = context_layer(mode, data, colors, selected_variable, min_temp, max_temp, args.threshold,
+                                in_between_data, args.reduction, args.resolution)
+        # the in-between region is only extracted once, but counts for every mode drawing it
+        build_time = time.perf_counter() - start + (in_between_time if mode in IN_BETWEEN_MODES else 0.0)
+        renderer, render_window, _ = anomaly_scene(surface, context, colors, selected_variable,
+                                                   min_temp, max_temp, interactive=False)
+        render_window.SetSize(*args.size)
+        first_frame = time_frames(renderer, render_window, 1, degrees=0.0)[0]
+        image_camera = vtk.vtkCamera()
+        image_camera.DeepCopy(renderer.GetActiveCamera())
+        frame = np.median(time_frames(renderer, render_window, args.frames))
+        print(f"{mode:10s} {build_time:7.2f}s {primitive_count(context):11d} {first_frame:11.3f}s "
+              f"{1000 * frame:10.1f} ms")
+
+        label = vtk.vtkTextActor()
+        label.SetInput(f"{mode}: {1000 * frame:.0f} ms/frame, {primitive_count(context)} primitives")
+        label.GetTextProperty().SetFontSize(20)
+        label.SetDisplayPosition(10, 10)
+        renderer.AddViewProp(label)
+        renderer.GetActiveCamera().DeepCopy(image_camera)
+        render_window.Render()
+        images.append(capture(render_window))
+        render_window.Finalize()
+
+    output = args.output or f"output_images/context_compare{args.file_number:03d}.png"
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    write_png(contact_sheet(images, len(images) if len(images) <= 3 else int(np.ceil(len(images) / 2))), output)
+    print(f"Comparison saved as {output}")
@@ -0,0 +1,172 @@
+'''
+The translucent context layer drawn around the anomaly surfaces in
+mantle_anomoly.py, and cheaper stand-ins for it.
+
+"full" is the original layer: the in-between region (cells between
+-threshold and threshold) through a vtkDataSetMapper at opacity 0.1, i.e.
+every boundary face of that region blended on top of the surfaces. The
+proxies keep the look of a faint colored shell around the anomalies:
+
+    boundary  the same boundary, triangulated and decimated, colored by point data
+    shell     only the outer and inner spheres of the grid, colored by the cells beside them
+    volume    a low-resolution volume of the in-between values, opacity scaled to the shell thickness
+    none      no context layer
+'''
+
+import numpy as np
+import mantle_vtk as vtk
+from vtkmodules.util import numpy_support
+from domain_decomposition import grid_arrays
+
+MODES = ("full", "boundary", "shell", "volume", "none")
+# modes that draw mantle_anomoly.in_between_region
+IN_BETWEEN_MODES = ("full", "boundary")
+CONTEXT_OPACITY = 0.1
+
+
+def _translucent_actor(mapper, colors, variable, vmin, vmax, point_data=False):
+    if point_data:
+        mapper.SetScalarModeToUsePointFieldData()
+    else:
+        mapper.SetScalarModeToUseCellFieldData()
+    mapper.SelectColorArray(variable)
+    mapper.SetScalarRange(vmin, vmax)
+    mapper.SetLookupTable(colors)
+    actor = vtk.vtkActor()
+    actor.SetMapper(mapper)
+    actor.GetProperty().SetOpacity(CONTEXT_OPACITY)
+    return actor
+
+
+def full_context(in_between_data, colors, variable, vmin, vmax):
+    # Set up a mapper and actor for the in-between data (with opacity of 0.1)
+    in_between_mapper = vtk.vtkDataSetMapper()
+    in_between_mapper.SetInputData(in_between_data)
+    return _translucent_actor(in_between_mapper, colors, variable, vmin, vmax)
+
+
+def boundary_context(in_between_data, colors, variable, vmin, vmax, reduction=0.9):
+    """Boundary of the in-between region with `reduction` of its triangles decimated away."""
+    geometry_filter = vtk.vtkGeometryFilter()
+    geometry_filter.SetInputData(in_between_data)
+    triangles = vtk.vtkTriangleFilter()
+    triangles.SetInputConnection(geometry_filter.GetOutputPort())
+    # decimation drops the cell data, so the colors go through the points
+    cell_to_point = vtk.vtkCellDataToPointData()
+    cell_to_point.SetInputConnection(triangles.GetOutputPort())
+    decimate = vtk.vtkDecimatePro()
+    decimate.SetInputConnection(cell_to_point.GetOutputPort())
+    decimate.SetTargetReduction(reduction)
+    decimate.PreserveTopologyOn()
+    decimate.Update()
+    mapper = vtk.vtkPolyDataMapper()
+    mapper.SetInputData(decimate.GetOutput())
+    return _translucent_actor(mapper, colors, variable, vmin, vmax, point_data=True)
+
+
+def _layer_quads(nlat, nlon, offset):
+    """Quads (n, 4) of one (nlat + 1) x (nlon + 1) layer of points starting at point `offset`."""
+    j, i = np.meshgrid(np.arange(nlat), np.arange(nlon), indexing="ij")
+    first = (j * (nlon + 1) + i).ravel() + offset
+    return np.stack([first, first + 1, first + nlon + 2, first + nlon + 1], axis=-1)
+
+
+def shell_context(data, colors, variable, vmin, vmax):
+    """Inner and outer spheres of the grid, each quad colored by the cell under/over it."""
+    points, cell_arrays = grid_arrays(data)
+    nlat, nlon = points.shape[1] - 1, points.shape[2] - 1
+    layer_points = (nlat + 1) * (nlon + 1)
+    shell_points = np.concatenate([points[0].reshape(-1, 3), points[-1].reshape(-1, 3)])
+    quads = np.concatenate([_layer_quads(nlat, nlon, 0), _layer_quads(nlat, nlon, layer_points)])
+    values = np.concatenate([cell_arrays[variable][0].ravel(), cell_arrays[variable][-1].ravel()])
+
+    shell = vtk.vtkPolyData()
+    vtk_points = vtk.vtkPoints()
+    vtk_points.SetData(numpy_support.numpy_to_vtk(np.ascontiguousarray(shell_points), deep=1))
+    shell.SetPoints(vtk_points)
+    polys = vtk.vtkCellArray()
+    polys.SetData(numpy_support.numpy_to_vtkIdTypeArray(np.arange(0, 4 * len(quads) + 1, 4, dtype=np.int64), deep=1),
+                  numpy_support.numpy_to_vtkIdTypeArray(quads.astype(np.int64).ravel(), deep=1))
+    shell.SetPolys(polys)
+    array = numpy_support.numpy_to_vtk(np.ascontiguousarray(values), deep=1)
+    array.SetName(variable)
+    shell.GetCellData().AddArray(array)
+
+    mapper = vtk.vtkPolyDataMapper()
+    mapper.SetInputData(shell)
+    return _translucent_actor(mapper, colors, variable, vmin, vmax)
+
+
+def volume_context(data, colors, variable, vmin, vmax, threshold_value, resolution=64):
+    """resolution^3 volume of `variable`, opaque only where the active (scaled) scalars are in between."""
+    scaled = numpy_support.vtk_to_numpy(data.GetCellData().GetScalars())
+    values = numpy_support.vtk_to_numpy(data.GetCellData().GetArray(variable))
+    in_between = np.abs(scaled) <= threshold_value
+    if not in_between.any():
+        return None
+    # the scaling is linear, so the in-between cells are a range of the unscaled values too
+    low, high = values[in_between].min(), values[in_between].max()
+
+    resample = vtk.vtkResampleToImage()
+    resample.SetInputDataObject(data)
+    resample.UseInputBoundsOn()
+    resample.SetSamplingDimensions(resolution, resolution, resolution)
+    resample.Update()
+    image = resample.GetOutput()
+    sampled = numpy_support.vtk_to_numpy(image.GetPointData().GetArray(variable)).astype(np.float32)
+    valid = numpy_support.vtk_to_numpy(image.GetPointData().GetArray("vtkValidPointMask"))
+    # samples in the core and the corners get a value past the opaque range
+    sampled[valid == 0] = high + (high - low + 1.0)
+    volume_image = vtk.vtkImageData()
+    volume_image.CopyStructure(image)
+    array = numpy_support.numpy_to_vtk(sampled, deep=1)
+    array.SetName(variable)
+    volume_image.GetPointData().SetScalars(array)
+
+    step = 1e-3 * (high - low + 1.0)
+    opacity = vtk.vtkPiecewiseFunction()
+    opacity.AddPoint(low - step, 0.0)
+    opacity.AddPoint(low, CONTEXT_OPACITY)
+    opacity.AddPoint(high, CONTEXT_OPACITY)
+    opacity.AddPoint(high + step, 0.0)
+    volume_property = vtk.vtkVolumeProperty()
+    volume_property.SetColor(colors)
+    volume_property.SetScalarOpacity(opacity)
+    volume_property.SetInterpolationTypeToLinear()
+    # a ray crossing the whole shell picks up about the opacity of one translucent face
+    radius = np.linalg.norm(grid_arrays(data)[0][[0, -1], 0, 0], axis=-1)
+    volume_property.SetScalarOpacityUnitDistance(abs(radius[1] - radius[0]))
+
+    mapper = vtk.vtkSmartVolumeMapper()
+    mapper.SetInputData(volume_image)
+    volume = vtk.vtkVolume()
+    volume.SetMapper(mapper)
+    volume.SetProperty(volume_property)
+    return volume
+
+
+def context_layer(mode, data, colors, variable, vmin, vmax, threshold_value=50, in_between_data=None,
+                  reduction=0.9, resolution=64):
+    """Prop for the context layer (None for "none"); "full" and "boundary" need in_between_data."""
+    if mode not in MODES:
+        raise ValueError(f"Unknown context mode '{mode}', expected one of {', '.join(MODES)}")
+    if mode in IN_BETWEEN_MODES and in_between_data is None:
+        raise ValueError(f"Context mode '{mode}' needs the in-between region")
+    if mode == "full":
+        return full_context(in_between_data, colors, variable, vmin, vmax)
+    if mode == "boundary":
+        return boundary_context(in_between_data, colors, variable, vmin, vmax, reduction)
+    if mode == "shell":
+        return shell_context(data, colors, variable, vmin, vmax)
+    if mode == "volume":
+        return volume_context(data, colors, variable, vmin, vmax, threshold_value, resolution)
+    return None
+
+
+def primitive_count(prop):
+    """Cells drawn by a context actor, or voxels of a context volume."""
+    if prop is None:
+        return 0
+    if prop.IsA("vtkVolume"):
+        return prop.GetMapper().GetInput().GetNumberOfPoints()
+    return prop.GetMapper().GetInput().GetNumberOfCells()
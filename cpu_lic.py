@@ -0,0 +1,210 @@
+'''
+Line integral convolution of the mantle velocity on depth shells and
+cross-sections, done on the CPU with numpy (no vtkSurfaceLICMapper / OpenGL).
+
+Each slice is drawn as an equirectangular image (see spherical_slices.py).
+The in-plane velocity is converted to pixel units, and the streamlines of
+all pixels are advanced together one step at a time. The result is colored
+by temperature with the mantle.py color stops, over one range for every
+frame (--range, or the temperature range of all the files), so the colors
+of a time series do not shift from frame to frame.
+
+Usage:
+    python cpu_lic.py <start_file_number> <end_file_number> --kind shell --value 660 --workers 8
+'''
+
+import argparse
+import functools
+import os
+import time
+import numpy as np
+from multiprocessing import Pool
+from mantle_grid import data_path, read_fields, fractional_index, to_local_components
+from mantle_colors import TEMPERATURE_STOPS, map_colors
+from spherical_slices import KINDS
+from mantle_images import write_png
+
+LIC_VARIABLES = ["temperature", "vx", "vy", "vz"]
+
+
+@functools.lru_cache(maxsize=8)
+def noise_texture(shape, seed=0):
+    """White noise shared by every frame of the same size, so animations do not flicker."""
+    noise = np.random.default_rng(seed).random(shape, dtype=np.float32)
+    noise.setflags(write=False)
+    return noise
+
+
+def _bilinear(array, rows, cols, wrap_cols=False):
+    """Samples a 2D array at fractional (row, col) positions."""
+    n_rows, n_cols = array.shape
+    rows = np.clip(rows, 0, n_rows - 1)
+    r0 = np.minimum(np.floor(rows).astype(np.intp), n_rows - 2) if n_rows > 1 else np.zeros(rows.shape, np.intp)
+    tr = rows - r0
+    if wrap_cols:
+        cols = np.mod(cols, n_cols)
+        c0 = np.floor(cols).astype(np.intp)
+        c1 = (c0 + 1) % n_cols
+    else:
+        cols = np.clip(cols, 0, n_cols - 1)
+        c0 = np.minimum(np.floor(cols).astype(np.intp), n_cols - 2)
+        c1 = c0 + 1
+    tc = cols - c0
+    r1 = np.minimum(r0 + 1, n_rows - 1)
+    top = array[r0, c0] * (1 - tc) + array[r0, c1] * tc
+    bottom = array[r1, c0] * (1 - tc) + array[r1, c1] * tc
+    return top * (1 - tr) + bottom * tr
+
+
+def slice_plane(fields, grid, kind, value, size):
+    """Temperature and in-plane velocity (pixels / unit time) on an equirectangular slice image."""
+    east, north, up = to_local_components(fields["vx"], fields["vy"], fields["vz"], grid)
+    temperature = fields["temperature"]
+    h = size
+    w = size if kind == "meridian" else 2 * size
+    row_centers = (np.arange(h) + 0.5) / h
+    col_centers = (np.arange(w) + 0.5) / w
+    lon0 = min(grid.lon_bounds[0], grid.lon_bounds[-1])
+    r_min, r_max = grid.r_bounds.min(), grid.r_bounds.max()
+
+    if kind == "shell":
+        k = int(grid.depth_index(value))
+        if k < 0:
+            raise ValueError(f"Depth {value} is outside the mantle")
+        lat = 90.0 - 180.0 * row_centers
+        lon = lon0 + 360.0 * col_centers
+        rows, cols = np.meshgrid(fractional_index(grid.lat, lat),
+                                 fractional_index(grid.lon, lon, grid.periodic), indexing="ij")
+        wrap = grid.periodic
+        t, ve, vn = (_bilinear(a[k], rows, cols, wrap) for a in (temperature, east, north))
+        cos_lat = np.maximum(np.cos(np.radians(lat)), 0.05)[:, None]
+        dcol = ve / (grid.r[k] * cos_lat) * w / (2 * np.pi)
+        drow = -vn / grid.r[k] * h / np.pi
+        return t, dcol, drow, wrap
+
+    radius = r_max - (r_max - r_min) * row_centers
+    if kind == "meridian":
+        i = int(grid.lon_index(value))
+        if i < 0:
+            raise ValueError(f"Longitude {value} is outside the grid")
+        lat = -90.0 + 180.0 * col_centers
+        rows, cols = np.meshgrid(fractional_index(grid.r, radius), fractional_index(grid.lat, lat), indexing="ij")
+        wrap = False
+        t, vn, vr = (_bilinear(a[:, :, i], rows, cols) for a in (temperature, north, up))
+        dcol = vn / radius[:, None] * w / np.pi
+    else:
+        j = int(grid.lat_index(value))
+        if j < 0:
+            raise ValueError(f"Latitude {value} is outside the grid")
+        lon = lon0 + 360.0 * col_centers
+        rows, cols = np.meshgrid(fractional_index(grid.r, radius),
+                                 fractional_index(grid.lon, lon, grid.periodic), indexing="ij")
+        wrap = grid.periodic
+        t, ve, vr = (_bilinear(a[:, j, :], rows, cols, wrap) for a in (temperature, east, up))
+        cos_lat = max(np.cos(np.radians(grid.lat[j])), 0.05)
+        dcol = ve / (radius[:, None] * cos_lat) * w / (2 * np.pi)
+    drow = -vr * h / (r_max - r_min)
+    return t, dcol, drow, wrap
+
+
+def line_integral_convolution(dcol, drow, noise, length=20, step=0.5, wrap_cols=False):
+    """Averages the noise along the streamline through every pixel, all pixels at once."""
+    h, w = noise.shape
+    magnitude = np.hypot(dcol, drow)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        u = np.where(magnitude > 0, dcol / magnitude, 0.0)
+        v = np.where(magnitude > 0, drow / magnitude, 0.0)
+
+    rows0, cols0 = np.meshgrid(np.arange(h, dtype=np.float64), np.arange(w, dtype=np.float64), indexing="ij")
+    total = noise.astype(np.float64).copy()
+    weight = np.ones_like(total)
+    for direction in (1.0, -1.0):
+        rows, cols = rows0.copy(), cols0.copy()
+        alive = np.ones(noise.shape, dtype=bool)
+        for n in range(length):
+            # midpoint (RK2) step along the normalized field
+            du = _bilinear(u, rows, cols, wrap_cols)
+            dv = _bilinear(v, rows, cols, wrap_cols)
+            mid_rows = rows + 0.5 * step * direction * dv
+            mid_cols = cols + 0.5 * step * direction * du
+            rows = rows + step * direction * _bilinear(v, mid_rows, mid_cols, wrap_cols)
+            cols = cols + step * direction * _bilinear(u, mid_rows, mid_cols, wrap_cols)
+            if wrap_cols:
+                cols = np.mod(cols, w)
+            # streamlines stop at the edges of the image
+            alive &= (rows >= 0) & (rows <= h - 1) & (cols >= 0) & (cols <= w - 1)
+            # Hann kernel along the streamline
+            kernel = 0.5 * (1 + np.cos(np.pi * (n + 1) / (length + 1)))
+            sample = noise[np.clip(np.rint(rows), 0, h - 1).astype(np.intp),
+                           np.clip(np.rint(cols), 0, w - 1).astype(np.intp) % w]
+            total += np.where(alive, kernel * sample, 0.0)
+            weight += np.where(alive, kernel, 0.0)
+    return (total / weight).astype(np.float32)
+
+
+def enhance_contrast(lic, low=2.0, high=98.0):
+    """Stretches the LIC intensities between two percentiles to [0, 1]."""
+    lo, hi = np.percentile(lic, [low, high])
+    if hi <= lo:
+        return np.zeros_like(lic)
+    return np.clip((lic - lo) / (hi - lo), 0.0, 1.0)
+
+
+def render_lic(fields, grid, kind, value, size=256, length=20, contrast=True, vrange=None):
+    """Returns the LIC image of one slice colored by temperature, as (h, w, 3) uint8."""
+    temperature, dcol, drow, wrap = slice_plane(fields, grid, kind, value, size)
+    lic = line_integral_convolution(dcol, drow, noise_texture(temperature.shape), length, wrap_cols=wrap)
+    if contrast:
+        lic = enhance_contrast(lic)
+    if vrange is None:
+        vrange = (float(fields["temperature"].min()), float(fields["temperature"].max()))
+    rgb = map_colors(temperature, TEMPERATURE_STOPS, vrange[0], vrange[1])
+    shade = 0.25 + 0.75 * lic[..., None]
+    return np.clip(rgb * shade, 0, 255).astype(np.uint8)
+
+
+def temperature_range(file_number):
+    _, fields = read_fields(data_path(file_number), ["temperature"])
+    return float(fields["temperature"].min()), float(fields["temperature"].max())
+
+
+def render_file(job):
+    file_number, kind, value, size, length, contrast, vrange, output = job
+    grid, fields = read_fields(data_path(file_number), LIC_VARIABLES)
+    rgb = render_lic(fields, grid, kind, value, size, length, contrast, vrange)
+    file_name = os.path.join(output, f"lic_{kind}_{value:g}_{file_number:03d}.png")
+    write_png(rgb, file_name)
+    return file_name
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='CPU line integral convolution of the mantle velocity')
+    parser.add_argument('start', type=int, help='First file number')
+    parser.add_argument('end', type=int, help='Last file number')
+    parser.add_argument('--kind', type=str, choices=KINDS, help='Type of slice', default='shell')
+    parser.add_argument('--value', type=float, help='Depth (km), longitude or latitude of the slice', default=660.0)
+    parser.add_argument('--size', type=int, metavar='int', help='Image height in pixels', default=512)
+    parser.add_argument('--length', type=int, metavar='int', help='Streamline steps in each direction', default=20)
+    parser.add_argument('--no-contrast', action='store_true', help='Skip the contrast enhancement')
+    parser.add_argument('--range', type=float, nargs=2, metavar='float',
+                        help='Temperature color range (default: range over all the files)', default=None)
+    parser.add_argument('-w', '--workers', type=int, metavar='int', help='Number of processes', default=os.cpu_count())
+    parser.add_argument('-o', '--output', type=str, metavar='dirname', help='Output directory', default='output_images/lic')
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    file_numbers = range(args.start, args.end + 1)
+    start = time.perf_counter()
+    with Pool(args.workers) as pool:
+        if args.range is None:
+            ranges = pool.map(temperature_range, file_numbers)
+            vrange = (min(low for low, _ in ranges), max(high for _, high in ranges))
+            print(f"Temperature range [{vrange[0]:.4g}, {vrange[1]:.4g}] over {len(ranges)} files "
+                  f"in {time.perf_counter() - start:.2f}s")
+        else:
+            vrange = tuple(args.range)
+        jobs = [(n, args.kind, args.value, args.size, args.length, not args.no_contrast, vrange, args.output)
+                for n in file_numbers]
+        for file_name in pool.imap(render_file, jobs):
+            print(f"Saved {file_name}")
+    print(f"Rendered {len(jobs)} frames in {time.perf_counter() - start:.2f}s")
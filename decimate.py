@@ -0,0 +1,376 @@
+'''
+Decimation of the rendered surfaces down to a triangle budget or a
+screen-space error, so the renderer does not spend its time on triangles
+smaller than a pixel.
+
+    triangles -> split by color band -> normals -> cell data to point data
+        -> vtkDecimatePro -> point data to cell data
+
+vtkDecimatePro only removes vertices, never deleting the boundary ones
+here, and keeps the point data of the rest. Before decimating, the points
+are duplicated where cells of different color bands meet (32 bands of the
+colored range by default), so band borders become boundaries: the colors
+can drift by less than a band, and the variable comes back as a cell array
+of the same name for the mappers' cell field coloring. Point normals
+computed on the full surface keep the shading smooth, and the open edges
+(the cutaway) stay in place. Topology is preserved.
+
+Locked band borders cost vertices: with a budget alone, the number of
+bands is first halved (coarser color steps) until the band borders leave
+room for the budget, about two triangles per border point, which only
+needs the band split. If the result is still more than BUDGET_TOLERANCE
+over the budget, the decimation is rerun with fewer bands, down to one
+band, past which a warning is printed. The surface is triangulated once
+for all the attempts.
+
+The surface is cut into longitude wedges that are decimated in parallel.
+The wedge borders are boundaries too, so both sides keep the same
+vertices and the pieces fit back together without cracks.
+
+The screen-space bound converts an error in pixels into a distance, for
+the camera the renderers set up (ResetCamera + Zoom) or a given camera.
+
+Usage:
+    python decimate.py <file_number> --budget 200000 -w 4
+    python decimate.py <file_number> --pixels 1.0 --frames 10
+'''
+
+import argparse
+import os
+import time
+import numpy as np
+import mantle_vtk as vtk
+from multiprocessing import Pool
+from vtkmodules.util import numpy_support
+from mesh_transfer import pack_polydata, unpack_polydata
+
+# a budget counts as met up to this fraction over it
+BUDGET_TOLERANCE = 0.1
+
+
+def triangle_count(polydata):
+    """Triangles drawn for a polydata (polygons count as n - 2 triangles, strips as n - 2)."""
+    count = 0
+    for cells in (polydata.GetPolys(), polydata.GetStrips()):
+        offsets = numpy_support.vtk_to_numpy(cells.GetOffsetsArray())
+        count += int(np.maximum(np.diff(offsets) - 2, 0).sum())
+    return count
+
+
+def pixel_size(bounds, height, zoom=2.5, view_angle=30.0, camera=None):
+    """World size of one pixel at the front of the bounds' sphere.
+
+    Without a camera, the camera is the one ResetCamera() + Zoom(zoom) sets
+    up; the front of the bounding sphere is the closest the surface gets.
+    """
+    x_min, x_max, y_min, y_max, z_min, z_max = bounds
+    center = np.array([x_min + x_max, y_min + y_max, z_min + z_max]) / 2
+    radius = 0.5 * np.linalg.norm([x_max - x_min, y_max - y_min, z_max - z_min])
+    if camera is not None:
+        view_angle = camera.GetViewAngle()
+        distance = np.linalg.norm(np.array(camera.GetPosition()) - center)
+        zoom = 1.0
+    else:
+        distance = radius / np.sin(np.radians(view_angle) / 2)
+    depth = max(distance - radius, 1e-6 * radius)
+    return 2 * depth * np.tan(np.radians(view_angle) / 2) / (zoom * height)
+
+
+def _names(variables):
+    return [variables] if isinstance(variables, str) else list(variables)
+
+
+def _triangle_polydata(points, triangles, cell_arrays):
+    polydata = vtk.vtkPolyData()
+    vtk_points = vtk.vtkPoints()
+    vtk_points.SetData(numpy_support.numpy_to_vtk(np.ascontiguousarray(points), deep=1))
+    polydata.SetPoints(vtk_points)
+    polys = vtk.vtkCellArray()
+    polys.SetData(numpy_support.numpy_to_vtkIdTypeArray(np.arange(0, triangles.size + 1, 3, dtype=np.int64), deep=1),
+                  numpy_support.numpy_to_vtkIdTypeArray(np.ascontiguousarray(triangles, dtype=np.int64).ravel(),
+                                                        deep=1))
+    polydata.SetPolys(polys)
+    for name, values in cell_arrays.items():
+        array = numpy_support.numpy_to_vtk(np.ascontiguousarray(values), deep=1)
+        array.SetName(name)
+        polydata.GetCellData().AddArray(array)
+    return polydata
+
+
+def _band_corners(triangulated, variables, levels, ranges):
+    """Triangle corners as (point, band) ids, point * levels ** variables + band, and their stride."""
+    ranges = ranges or {}
+    triangles = numpy_support.vtk_to_numpy(triangulated.GetPolys().GetConnectivityArray()).reshape(-1, 3)
+    cell_arrays = {name: numpy_support.vtk_to_numpy(triangulated.GetCellData().GetArray(name))
+                   for name in _names(variables)}
+    band = np.zeros(len(triangles), dtype=np.int64)
+    for name, values in cell_arrays.items():
+        vmin, vmax = ranges.get(name) or (float(np.nanmin(values)), float(np.nanmax(values)))
+        level = np.clip(np.floor((values - vmin) / max(vmax - vmin, 1e-30) * levels), 0, levels - 1)
+        band = band * levels + np.nan_to_num(level).astype(np.int64)
+    stride = levels ** len(cell_arrays)
+    return triangles.astype(np.int64) * stride + band[:, None], stride, cell_arrays
+
+
+def split_color_bands(triangulated, variables, levels=32, ranges=None):
+    """Triangles with their points duplicated wherever cells of different color bands meet.
+
+    Every variable is cut into `levels` bands over its range (ranges[name]
+    or the data range). The band borders become boundary edges, which the
+    decimation keeps, so a decimated triangle never spans more than one band.
+    """
+    points = numpy_support.vtk_to_numpy(triangulated.GetPoints().GetData())
+    corners, stride, cell_arrays = _band_corners(triangulated, variables, levels, ranges)
+    # one point per (original point, band of the triangle using it)
+    unique, inverse = np.unique(corners.ravel(), return_inverse=True)
+    return _triangle_polydata(points[unique // stride], inverse.reshape(-1, 3), cell_arrays)
+
+
+def band_border_points(triangulated, variables, levels=32, ranges=None):
+    """Points split_color_bands() adds on the band borders, all of which the decimation keeps."""
+    corners, _, _ = _band_corners(triangulated, variables, levels, ranges)
+    if corners.size == 0:
+        return 0
+    # counted on sorted ids, much faster than np.unique here
+    corners = np.sort(corners, axis=None)
+    points = np.bincount(numpy_support.vtk_to_numpy(triangulated.GetPolys().GetConnectivityArray()),
+                         minlength=triangulated.GetNumberOfPoints())
+    return int(np.count_nonzero(np.diff(corners))) + 1 - int(np.count_nonzero(points))
+
+
+def triangulate(surface):
+    triangle_filter = vtk.vtkTriangleFilter()
+    triangle_filter.SetInputData(surface)
+    triangle_filter.PassLinesOff()
+    triangle_filter.PassVertsOff()
+    triangle_filter.Update()
+    return triangle_filter.GetOutput()
+
+
+def prepare(triangulated, variables, levels=32, ranges=None, feature_angle=45.0):
+    """Decimation input: a triangulate()d surface split by color band, with normals and the variable(s) as point data.
+
+    The normals are split at sharp edges (the cutaway rims), and the
+    decimation keeps the normals of the vertices it keeps, so the decimated
+    surface is shaded like the original instead of showing its facets.
+    """
+    normals = vtk.vtkPolyDataNormals()
+    normals.SetInputData(split_color_bands(triangulated, variables, levels, ranges))
+    normals.SetFeatureAngle(feature_angle)
+    normals.SplittingOn()
+    normals.ConsistencyOff()
+    normals.ComputeCellNormalsOff()
+    cell_to_point = vtk.vtkCellDataToPointData()
+    cell_to_point.SetInputConnection(normals.GetOutputPort())
+    cell_to_point.ProcessAllArraysOff()
+    for name in _names(variables):
+        cell_to_point.AddCellDataArray(name)
+    cell_to_point.PassCellDataOff()
+    cell_to_point.Update()
+    return cell_to_point.GetOutput()
+
+
+def to_cell_data(polydata, variables):
+    """Moves the variable(s) back from the points to the cells, keeping the point normals."""
+    point_to_cell = vtk.vtkPointDataToCellData()
+    point_to_cell.SetInputData(polydata)
+    point_to_cell.ProcessAllArraysOff()
+    for name in _names(variables):
+        point_to_cell.AddPointDataArray(name)
+    point_to_cell.PassPointDataOn()
+    point_to_cell.Update()
+    output = point_to_cell.GetOutput()
+    for name in _names(variables):
+        output.GetPointData().RemoveArray(name)
+    output.GetPointData().SetActiveNormals("Normals")
+    return output
+
+
+def split_wedges(polydata, pieces):
+    """Triangles of a prepared surface split into `pieces` longitude wedges (by centroid), with their points."""
+    points = numpy_support.vtk_to_numpy(polydata.GetPoints().GetData())
+    triangles = numpy_support.vtk_to_numpy(polydata.GetPolys().GetConnectivityArray()).reshape(-1, 3)
+    centroids = points[triangles].mean(axis=1)
+    lon = np.arctan2(centroids[:, 1], centroids[:, 0])
+    wedge = np.minimum(((lon + np.pi) / (2 * np.pi) * pieces).astype(int), pieces - 1)
+    point_data = polydata.GetPointData()
+    point_arrays = {point_data.GetArrayName(i): numpy_support.vtk_to_numpy(point_data.GetArray(i))
+                    for i in range(point_data.GetNumberOfArrays())}
+    no_cells = (np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int64))
+
+    packed = []
+    for w in range(pieces):
+        piece = triangles[wedge == w]
+        if piece.size == 0:
+            continue
+        used, local = np.unique(piece, return_inverse=True)
+        packed.append({"points": points[used], "verts": no_cells, "lines": no_cells, "strips": no_cells,
+                       "polys": (np.arange(0, piece.size + 1, 3, dtype=np.int64), local.astype(np.int64).ravel()),
+                       "point_data": {name: values[used] for name, values in point_arrays.items()},
+                       "point_scalars": None, "cell_data": {}, "cell_scalars": None})
+    return packed
+
+
+def append_pieces(pieces):
+    """The decimated wedges in one polydata.
+
+    Unlike domain_decomposition.merge_pieces the border points are not
+    fused: they sit at the same positions in both wedges already, and fusing
+    would also merge the points split by color band and by normal.
+    """
+    append = vtk.vtkAppendPolyData()
+    for piece in pieces:
+        append.AddInputData(piece)
+    append.Update()
+    return append.GetOutput()
+
+
+def decimate_piece(polydata, reduction, max_error=None):
+    """vtkDecimatePro keeping topology and boundary vertices; max_error is an absolute distance."""
+    decimate = vtk.vtkDecimatePro()
+    decimate.SetInputData(polydata)
+    decimate.SetTargetReduction(reduction)
+    decimate.PreserveTopologyOn()
+    decimate.BoundaryVertexDeletionOff()
+    decimate.SplittingOff()
+    if max_error is not None:
+        decimate.SetErrorIsAbsolute(1)
+        decimate.SetAbsoluteError(max_error)
+        # the bound holds for the accumulated error, not just the last collapse
+        decimate.AccumulateErrorOn()
+    decimate.Update()
+    return decimate.GetOutput()
+
+
+def _decimate_job(job):
+    packed, reduction, max_error = job
+    start = time.perf_counter()
+    decimated = decimate_piece(unpack_polydata(packed), reduction, max_error)
+    return pack_polydata(decimated), time.perf_counter() - start
+
+
+def _decimate_levels(triangulated, variables, budget, max_error, workers, pieces, levels, ranges):
+    """One decimation of a triangulated surface with `levels` color bands per variable."""
+    prepared = prepare(triangulated, variables, levels, ranges)
+    before = triangle_count(prepared)
+    if budget is None and max_error is None or before == 0:
+        return to_cell_data(prepared, variables), (before, before, [])
+    reduction = 1.0 - min(budget, before) / before if budget is not None else 1.0
+    pieces = pieces or workers
+    if pieces <= 1:
+        start = time.perf_counter()
+        decimated = decimate_piece(prepared, reduction, max_error)
+        piece_times = [time.perf_counter() - start]
+    else:
+        jobs = [(packed, reduction, max_error) for packed in split_wedges(prepared, pieces)]
+        with Pool(workers) as pool:
+            results = pool.map(_decimate_job, jobs)
+        decimated = append_pieces([unpack_polydata(packed) for packed, _ in results])
+        piece_times = [elapsed for _, elapsed in results]
+    decimated = to_cell_data(decimated, variables)
+    return decimated, (before, triangle_count(decimated), piece_times)
+
+
+def decimate_surface(surface, variables, budget=None, max_error=None, workers=1, pieces=None, levels=32,
+                     ranges=None):
+    """Decimated surface with the variable(s) as cell data, and (triangles before, after, seconds per piece, levels).
+
+    budget is a number of triangles; max_error a distance in world units
+    (see pixel_size()). With both, the decimation stops at whichever comes
+    first; with neither, the surface is only prepared. `levels` color bands
+    per variable (over ranges[name], default the data range) are kept apart;
+    with a budget alone they are reduced until the budget is met.
+    """
+    triangulated = triangulate(surface)
+    if budget is not None and max_error is None and triangulated.GetNumberOfCells() > budget:
+        # each border point keeps about two triangles around it
+        while levels > 1 and 2 * band_border_points(triangulated, variables, levels, ranges) > budget:
+            levels //= 2
+    while True:
+        decimated, (before, after, piece_times) = _decimate_levels(triangulated, variables, budget, max_error,
+                                                                   workers, pieces, levels, ranges)
+        if max_error is not None or budget is None or after <= budget * (1 + BUDGET_TOLERANCE):
+            break
+        if levels == 1:
+            print(f"Warning: decimated to {after} triangles, over the budget of {budget} "
+                  f"(the surface's boundary vertices are kept)")
+            break
+        # the locked vertices grow about linearly with the number of bands
+        levels = max(1, min(levels // 2, int(levels * budget / after)))
+    return decimated, (before, after, piece_times, levels)
+
+
+def decimation_options(parser):
+    """Adds --budget, --pixels and --decimate-workers to a script's parser."""
+    parser.add_argument('--budget', type=int, metavar='int', help='Decimate the surface to about this many triangles',
+                        default=None)
+    parser.add_argument('--pixels', type=float,
+                        help='Decimate while the surface moves by less than this many pixels on screen', default=None)
+    parser.add_argument('--decimate-workers', type=int, metavar='int', help='Processes decimating surface wedges',
+                        default=1)
+
+
+def print_decimation(counts, elapsed):
+    before, after, piece_times, levels = counts
+    slowest = f", slowest piece {max(piece_times):.2f}s" if len(piece_times) > 1 else ""
+    print(f"Decimated {before} -> {after} triangles ({100.0 * after / max(before, 1):.1f}%) "
+          f"with {levels} color bands in {elapsed:.2f}s{slowest}")
+
+
+if __name__ == "__main__":
+    from mantle_anomoly import read_anomaly, scale_anomaly, anomaly_surface, anomaly_colors, anomaly_scene
+    from mantle_grid import data_path
+    from mantle_images import capture, contact_sheet, time_frames, write_png
+
+    parser = argparse.ArgumentParser(description='Decimate the anomaly surfaces and compare render times')
+    parser.add_argument('file_number', type=int, help='File number')
+    parser.add_argument('-t', '--threshold', type=float, help='Threshold on the scaled anomaly', default=50)
+    parser.add_argument('--budget', type=int, metavar='int', help='Target number of triangles', default=None)
+    parser.add_argument('--pixels', type=float, help='Maximum error in pixels at the render size', default=None)
+    parser.add_argument('-w', '--workers', type=int, metavar='int', help='Processes decimating wedges', default=1)
+    parser.add_argument('--pieces', type=int, metavar='int', help='Longitude wedges (default: one per worker)',
+                        default=None)
+    parser.add_argument('--frames', type=int, metavar='int', help='Timed frames before and after', default=5)
+    parser.add_argument('--size', type=int, nargs=2, metavar='int', help='Window size', default=[1600, 1200])
+    parser.add_argument('-o', '--output', type=str, help='Before/after image', default=None)
+    args = parser.parse_args()
+    if args.budget is None and args.pixels is None:
+        parser.error("give a --budget and/or --pixels")
+
+    selected_variable = "temperature anomaly"
+    min_temp, max_temp = -200, 200
+    data = read_anomaly(data_path(args.file_number), selected_variable, lean=True)
+    scale_anomaly(data, selected_variable, min_temp, max_temp, lean=True)
+    surface = anomaly_surface(data, args.threshold, lean=True)
+    del data
+
+    max_error = None
+    if args.pixels is not None:
+        # anomaly_scene: ResetCamera + Zoom(2.5) on the surface
+        max_error = args.pixels * pixel_size(surface.GetBounds(), args.size[1], zoom=2.5)
+    start = time.perf_counter()
+    decimated, counts = decimate_surface(surface, selected_variable, args.budget, max_error, args.workers,
+                                         args.pieces)
+    print_decimation(counts, time.perf_counter() - start)
+
+    colors = anomaly_colors(min_temp, max_temp)
+    images = []
+    for label, polydata in (("original", surface), ("decimated", decimated)):
+        renderer, render_window, _ = anomaly_scene(polydata, None, colors, selected_variable, min_temp, max_temp,
+                                                   interactive=False)
+        render_window.SetSize(*args.size)
+        first = time_frames(renderer, render_window, 1, degrees=0.0)[0]
+        camera = vtk.vtkCamera()
+        camera.DeepCopy(renderer.GetActiveCamera())
+        frame = np.median(time_frames(renderer, render_window, args.frames))
+        print(f"{label:10s} {triangle_count(polydata):10d} triangles, first frame {first:.2f}s, "
+              f"median frame {1000 * frame:.0f} ms")
+        renderer.GetActiveCamera().DeepCopy(camera)
+        render_window.Render()
+        images.append(capture(render_window))
+        render_window.Finalize()
+
+    output = args.output or f"output_images/decimate{args.file_number:03d}.png"
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    write_png(contact_sheet(images, 2), output)
+    print(f"Before/after saved as {output}")
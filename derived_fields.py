@@ -0,0 +1,150 @@
+'''
+Derived variables computed with finite differences on the [r, lat, lon] grid:
+velocity magnitude, radial and tangential velocity, divergence, vorticity
+and temperature gradient.
+
+Results are cached next to the data (mantle_data/derived/sphericalNNN/*.npy),
+and mantle_grid.read_timestep / read_fields accept these names like any
+variable of the NetCDF files, so renderers and analysis scripts pick them up
+without recomputing.
+
+Usage:
+    python derived_fields.py <start_file_number> <end_file_number> --workers 8
+'''
+
+import argparse
+import os
+import time
+import numpy as np
+from multiprocessing import Pool
+from mantle_grid import data_path, read_fields, to_local_components
+
+# name -> NetCDF variables it is computed from
+DERIVED_FIELDS = {
+    "velocity magnitude": ["vx", "vy", "vz"],
+    "radial velocity": ["vx", "vy", "vz"],
+    "tangential velocity": ["vx", "vy", "vz"],
+    "divergence": ["vx", "vy", "vz"],
+    "radial vorticity": ["vx", "vy", "vz"],
+    "vorticity magnitude": ["vx", "vy", "vz"],
+    "temperature gradient magnitude": ["temperature"],
+    "radial temperature gradient": ["temperature"],
+}
+
+
+class SphericalDifferences:
+    """Centered differences along r, lat and lon (periodic in lon when the grid goes all the way round)."""
+
+    def __init__(self, grid):
+        self.grid = grid
+        self.r = grid.r[:, None, None]
+        self.lat = np.radians(grid.lat)
+        self.lon = np.radians(grid.lon)
+        self.cos_lat = np.maximum(np.cos(self.lat), 1e-6)[None, :, None]
+
+    def d_dr(self, f):
+        return np.gradient(f, self.grid.r, axis=0)
+
+    def d_dlat(self, f):
+        return np.gradient(f, self.lat, axis=1)
+
+    def d_dlon(self, f):
+        if self.grid.periodic:
+            step = 2 * np.pi / self.lon.size
+            return (np.roll(f, -1, axis=2) - np.roll(f, 1, axis=2)) / (2 * step)
+        return np.gradient(f, self.lon, axis=2)
+
+
+def compute_derived_fields(grid, fields, names):
+    """Computes the requested derived variables from the native [r, lat, lon] arrays."""
+    d = SphericalDifferences(grid)
+    r, cos_lat = d.r, d.cos_lat
+    results = {}
+    if any("vx" in DERIVED_FIELDS[name] for name in names):
+        vx, vy, vz = fields["vx"], fields["vy"], fields["vz"]
+        ve, vn, vr = to_local_components(vx, vy, vz, grid)
+    for name in names:
+        if name == "velocity magnitude":
+            value = np.sqrt(vx ** 2 + vy ** 2 + vz ** 2)
+        elif name == "radial velocity":
+            value = vr
+        elif name == "tangential velocity":
+            value = np.hypot(ve, vn)
+        elif name == "divergence":
+            value = (d.d_dr(r ** 2 * vr) / r ** 2
+                     + d.d_dlat(vn * cos_lat) / (r * cos_lat)
+                     + d.d_dlon(ve) / (r * cos_lat))
+        elif name == "radial vorticity":
+            value = (d.d_dlon(vn) - d.d_dlat(ve * cos_lat)) / (r * cos_lat)
+        elif name == "vorticity magnitude":
+            radial = (d.d_dlon(vn) - d.d_dlat(ve * cos_lat)) / (r * cos_lat)
+            north = (d.d_dr(r * ve) - d.d_dlon(vr) / cos_lat) / r
+            east = (d.d_dlat(vr) - d.d_dr(r * vn)) / r
+            value = np.sqrt(radial ** 2 + north ** 2 + east ** 2)
+        elif name == "temperature gradient magnitude":
+            t = fields["temperature"]
+            value = np.sqrt(d.d_dr(t) ** 2 + (d.d_dlat(t) / r) ** 2 + (d.d_dlon(t) / (r * cos_lat)) ** 2)
+        elif name == "radial temperature gradient":
+            value = d.d_dr(fields["temperature"])
+        else:
+            raise KeyError(f"Unknown derived variable '{name}'")
+        results[name] = np.ascontiguousarray(value, dtype=np.float32)
+    return results
+
+
+def cache_path(file_path, name):
+    base = os.path.splitext(os.path.basename(file_path))[0]
+    return os.path.join(os.path.dirname(file_path), "derived", base, name.replace(" ", "_") + ".npy")
+
+
+def _cache_is_fresh(file_path, cached):
+    return os.path.exists(cached) and os.path.getmtime(cached) >= os.path.getmtime(file_path)
+
+
+def load_derived_fields(file_path, names):
+    """Derived variables of one file as [r, lat, lon] arrays, computing and caching the missing ones."""
+    results = {}
+    missing = []
+    for name in names:
+        cached = cache_path(file_path, name)
+        if _cache_is_fresh(file_path, cached):
+            results[name] = np.load(cached, mmap_mode="r")
+        else:
+            missing.append(name)
+    if missing:
+        inputs = sorted({variable for name in missing for variable in DERIVED_FIELDS[name]})
+        grid, fields = read_fields(file_path, inputs)
+        for name, value in compute_derived_fields(grid, fields, missing).items():
+            cached = cache_path(file_path, name)
+            os.makedirs(os.path.dirname(cached), exist_ok=True)
+            # write then rename, so a reader in another process never sees half a file
+            temporary = cached + f".{os.getpid()}.tmp.npy"
+            np.save(temporary, value)
+            os.replace(temporary, cached)
+            results[name] = value
+    return results
+
+
+def _precompute(job):
+    file_number, names = job
+    start = time.perf_counter()
+    load_derived_fields(data_path(file_number), names)
+    return file_number, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Precompute and cache derived variables')
+    parser.add_argument('start', type=int, help='First file number')
+    parser.add_argument('end', type=int, help='Last file number')
+    parser.add_argument('--variables', type=str, nargs='+', help='Derived variables to compute',
+                        default=list(DERIVED_FIELDS))
+    parser.add_argument('-w', '--workers', type=int, metavar='int', help='Number of processes', default=os.cpu_count())
+    args = parser.parse_args()
+
+    unknown = [name for name in args.variables if name not in DERIVED_FIELDS]
+    if unknown:
+        parser.error(f"Unknown derived variables {unknown}, expected some of {list(DERIVED_FIELDS)}")
+    jobs = [(n, args.variables) for n in range(args.start, args.end + 1)]
+    with Pool(args.workers) as pool:
+        for file_number, elapsed in pool.imap(_precompute, jobs):
+            print(f"Cached {len(args.variables)} derived variables for file {file_number:03d} in {elapsed:.2f}s")
@@ -0,0 +1,257 @@
+'''
+Runs a polydata-producing filter chain (threshold -> geometry -> smooth in
+mantle_anomoly.py) on longitude/latitude wedges of one timestep in
+parallel, and merges the pieces back into one seamless polydata.
+
+Every wedge carries `ghost` extra layers of cells on each side (wrapping
+around in longitude), so the thresholded surface and the smoothing see
+the same neighbourhood as in the full grid. The faces coming from ghost
+cells are dropped before merging, and vtkCleanPolyData then fuses the
+points the wedges share along their borders.
+
+The reader's grid repeats the first column of points (lon 0) as the last
+one (lon 360), as separate points, so cells on both sides of the seam do
+not share a face and vtkGeometryFilter turns the seam into two walls
+inside any anomaly that crosses it. A wedge that wraps around in longitude
+has no such break, so the filter chains merge coincident points with
+close_seam() before extracting the surface: then the serial run and the
+wedges give the same surface wherever it lies.
+
+Usage (serial vs. parallel surface, the anomaly rolled across the seam):
+    python domain_decomposition.py <file_number> -w 4 --roll 90
+'''
+
+import argparse
+import functools
+import time
+import numpy as np
+import mantle_vtk as vtk
+from multiprocessing import Pool
+from vtkmodules.util import numpy_support
+from mesh_transfer import pack_polydata, unpack_polydata
+
+GHOST_ARRAY = "wedge ghost"
+
+# set in each worker by _init_worker
+_points = None
+_cell_arrays = None
+_scalars = None
+_periodic = False
+
+
+def grid_arrays(data):
+    """Points as (nr+1, nlat+1, nlon+1, 3) and cell arrays as (nr, nlat, nlon) of the reader's structured grid."""
+    extent = data.GetExtent()
+    dims = (extent[5] - extent[4] + 1, extent[3] - extent[2] + 1, extent[1] - extent[0] + 1)
+    points = numpy_support.vtk_to_numpy(data.GetPoints().GetData()).reshape(dims + (3,))
+    cells = tuple(n - 1 for n in dims)
+    cell_arrays = {}
+    for i in range(data.GetCellData().GetNumberOfArrays()):
+        array = data.GetCellData().GetArray(i)
+        if array is not None and array.GetName():
+            values = numpy_support.vtk_to_numpy(array)
+            cell_arrays[array.GetName()] = values.reshape(cells + values.shape[1:])
+    return points, cell_arrays
+
+
+def is_periodic(points):
+    """True when the last column of points (in longitude) lands on the first one."""
+    return np.allclose(points[:, :, 0], points[:, :, -1], rtol=1e-6, atol=1e-3)
+
+
+def close_seam(cells, tolerance=1e-7):
+    """Unstructured grid with coincident points merged, so the cells on both sides of the longitude seam connect.
+
+    The pole points, coincident too, are merged as well; `tolerance` is a
+    fraction of the bounds' diagonal.
+    """
+    clean = vtk.vtkStaticCleanUnstructuredGrid()
+    clean.SetInputData(cells)
+    clean.ToleranceIsAbsoluteOff()
+    clean.SetTolerance(tolerance)
+    clean.RemoveUnusedPointsOff()
+    clean.Update()
+    return clean.GetOutput()
+
+
+def split_counts(workers):
+    """(latitude bands, longitude wedges): wedges only, then two latitude bands from 8 pieces on."""
+    n_lat = 2 if workers >= 8 and workers % 2 == 0 else 1
+    return n_lat, workers // n_lat
+
+
+def plan_wedges(shape, pieces):
+    """Owned (j0, j1, i0, i1) cell ranges of every piece for a (nr, nlat, nlon) grid."""
+    n_lat, n_lon = split_counts(pieces)
+    j_edges = np.linspace(0, shape[1], n_lat + 1).round().astype(int)
+    i_edges = np.linspace(0, shape[2], n_lon + 1).round().astype(int)
+    return [(int(j_edges[b]), int(j_edges[b + 1]), int(i_edges[w]), int(i_edges[w + 1]))
+            for b in range(n_lat) for w in range(n_lon)]
+
+
+def make_wedge(points, cell_arrays, scalars, j0, j1, i0, i1, ghost, periodic):
+    """vtkStructuredGrid of the cells [j0, j1) x [i0, i1) plus the ghost layers, flagged in GHOST_ARRAY."""
+    nlat, nlon = points.shape[1] - 1, points.shape[2] - 1
+    jj0, jj1 = max(j0 - ghost, 0), min(j1 + ghost, nlat)
+    if periodic:
+        ghost_lon = min(ghost, (nlon - (i1 - i0)) // 2)
+        ii = np.arange(i0 - ghost_lon, i1 + ghost_lon) % nlon
+    else:
+        ii = np.arange(max(i0 - ghost, 0), min(i1 + ghost, nlon))
+    # the point after the last cell; with a periodic grid column nlon is column 0 again
+    point_i = np.append(ii, ii[-1] + 1)
+
+    wedge_points = points[:, jj0:jj1 + 1][:, :, point_i]
+    grid = vtk.vtkStructuredGrid()
+    grid.SetDimensions(point_i.size, jj1 - jj0 + 1, points.shape[0])
+    vtk_points = vtk.vtkPoints()
+    vtk_points.SetData(numpy_support.numpy_to_vtk(np.ascontiguousarray(wedge_points.reshape(-1, 3)), deep=1))
+    grid.SetPoints(vtk_points)
+
+    for name, values in cell_arrays.items():
+        wedge_values = values[:, jj0:jj1][:, :, ii]
+        array = numpy_support.numpy_to_vtk(np.ascontiguousarray(wedge_values.reshape((-1,) + values.shape[3:])), deep=1)
+        array.SetName(name)
+        grid.GetCellData().AddArray(array)
+    if scalars is not None:
+        grid.GetCellData().SetActiveScalars(scalars)
+
+    j = np.arange(jj0, jj1)
+    owned = ((j >= j0) & (j < j1))[:, None] & np.isin(ii, np.arange(i0, i1))[None, :]
+    flags = np.broadcast_to(~owned, (points.shape[0] - 1,) + owned.shape).astype(np.uint8)
+    array = numpy_support.numpy_to_vtk(np.ascontiguousarray(flags.reshape(-1)), deep=1)
+    array.SetName(GHOST_ARRAY)
+    grid.GetCellData().AddArray(array)
+    return grid
+
+
+def drop_ghost_cells(polydata):
+    """Removes the cells that came from ghost cells, and the ghost flag array."""
+    threshold = vtk.vtkThreshold()
+    threshold.SetInputData(polydata)
+    threshold.SetInputArrayToProcess(0, 0, 0, vtk.vtkDataObject.FIELD_ASSOCIATION_CELLS, GHOST_ARRAY)
+    threshold.SetThresholdFunction(vtk.vtkThreshold.THRESHOLD_LOWER)
+    threshold.SetLowerThreshold(0.5)
+    geometry_filter = vtk.vtkGeometryFilter()
+    geometry_filter.SetInputConnection(threshold.GetOutputPort())
+    geometry_filter.Update()
+    owned = geometry_filter.GetOutput()
+    owned.GetCellData().RemoveArray(GHOST_ARRAY)
+    return owned
+
+
+def _init_worker(points, cell_arrays, scalars, periodic):
+    global _points, _cell_arrays, _scalars, _periodic
+    _points = points
+    _cell_arrays = cell_arrays
+    _scalars = scalars
+    _periodic = periodic
+
+
+def _run_wedge(job):
+    (j0, j1, i0, i1), ghost, filter_chain = job
+    start = time.perf_counter()
+    wedge = make_wedge(_points, _cell_arrays, _scalars, j0, j1, i0, i1, ghost, _periodic)
+    polydata = drop_ghost_cells(filter_chain(wedge))
+    return pack_polydata(polydata), time.perf_counter() - start
+
+
+def merge_pieces(pieces, tolerance=1e-6):
+    """Appends the wedge polydata and fuses the points they share along the wedge borders.
+
+    Smoothing moves a border point slightly differently in the two wedges
+    (the ghost layers only approximate the full neighbourhood), so points
+    closer than `tolerance` times the diagonal of the bounds are merged.
+    """
+    append = vtk.vtkAppendPolyData()
+    for piece in pieces:
+        append.AddInputData(piece)
+    append.Update()
+    x_min, x_max, y_min, y_max, z_min, z_max = append.GetOutput().GetBounds()
+    diagonal = np.linalg.norm([x_max - x_min, y_max - y_min, z_max - z_min])
+    clean = vtk.vtkCleanPolyData()
+    clean.SetInputConnection(append.GetOutputPort())
+    clean.PointMergingOn()
+    clean.ToleranceIsAbsoluteOn()
+    clean.SetAbsoluteTolerance(tolerance * diagonal)
+    clean.Update()
+    return clean.GetOutput()
+
+
+def parallel_filter(data, filter_chain, workers, ghost=8, pieces=None):
+    """Runs filter_chain(vtkStructuredGrid) -> vtkPolyData on wedges of `data` in a process pool.
+
+    filter_chain must be picklable (a module-level function or a
+    functools.partial of one). Returns the merged polydata and the time
+    spent in each wedge. The ghost layers should cover the reach of the
+    chain: with 40 smoothing iterations about 8 cells are enough for the
+    borders of neighbouring wedges to agree to within the merge tolerance.
+    """
+    points, cell_arrays = grid_arrays(data)
+    active = data.GetCellData().GetScalars()
+    scalars = active.GetName() if active is not None else None
+    wedges = plan_wedges(tuple(n - 1 for n in points.shape[:3]), pieces or workers)
+    jobs = [(wedge, ghost, filter_chain) for wedge in wedges]
+    with Pool(workers, initializer=_init_worker, initargs=(points, cell_arrays, scalars, is_periodic(points))) as pool:
+        results = pool.map(_run_wedge, jobs)
+    merged = merge_pieces([unpack_polydata(packed) for packed, _ in results])
+    return merged, [elapsed for _, elapsed in results]
+
+
+def boundary_edges(polydata):
+    """Number of boundary and non-manifold edges (0 for a closed surface)."""
+    edges = vtk.vtkFeatureEdges()
+    edges.SetInputData(polydata)
+    edges.BoundaryEdgesOn()
+    edges.NonManifoldEdgesOn()
+    edges.FeatureEdgesOff()
+    edges.ManifoldEdgesOff()
+    edges.Update()
+    return edges.GetOutput().GetNumberOfCells()
+
+
+def largest_point_distance(polydata, reference):
+    """Largest distance from a point of `polydata` to the closest point of `reference`."""
+    from scipy.spatial import cKDTree
+    points = numpy_support.vtk_to_numpy(polydata.GetPoints().GetData())
+    distances, _ = cKDTree(numpy_support.vtk_to_numpy(reference.GetPoints().GetData())).query(points)
+    return float(distances.max(initial=0.0))
+
+
+if __name__ == "__main__":
+    from mantle_anomoly import read_anomaly, scale_anomaly, anomaly_surface
+    from mantle_grid import data_path
+
+    parser = argparse.ArgumentParser(description='Compare the serial and the wedge-parallel anomaly surface')
+    parser.add_argument('file_number', type=int, help='File number')
+    parser.add_argument('-t', '--threshold', type=float, help='Threshold on the scaled anomaly', default=50)
+    parser.add_argument('-w', '--workers', type=int, metavar='int', help='Worker processes', default=4)
+    parser.add_argument('--pieces', type=int, metavar='int', help='Wedges (default: one per worker)', default=None)
+    parser.add_argument('--ghost', type=int, metavar='int', help='Ghost cell layers', default=8)
+    parser.add_argument('--roll', type=int, metavar='int',
+                        help='Roll the anomaly by this many cells in longitude (to move it across the seam)',
+                        default=0)
+    args = parser.parse_args()
+
+    selected_variable = "temperature anomaly"
+    data = read_anomaly(data_path(args.file_number), selected_variable)
+    if args.roll:
+        _, cell_arrays = grid_arrays(data)
+        values = cell_arrays[selected_variable]
+        values[...] = np.roll(values, args.roll, axis=2)
+    scale_anomaly(data, selected_variable, -200, 200)
+
+    chain = functools.partial(anomaly_surface, threshold_value=args.threshold)
+    start = time.perf_counter()
+    serial = chain(data)
+    print(f"serial:   {serial.GetNumberOfPoints()} points, {serial.GetNumberOfCells()} cells, "
+          f"{boundary_edges(serial)} open edges in {time.perf_counter() - start:.2f}s")
+    start = time.perf_counter()
+    parallel, _ = parallel_filter(data, chain, args.workers, args.ghost, args.pieces)
+    print(f"parallel: {parallel.GetNumberOfPoints()} points, {parallel.GetNumberOfCells()} cells, "
+          f"{boundary_edges(parallel)} open edges in {time.perf_counter() - start:.2f}s")
+    if parallel.GetNumberOfPoints() and serial.GetNumberOfPoints():
+        x_min, x_max, y_min, y_max, z_min, z_max = serial.GetBounds()
+        diagonal = np.linalg.norm([x_max - x_min, y_max - y_min, z_max - z_min])
+        distance = max(largest_point_distance(serial, parallel), largest_point_distance(parallel, serial))
+        print(f"largest distance between the surfaces' points {distance:.3g} ({distance / diagonal:.2g} of the diagonal)")
@@ -0,0 +1,220 @@
+'''
+Compact storage for scalar fields: optional 8/16-bit quantization against a
+fixed (run-wide) range, byte shuffling and lossless compression.
+
+With `bits` set, a value v is stored as round((v - vmin) / step) with
+step = (vmax - vmin) / (2**bits - 1), so the absolute error is at most
+step / 2 for values inside [vmin, vmax], plus float32 rounding (see
+max_error()). With bits=0 the float32 values are kept exactly. The bytes
+are then shuffled (all first bytes, then all second bytes, ...) and
+compressed with zlib, or zstd when the zstandard package is installed.
+
+A file holds one variable of one timestep plus the grid bounds, so
+read_encoded_fields() gives the same (grid, fields) as
+mantle_grid.read_fields() without opening the NetCDF file. decode() fills
+an existing float32 buffer in place: timestep_cache.py (encoded=True)
+caches the compressed files and mantle4.py --encoded decodes them straight
+into the cell array of its pipeline.
+
+Usage:
+    python field_codec.py <start_file_number> <end_file_number> --bits 16 --variables temperature "temperature anomaly"
+'''
+
+import argparse
+import functools
+import json
+import os
+import struct
+import zlib
+import numpy as np
+from vtkmodules.util import numpy_support
+from mantle_grid import data_path, read_fields, SphericalGrid
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MAGIC = b"MFC1"
+COMPRESSORS = ("zlib", "zstd", "none")
+
+
+def max_error(bits, vmin, vmax):
+    """Largest absolute error of a quantized value inside [vmin, vmax].
+
+    Half a quantization step, plus half a float32 spacing for rounding the
+    decoded value to float32.
+    """
+    if not bits:
+        return 0.0
+    rounding = 0.5 * float(np.spacing(np.float32(max(abs(vmin), abs(vmax)))))
+    return (vmax - vmin) / (2 * (2 ** bits - 1)) + rounding
+
+
+def _shuffle(raw, itemsize):
+    return np.frombuffer(raw, dtype=np.uint8).reshape(-1, itemsize).T.tobytes()
+
+
+def _unshuffle(raw, itemsize):
+    return np.frombuffer(raw, dtype=np.uint8).reshape(itemsize, -1).T.tobytes()
+
+
+def _compress(raw, compressor, level):
+    if compressor == "zlib":
+        return zlib.compress(raw, level)
+    if compressor == "zstd":
+        if zstandard is None:
+            raise ImportError("The zstandard package is needed for compressor='zstd'")
+        return zstandard.ZstdCompressor(level=level).compress(raw)
+    return raw
+
+
+def _decompress(payload, compressor):
+    if compressor == "zlib":
+        return zlib.decompress(payload)
+    if compressor == "zstd":
+        if zstandard is None:
+            raise ImportError("The zstandard package is needed to read zstd-compressed fields")
+        return zstandard.ZstdDecompressor().decompress(payload)
+    return payload
+
+
+def encode(values, bits=16, vmin=None, vmax=None, compressor="zlib", level=1, grid=None):
+    """Encodes a scalar field into bytes; vmin/vmax default to the range of `values`."""
+    values = np.asarray(values)
+    header = {"shape": list(values.shape), "bits": bits, "compressor": compressor}
+    if grid is not None:
+        header["bounds"] = [grid.r_bounds.tolist(), grid.lat_bounds.tolist(), grid.lon_bounds.tolist()]
+    if bits:
+        if bits not in (8, 16):
+            raise ValueError(f"bits must be 0 (lossless), 8 or 16, got {bits}")
+        vmin = float(np.nanmin(values)) if vmin is None else float(vmin)
+        vmax = float(np.nanmax(values)) if vmax is None else float(vmax)
+        levels = 2 ** bits - 1
+        step = (vmax - vmin) / levels if vmax > vmin else 1.0
+        dtype = np.uint8 if bits == 8 else np.uint16
+        stored = np.rint(np.clip((values.astype(np.float64) - vmin) / step, 0, levels)).astype(dtype)
+        header.update(vmin=vmin, vmax=vmax, step=step, max_error=max_error(bits, vmin, vmax))
+    else:
+        stored = np.ascontiguousarray(values, dtype=np.float32)
+    raw = _shuffle(stored.tobytes(), stored.itemsize)
+    header_bytes = json.dumps(header).encode()
+    return MAGIC + struct.pack("<I", len(header_bytes)) + header_bytes + _compress(raw, compressor, level)
+
+
+@functools.lru_cache(maxsize=32)
+def _levels(bits, vmin, step):
+    """Decoded value of every quantization level, computed in float64 and rounded once to float32."""
+    levels = (vmin + step * np.arange(2 ** bits)).astype(np.float32)
+    levels.setflags(write=False)
+    return levels
+
+
+def read_header(blob):
+    if bytes(blob[:4]) != MAGIC:
+        raise ValueError("Not an encoded field (bad magic)")
+    (length,) = struct.unpack("<I", bytes(blob[4:8]))
+    return json.loads(bytes(blob[8:8 + length])), 8 + length
+
+
+def decode(blob, out=None):
+    """Decodes a field (bytes or a uint8 array) into a float32 array, reusing `out` (same size, float32) when given."""
+    header, offset = read_header(blob)
+    bits = header["bits"]
+    itemsize = {0: 4, 8: 1, 16: 2}[bits]
+    raw = _unshuffle(_decompress(blob[offset:], header["compressor"]), itemsize)
+    shape = tuple(header["shape"])
+    if out is None:
+        out = np.empty(shape, dtype=np.float32)
+    elif out.dtype != np.float32 or out.size != int(np.prod(shape)):
+        raise ValueError(f"Output buffer must be float32 with {int(np.prod(shape))} values")
+    out = out.reshape(shape)
+    if bits:
+        stored = np.frombuffer(raw, dtype=np.uint8 if bits == 8 else np.uint16).reshape(shape)
+        np.take(_levels(bits, header["vmin"], header["step"]), stored, out=out)
+    else:
+        out[...] = np.frombuffer(raw, dtype=np.float32).reshape(shape)
+    return out
+
+
+def encoded_path(file_path, variable):
+    base = os.path.splitext(os.path.basename(file_path))[0]
+    return os.path.join(os.path.dirname(file_path), "encoded", base, variable.replace(" ", "_") + ".mfc")
+
+
+def read_encoded(file_path, variable):
+    """The encoded file of a variable as a uint8 array (what timestep_cache.py caches)."""
+    with open(encoded_path(file_path, variable), "rb") as encoded:
+        return np.frombuffer(encoded.read(), dtype=np.uint8)
+
+
+def read_encoded_fields(file_path, variables, out=None):
+    """Same (grid, fields) as mantle_grid.read_fields, from the encoded files of a timestep.
+
+    `out` maps variable names to float32 buffers that are refilled in place.
+    """
+    out = out or {}
+    grid = None
+    fields = {}
+    for name in variables:
+        with open(encoded_path(file_path, name), "rb") as encoded:
+            blob = encoded.read()
+        if grid is None:
+            header, _ = read_header(blob)
+            if "bounds" not in header:
+                raise ValueError(f"{encoded_path(file_path, name)} was written without the grid bounds")
+            grid = SphericalGrid(*header["bounds"])
+        fields[name] = decode(blob, out.get(name))
+    return grid, fields
+
+
+def decode_to_vtk(file_path, variable, out=None):
+    """Decodes a variable into a float32 vtkDataArray usable as a cell array (ordered like the reader's).
+
+    The VTK array shares the numpy buffer; pass the same `out` again to
+    refill it in place for the next timestep.
+    """
+    with open(encoded_path(file_path, variable), "rb") as encoded:
+        values = decode(encoded.read(), out)
+    array = numpy_support.numpy_to_vtk(values.reshape(-1), deep=0)
+    array.SetName(variable)
+    return array, values
+
+
+def global_ranges(file_numbers, variables):
+    """Min and max of each variable over all the files (the quantization range of the run)."""
+    ranges = {name: [np.inf, -np.inf] for name in variables}
+    for file_number in file_numbers:
+        _, fields = read_fields(data_path(file_number), variables)
+        for name, values in fields.items():
+            ranges[name][0] = min(ranges[name][0], float(np.nanmin(values)))
+            ranges[name][1] = max(ranges[name][1], float(np.nanmax(values)))
+    return ranges
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Encode mantle variables with bounded-error quantization and compression')
+    parser.add_argument('start', type=int, help='First file number')
+    parser.add_argument('end', type=int, help='Last file number')
+    parser.add_argument('--variables', type=str, nargs='+', help='Variables to encode',
+                        default=['temperature', 'temperature anomaly'])
+    parser.add_argument('--bits', type=int, choices=[0, 8, 16], help='Quantization bits (0 = lossless)', default=16)
+    parser.add_argument('--compressor', type=str, choices=COMPRESSORS, help='Lossless compressor', default='zlib')
+    parser.add_argument('--level', type=int, metavar='int', help='Compression level', default=1)
+    args = parser.parse_args()
+
+    file_numbers = range(args.start, args.end + 1)
+    ranges = global_ranges(file_numbers, args.variables) if args.bits else {}
+    for name, (vmin, vmax) in ranges.items():
+        print(f"{name}: range {vmin:g} - {vmax:g}, max error {max_error(args.bits, vmin, vmax):.4g}")
+    for file_number in file_numbers:
+        file_path = data_path(file_number)
+        grid, fields = read_fields(file_path, args.variables)
+        for name, values in fields.items():
+            vmin, vmax = ranges.get(name, (None, None))
+            blob = encode(values, args.bits, vmin, vmax, args.compressor, args.level, grid)
+            output = encoded_path(file_path, name)
+            os.makedirs(os.path.dirname(output), exist_ok=True)
+            with open(output, "wb") as encoded:
+                encoded.write(blob)
+            print(f"File {file_number:03d} {name}: {values.size * 4 / len(blob):.1f}x smaller than float32")
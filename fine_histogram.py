@@ -0,0 +1,101 @@
+'''
+Histogram of a variable that can be re-binned for any clip window and bin
+count without touching the cell data again.
+
+The finest level of the histogram is every distinct value with its count,
+stored with the prefix sums of the counts. A query looks up the window and
+the bin edges in the sorted values (O(bins log n)) and gives exactly what
+np.histogram(data[(data > clip_min) & (data < clip_max)], bins) gives.
+Histograms are cached per file in mantle_data/histograms/.
+
+Usage:
+    python fine_histogram.py <start_file_number> <end_file_number> --variables temperature
+'''
+
+import argparse
+import os
+import time
+import numpy as np
+from mantle_grid import data_path, read_timestep, cell_array
+
+
+class FineHistogram:
+    """Distinct values of a variable (sorted) and the cumulative count up to each of them."""
+
+    def __init__(self, values, cumulative):
+        self.values = values
+        # cumulative[i] = number of cells with a value below values[i]
+        self.cumulative = cumulative
+
+    @classmethod
+    def from_data(cls, data):
+        values, counts = np.unique(np.asarray(data, dtype=np.float64), return_counts=True)
+        return cls(values, np.concatenate([[0], np.cumsum(counts)]))
+
+    @property
+    def total(self):
+        return int(self.cumulative[-1])
+
+    def save(self, file_name):
+        np.savez(file_name, values=self.values, cumulative=self.cumulative)
+
+    @classmethod
+    def load(cls, file_name):
+        data = np.load(file_name)
+        return cls(data["values"], data["cumulative"])
+
+    def window(self, clip_min, clip_max):
+        """Index range of the values strictly between clip_min and clip_max."""
+        lo = np.searchsorted(self.values, clip_min, side="right")
+        hi = np.searchsorted(self.values, clip_max, side="left")
+        return lo, max(lo, hi)
+
+    def histogram(self, clip_min, clip_max, bins):
+        """Counts and edges of the values strictly inside the window, like np.histogram of the clipped data."""
+        lo, hi = self.window(clip_min, clip_max)
+        if lo == hi:
+            return np.zeros(bins, dtype=np.int64), np.linspace(0.0, 1.0, bins + 1)
+        first, last = self.values[lo], self.values[hi - 1]
+        if first == last:
+            first, last = first - 0.5, last + 0.5
+        edges = np.linspace(first, last, bins + 1)
+        # bins are [edge, next edge), except the last one which includes its right edge
+        index = np.searchsorted(self.values[lo:hi], edges, side="left") + lo
+        index[-1] = hi
+        cumulative = self.cumulative[index]
+        return np.diff(cumulative), edges
+
+
+def cache_path(file_path, variable):
+    base = os.path.splitext(os.path.basename(file_path))[0]
+    return os.path.join(os.path.dirname(file_path), "histograms", f"{base}_{variable.replace(' ', '_')}.npz")
+
+
+def load_fine_histogram(file_path, variable):
+    """Fine histogram of one variable of a file, built and cached on first use."""
+    cached = cache_path(file_path, variable)
+    if os.path.exists(cached) and os.path.getmtime(cached) >= os.path.getmtime(file_path):
+        return FineHistogram.load(cached)
+    data = read_timestep(file_path, [variable])
+    histogram = FineHistogram.from_data(cell_array(data, variable))
+    os.makedirs(os.path.dirname(cached), exist_ok=True)
+    # write then rename, so a reader in another process never sees half a file
+    temporary = cached + f".{os.getpid()}.tmp.npz"
+    histogram.save(temporary)
+    os.replace(temporary, cached)
+    return histogram
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Precompute the fine histograms used by analysis2.py')
+    parser.add_argument('start', type=int, help='First file number')
+    parser.add_argument('end', type=int, help='Last file number')
+    parser.add_argument('--variables', type=str, nargs='+', help='Variables', default=['temperature'])
+    args = parser.parse_args()
+
+    for file_number in range(args.start, args.end + 1):
+        for variable in args.variables:
+            start = time.perf_counter()
+            histogram = load_fine_histogram(data_path(file_number), variable)
+            print(f"File {file_number:03d} {variable}: {histogram.values.size} distinct values "
+                  f"out of {histogram.total} cells ({time.perf_counter() - start:.2f}s)")
@@ -0,0 +1,157 @@
+'''
+Asynchronous frame output: the render thread only copies the framebuffer
+into a reusable buffer, and a pool of threads encodes and writes it.
+
+PNG is encoded with zlib, which releases the GIL, so several frames
+compress in parallel; JPEG goes through vtkJPEGWriter and "raw" writes the
+RGB pixels as a .npy file. The number of buffers bounds the frames in
+flight: when they are all taken, submit() waits for one (backpressure) or,
+with drop=True, skips the frame.
+
+    with FrameWriter(workers=4, compression=1) as writer:
+        for ...:
+            render_window.Render()
+            writer.submit(render_window, file_name)
+'''
+
+import queue
+import struct
+import threading
+import time
+import zlib
+import numpy as np
+import mantle_vtk as vtk
+from concurrent.futures import ThreadPoolExecutor
+from vtkmodules.util import numpy_support
+
+FORMATS = ("png", "jpeg", "raw")
+
+
+def _png_chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+
+def encode_png(rgb, level=6):
+    """PNG bytes of an (h, w, 3) uint8 image stored top row first."""
+    h, w, channels = rgb.shape
+    rows = rgb.reshape(h, w * channels)
+    # "up" filter: each row minus the row above, which suits smooth renders
+    filtered = np.empty((h, w * channels + 1), dtype=np.uint8)
+    filtered[:, 0] = 2
+    filtered[0, 1:] = rows[0]
+    np.subtract(rows[1:], rows[:-1], out=filtered[1:, 1:])
+    color_type = 6 if channels == 4 else 2
+    header = struct.pack(">IIBBBBB", w, h, 8, color_type, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + _png_chunk(b"IHDR", header)
+            + _png_chunk(b"IDAT", zlib.compress(filtered.tobytes(), level)) + _png_chunk(b"IEND", b""))
+
+
+def write_jpeg(rgb, file_name, quality=90):
+    """Writes an (h, w, 3) uint8 image (top row first) with vtkJPEGWriter."""
+    h, w, channels = rgb.shape
+    image = vtk.vtkImageData()
+    image.SetDimensions(w, h, 1)
+    array = numpy_support.numpy_to_vtk(rgb[::-1].reshape(-1, channels), deep=1)
+    image.GetPointData().SetScalars(array)
+    writer = vtk.vtkJPEGWriter()
+    writer.SetQuality(quality)
+    writer.SetFileName(file_name)
+    writer.SetInputData(image)
+    writer.Write()
+
+
+class FrameWriter:
+    """Pool of encoder threads fed with copies of the framebuffer."""
+
+    def __init__(self, workers=2, buffers=None, file_format="png", compression=6, quality=90, drop=False):
+        if file_format not in FORMATS:
+            raise ValueError(f"Unknown format '{file_format}', expected one of {FORMATS}")
+        self.file_format = file_format
+        self.compression = compression
+        self.quality = quality
+        self.drop = drop
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="frame_writer")
+        self.free = queue.Queue()
+        for _ in range(buffers or 2 * workers):
+            self.free.put(None)  # allocated on first use, at the window size
+        self.window_to_image_filter = vtk.vtkWindowToImageFilter()
+        self.window_to_image_filter.SetInputBufferTypeToRGB()
+        self.window_to_image_filter.ReadFrontBufferOff()
+        self.lock = threading.Lock()
+        self.errors = []
+        self.written = 0
+        self.dropped = 0
+        self.wait_time = 0.0
+
+    def _take_buffer(self, shape):
+        start = time.perf_counter()
+        try:
+            buffer = self.free.get(block=not self.drop)
+        except queue.Empty:
+            return None
+        self.wait_time += time.perf_counter() - start
+        if buffer is None or buffer.shape != shape:
+            buffer = np.empty(shape, dtype=np.uint8)
+        return buffer
+
+    def submit(self, render_window, file_name):
+        """Copies the current frame of the window and queues it; returns False if it was dropped."""
+        self.window_to_image_filter.SetInput(render_window)
+        self.window_to_image_filter.Modified()
+        self.window_to_image_filter.Update()
+        image = self.window_to_image_filter.GetOutput()
+        w, h, _ = image.GetDimensions()
+        pixels = numpy_support.vtk_to_numpy(image.GetPointData().GetScalars())
+        buffer = self._take_buffer((h, w, pixels.shape[1]))
+        if buffer is None:
+            self.dropped += 1
+            return False
+        # VTK images start at the bottom row
+        np.copyto(buffer, pixels.reshape(h, w, -1)[::-1])
+        self.executor.submit(self._write, buffer, file_name)
+        return True
+
+    def submit_array(self, rgb, file_name):
+        """Queues an (h, w, 3) uint8 image that is already in memory (top row first)."""
+        buffer = self._take_buffer(rgb.shape)
+        if buffer is None:
+            self.dropped += 1
+            return False
+        np.copyto(buffer, rgb)
+        self.executor.submit(self._write, buffer, file_name)
+        return True
+
+    def _write(self, buffer, file_name):
+        try:
+            if self.file_format == "png":
+                data = encode_png(buffer, self.compression)
+                with open(file_name, "wb") as output:
+                    output.write(data)
+            elif self.file_format == "jpeg":
+                write_jpeg(buffer, file_name, self.quality)
+            else:
+                np.save(file_name, buffer)
+            with self.lock:
+                self.written += 1
+        except Exception as error:
+            with self.lock:
+                self.errors.append((file_name, error))
+        finally:
+            self.free.put(buffer)
+
+    def close(self):
+        """Waits for the queued frames; raises the first write error, if any."""
+        self.executor.shutdown(wait=True)
+        if self.errors:
+            file_name, error = self.errors[0]
+            raise IOError(f"Could not write {file_name} ({len(self.errors)} failed frames)") from error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def extension(self):
+        return {"png": ".png", "jpeg": ".jpg", "raw": ".npy"}[self.file_format]
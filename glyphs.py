@@ -0,0 +1,233 @@
+'''
+Velocity glyphs with a fixed budget.
+
+Instead of one arrow per point (paraview/mantle_glypths.pvsm), a fixed
+number of glyph positions is picked: the sphere is cut into equal-area
+strata, each stratum gets a share of the budget proportional to its total
+importance (velocity magnitude or |temperature anomaly|), and cells are drawn
+inside each stratum with probability proportional to their importance. The
+arrows are drawn by vtkGlyph3DMapper, which instances one arrow instead of
+building geometry per glyph, so the frame cost follows the budget, not the
+mesh size.
+
+Usage:
+    python glyphs.py <file_number> --budget 5000 --depth 660
+    python glyphs.py <file_number> --budget 20000 --importance anomaly --volume
+'''
+
+import argparse
+import os
+import time
+import mantle_vtk as vtk
+import numpy as np
+from vtkmodules.util import numpy_support
+from mantle_grid import data_path, read_fields, to_cartesian
+from mantle_colors import make_color_transfer_function, stops_for_variable
+
+GLYPH_VARIABLES = ["temperature", "temperature anomaly", "vx", "vy", "vz"]
+
+
+def equal_area_strata(grid, bands):
+    """Stratum id of every (lat, lon) column: latitude bands split in lon bins of about equal area."""
+    band = np.minimum(((grid.lat + 90.0) / 180.0 * bands).astype(int), bands - 1)
+    # fewer longitude bins towards the poles, in proportion to the band's area
+    band_center = -90.0 + (np.arange(bands) + 0.5) * 180.0 / bands
+    lon_bins = np.maximum(1, np.rint(2 * bands * np.cos(np.radians(band_center))).astype(int))
+    first = np.concatenate([[0], np.cumsum(lon_bins)[:-1]])
+    lon0 = min(grid.lon_bounds[0], grid.lon_bounds[-1])
+    lon_fraction = np.mod(grid.lon - lon0, 360.0) / 360.0
+    b = band[:, None]
+    column = np.minimum((lon_fraction[None, :] * lon_bins[b]).astype(int), lon_bins[b] - 1)
+    return first[b] + column
+
+
+def stratified_sample(importance, strata, budget, seed=0):
+    """Picks up to `budget` cells, spreading them over the strata by importance.
+
+    importance and strata are flat arrays over the candidate cells. Each
+    stratum gets a quota proportional to its summed importance (largest
+    remainders round up, and what a stratum cannot take goes to the
+    heaviest strata with room), and the cells inside a stratum are chosen by
+    weighted sampling without replacement (Efraimidis-Spirakis keys), all
+    vectorized.
+    """
+    importance = np.maximum(np.asarray(importance, dtype=np.float64), 0.0)
+    n_strata = int(strata.max()) + 1
+    weight = np.bincount(strata, weights=importance, minlength=n_strata)
+    size = np.bincount(strata, minlength=n_strata)
+    if weight.sum() <= 0:
+        weight = size.astype(np.float64)
+        importance = np.ones_like(importance)
+    budget = min(budget, int(np.count_nonzero(importance > 0)))
+
+    share = budget * weight / weight.sum()
+    quota = np.floor(share).astype(int)
+    leftover = budget - quota.sum()
+    if leftover > 0:
+        quota[np.argsort(quota - share)[:leftover]] += 1
+    capacity = np.bincount(strata, weights=importance > 0, minlength=n_strata).astype(int)
+    quota = np.minimum(quota, capacity)
+    # strata with fewer usable cells than their share hand the rest to the heaviest ones with room
+    missing = budget - quota.sum()
+    for s in np.argsort(-weight):
+        if missing <= 0:
+            break
+        extra = min(capacity[s] - quota[s], missing)
+        quota[s] += extra
+        missing -= extra
+
+    rng = np.random.default_rng(seed)
+    with np.errstate(divide="ignore"):
+        key = np.where(importance > 0, np.log(rng.random(importance.size)) / importance, -np.inf)
+    # sort by stratum, then by decreasing key, and keep the first `quota` of each stratum
+    order = np.lexsort((-key, strata))
+    sorted_strata = strata[order]
+    rank = np.arange(order.size) - np.searchsorted(sorted_strata, sorted_strata, side="left")
+    return order[rank < quota[sorted_strata]]
+
+
+def candidate_cells(grid, depth=None, cutaway=False):
+    """Flat ids of the cells glyphs may be placed on: one shell, or the volume minus the cutaway octant."""
+    if depth is not None:
+        k = int(grid.depth_index(depth))
+        if k < 0:
+            raise ValueError(f"Depth {depth} is outside the mantle")
+        return np.arange(k * grid.shape[1] * grid.shape[2], (k + 1) * grid.shape[1] * grid.shape[2])
+    cells = np.arange(grid.number_of_cells)
+    if cutaway:
+        # same octant mantle.py clips away with its vtkBox
+        k, j, i = np.unravel_index(cells, grid.shape)
+        centers = to_cartesian(grid.r[k], grid.lat[j], grid.lon[i])
+        cells = cells[~np.all(centers >= 0, axis=1)]
+    return cells
+
+
+def select_glyphs(grid, fields, budget, importance="velocity", depth=None, cutaway=False, bands=24, seed=0):
+    """Flat cell ids of the glyph positions."""
+    velocity = np.stack([fields["vx"], fields["vy"], fields["vz"]], axis=-1).reshape(-1, 3)
+    cells = candidate_cells(grid, depth, cutaway)
+    if importance == "velocity":
+        score = np.linalg.norm(velocity[cells], axis=1)
+    else:
+        score = np.abs(fields["temperature anomaly"].reshape(-1)[cells])
+    k, j, i = np.unravel_index(cells, grid.shape)
+    columns = equal_area_strata(grid, bands)
+    # in volume mode every radial layer is its own set of strata
+    strata = columns[j, i] + (k if depth is None else 0) * (int(columns.max()) + 1)
+    _, strata = np.unique(strata, return_inverse=True)
+    return cells[stratified_sample(score, strata, budget, seed)]
+
+
+def make_glyph_points(grid, fields, cells):
+    """vtkPolyData of the glyph positions with velocity and the color variables on the points."""
+    k, j, i = np.unravel_index(cells, grid.shape)
+    polydata = vtk.vtkPolyData()
+    points = vtk.vtkPoints()
+    points.SetData(numpy_support.numpy_to_vtk(to_cartesian(grid.r[k], grid.lat[j], grid.lon[i]), deep=1))
+    polydata.SetPoints(points)
+    velocity = np.stack([fields["vx"], fields["vy"], fields["vz"]], axis=-1).reshape(-1, 3)[cells]
+    for name, values in (("velocity", velocity),
+                         ("temperature", fields["temperature"].reshape(-1)[cells]),
+                         ("temperature anomaly", fields["temperature anomaly"].reshape(-1)[cells])):
+        array = numpy_support.numpy_to_vtk(np.ascontiguousarray(values, dtype=np.float32), deep=1)
+        array.SetName(name)
+        polydata.GetPointData().AddArray(array)
+    return polydata
+
+
+def make_glyph_actor(polydata, color_variable, vmin, vmax, length):
+    """Instanced arrows oriented and scaled by velocity."""
+    arrow = vtk.vtkArrowSource()
+    arrow.SetTipResolution(8)
+    arrow.SetShaftResolution(8)
+
+    velocity = numpy_support.vtk_to_numpy(polydata.GetPointData().GetArray("velocity"))
+    max_speed = float(np.linalg.norm(velocity, axis=1).max()) if len(velocity) else 1.0
+
+    lut = make_color_transfer_function(stops_for_variable(color_variable), vmin, vmax)
+    mapper = vtk.vtkGlyph3DMapper()
+    mapper.SetInputData(polydata)
+    mapper.SetSourceConnection(arrow.GetOutputPort())
+    mapper.SetOrientationArray("velocity")
+    mapper.SetOrientationModeToDirection()
+    mapper.SetScaleArray("velocity")
+    mapper.SetScaleModeToScaleByMagnitude()
+    mapper.SetScaleFactor(length / max_speed if max_speed > 0 else length)
+    mapper.SetScalarModeToUsePointFieldData()
+    mapper.SelectColorArray(color_variable)
+    mapper.SetScalarRange(vmin, vmax)
+    mapper.SetLookupTable(lut)
+
+    actor = vtk.vtkActor()
+    actor.SetMapper(mapper)
+    return actor, lut
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Budgeted, instanced velocity glyphs')
+    parser.add_argument('file_number', type=int, help='File number')
+    parser.add_argument('--budget', type=int, metavar='int', help='Number of glyphs', default=5000)
+    parser.add_argument('--importance', type=str, choices=['velocity', 'anomaly'], help='Sampling importance', default='velocity')
+    parser.add_argument('--depth', type=float, help='Depth (km) of the shell to place glyphs on', default=660.0)
+    parser.add_argument('--volume', action='store_true', help='Place glyphs in the whole volume (mantle.py cutaway) instead of one shell')
+    parser.add_argument('--color', type=str, help='Variable used for the colors', default='temperature')
+    parser.add_argument('-r', '--resolution', type=int, metavar='int', nargs=2, help='Image resolution', default=[1600, 1200])
+    parser.add_argument('-o', '--output', type=str, metavar='dirname', help='Output directory', default='output_images')
+    args = parser.parse_args()
+
+    grid, fields = read_fields(data_path(args.file_number), GLYPH_VARIABLES)
+
+    start = time.perf_counter()
+    depth = None if args.volume else args.depth
+    cells = select_glyphs(grid, fields, args.budget, args.importance, depth, cutaway=args.volume)
+    polydata = make_glyph_points(grid, fields, cells)
+    print(f"Selected {len(cells)} glyphs out of {grid.number_of_cells} cells in {time.perf_counter() - start:.3f}s")
+
+    if "anomaly" in args.color:
+        vmin, vmax = -200, 200
+    else:
+        vmin, vmax = float(fields[args.color].min()), float(fields[args.color].max())
+    # arrows about as long as the spacing between glyphs
+    area = 4 * np.pi * (grid.outer_radius if args.volume else grid.r[grid.depth_index(args.depth)]) ** 2
+    actor, lut = make_glyph_actor(polydata, args.color, vmin, vmax, 1.5 * np.sqrt(area / max(len(cells), 1)))
+    transform = vtk.vtkTransform()
+    transform.RotateX(25)
+    transform.RotateY(-45)
+    actor.SetUserTransform(transform)
+
+    renderer = vtk.vtkRenderer()
+    renderer.AddActor(actor)
+    scalar_bar = vtk.vtkScalarBarActor()
+    scalar_bar.SetLookupTable(lut)
+    scalar_bar.SetTitle(args.color)
+    scalar_bar.SetNumberOfLabels(5)
+    renderer.AddViewProp(scalar_bar)
+    renderer.SetBackground(0.1, 0.2, 0.4)
+
+    render_window = vtk.vtkRenderWindow()
+    render_window.SetOffScreenRendering(1)
+    render_window.AddRenderer(renderer)
+    render_window.SetSize(args.resolution[0], args.resolution[1])
+    renderer.ResetCamera()
+    renderer.GetActiveCamera().Zoom(1.5)
+
+    start = time.perf_counter()
+    render_window.Render()
+    print(f"First frame (includes upload) {time.perf_counter() - start:.3f}s")
+    start = time.perf_counter()
+    render_window.Render()
+    print(f"Frame time {time.perf_counter() - start:.3f}s for {len(cells)} glyphs")
+
+    window_to_image_filter = vtk.vtkWindowToImageFilter()
+    window_to_image_filter.SetInput(render_window)
+    window_to_image_filter.SetInputBufferTypeToRGB()
+    window_to_image_filter.ReadFrontBufferOff()
+    window_to_image_filter.Update()
+
+    os.makedirs(args.output, exist_ok=True)
+    file_name = os.path.join(args.output, f"mantle_glyphs{args.file_number:03d}.png")
+    writer = vtk.vtkPNGWriter()
+    writer.SetFileName(file_name)
+    writer.SetInputConnection(window_to_image_filter.GetOutputPort())
+    writer.Write()
+    print(f"Saved current screen to '{file_name}'")
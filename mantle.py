@@ -1,9 +1,13 @@
-import vtk
-import matplotlib.cm as cm
-import matplotlib
-import sys
-
-file_number = int(sys.argv[1])
+import argparse
+import time
+import mantle_vtk as vtk
+from decimate import decimation_options, decimate_surface, pixel_size, print_decimation
+
+parser = argparse.ArgumentParser(description='Render the temperature with an octant clipped out')
+parser.add_argument('file_number', type=int, help='File number')
+decimation_options(parser)
+args = parser.parse_args()
+file_number = args.file_number
 # File path to your NetCDF file
 file_path = f"mantle_data/spherical{file_number:03d}.nc"
 
@@ -62,7 +66,20 @@ else:
 
         # Get the clipped output data
         clipped_data = clip_filter.GetOutput()
-        
+
+        if args.budget is not None or args.pixels is not None:
+            # Only the outer surface of the clipped grid is drawn, so decimate that
+            geometry_filter = vtk.vtkGeometryFilter()
+            geometry_filter.SetInputData(clipped_data)
+            geometry_filter.Update()
+            start = time.perf_counter()
+            # the camera below: ResetCamera + Zoom(2.5) in an 800 x 600 window
+            max_error = args.pixels * pixel_size(clipped_data.GetBounds(), 600, zoom=2.5) if args.pixels else None
+            clipped_data, counts = decimate_surface(geometry_filter.GetOutput(), selected_variable, args.budget,
+                                                    max_error, args.decimate_workers,
+                                                    ranges={selected_variable: (min_temp, max_temp)})
+            print_decimation(counts, time.perf_counter() - start)
+
         # Step 6: Set up the mapper and actor
         mapper = vtk.vtkDataSetMapper()
         mapper.SetInputData(clipped_data)
@@ -92,7 +109,7 @@ else:
         scalar_bar.SetLookupTable(lut)
         scalar_bar.SetTitle("Temperature (K)")
         scalar_bar.SetNumberOfLabels(5)
-        renderer.AddActor2D(scalar_bar)
+        renderer.AddViewProp(scalar_bar)
 
         renderer.SetBackground(0.1, 0.2, 0.4)  # Background color
         render_window.SetSize(800, 600)
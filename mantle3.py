@@ -1,4 +1,4 @@
-import vtk
+import mantle_vtk as vtk
 import sys
 
 # File path to your NetCDF file
@@ -8,15 +8,23 @@
 from PyQt6.QtWidgets import QApplication, QWidget, QMainWindow, QSlider, QGridLayout, QLabel, QPushButton, QTextEdit
 import PyQt6.QtCore as QtCore
 from PyQt6.QtCore import Qt
-import vtk
-from vtk.qt.QVTKRenderWindowInteractor import QVTKRenderWindowInteractor
+import mantle_vtk as vtk
+from vtkmodules.qt.QVTKRenderWindowInteractor import QVTKRenderWindowInteractor
 import argparse
 import sys
 from vtk_camera import save_camera, load_camera
+from frame_writer import FrameWriter, FORMATS
+from timestep_cache import TimestepLoader
+from vtkmodules.util import numpy_support
+import glob
 import os
 import numpy as np
 
+# QVTKRenderWindowInteractor creates its own vtkRenderWindow, so the OpenGL backend has to be there first
+vtk.load_rendering_backends()
+
 frame_counter = 0
+frame_writer = None
 
 def make_isocontour(input_fle, left, right):
     # Step 1: Create a reader for NetCDF CF files
@@ -76,8 +84,10 @@ def make_isocontour(input_fle, left, right):
             
             # Combine both thresholded outputs
             combine_threshold = vtk.vtkAppendFilter()
-            combine_threshold.AddInputData(lower_threshold.GetOutput())
-            combine_threshold.AddInputData(upper_threshold.GetOutput())
+            # connected (not copied) so that swapping the cell array of data
+            # for another timestep re-runs the thresholds
+            combine_threshold.AddInputConnection(lower_threshold.GetOutputPort())
+            combine_threshold.AddInputConnection(upper_threshold.GetOutputPort())
             combine_threshold.Update()
             
             volumeMapper = vtk.vtkUnstructuredGridVolumeRayCastMapper()
@@ -94,7 +104,7 @@ def make_isocontour(input_fle, left, right):
             colorbar.SetNumberOfLabels(5)
             colorbar.SetLabelFormat("%4.2f")
             
-            return [volume, colorbar, volume_property, min_temp, max_temp]
+            return [volume, colorbar, volume_property, min_temp, max_temp, data]
             
 
             
@@ -105,19 +115,18 @@ def save_frame(window, log):
     global frame_counter
     global args
     # ---------------------------------------------------------------
-    # Save current contents of render window to PNG file
+    # Save current contents of render window to an image file. The
+    # frame is copied here and encoded by frame_writer's threads, so
+    # the UI does not wait for the compression.
     # ---------------------------------------------------------------
-    file_name = args.output + str(frame_counter).zfill(5) + ".png"
-    image = vtk.vtkWindowToImageFilter()
-    image.SetInput(window)
-    png_writer = vtk.vtkPNGWriter()
-    png_writer.SetInputConnection(image.GetOutputPort())
-    png_writer.SetFileName(file_name)
+    file_name = args.output + str(frame_counter).zfill(5) + frame_writer.extension
     window.Render()
-    png_writer.Write()
+    if not frame_writer.submit(window, file_name):
+        log.insertPlainText('Skipped {} (writer busy)\n'.format(file_name))
+        return
     frame_counter += 1
     if args.verbose:
-        print(file_name + " has been successfully exported")
+        print(file_name + " has been queued for export")
     log.insertPlainText('Exported {}\n'.format(file_name))
 
 def print_camera_settings(camera, text_window, log, ren):
@@ -150,6 +159,7 @@ class Ui_MainWindow(object):
         # Sliders
         self.contour_slider = QSlider()
         self.y_slider = QSlider()
+        self.time_slider = QSlider()
         # Push buttons
         self.push_screenshot = QPushButton()
         self.push_screenshot.setText('Save screenshot')
@@ -178,6 +188,9 @@ class Ui_MainWindow(object):
         self.gridlayout.addWidget(self.push_camera, 1, 5, 1, 1)
         self.gridlayout.addWidget(self.camera_info, 2, 4, 1, 2)
         self.gridlayout.addWidget(self.log, 3, 4, 1, 2)
+        self.time_label = QLabel("Timestep")
+        self.gridlayout.addWidget(self.time_label, 5, 0, 1, 1)
+        self.gridlayout.addWidget(self.time_slider, 5, 1, 1, 3)
         self.gridlayout.addWidget(self.push_quit, 5, 5, 1, 1)
         MainWindow.setCentralWidget(self.centralWidget)
 
@@ -191,7 +204,21 @@ class PyQtDemo(QMainWindow):
         self.left = -10
         self.right = 10
 
-        [self.image_actor, self.colorbar, self.volume, self.min_temp, self.max_temp] = make_isocontour(args.input,self.left,self.right)
+        [self.image_actor, self.colorbar, self.volume, self.min_temp, self.max_temp, self.data] = make_isocontour(args.input,self.left,self.right)
+
+        # Other timesteps: the files next to --input, loaded in the background
+        self.file_paths = sorted(glob.glob(os.path.join(os.path.dirname(args.input), "spherical*.nc")))
+        if os.path.abspath(args.input) not in map(os.path.abspath, self.file_paths):
+            self.file_paths = [args.input]
+        self.time_index = [os.path.abspath(f) for f in self.file_paths].index(os.path.abspath(args.input))
+        self.requested_index = self.time_index
+        self.loader = TimestepLoader(self.file_paths, "temperature anomaly", args.cache_mb * 2 ** 20,
+                                     args.loaders, args.prefetch, args.encoded)
+        if not args.encoded:
+            self.loader.cache.put(self.time_index, np.array(self.cell_values()))
+        self.poll_timer = QtCore.QTimer()
+        self.poll_timer.timeout.connect(self.poll_loader)
+        self.poll_timer.start(30)
 
         # Create the Renderer
         self.ren = vtk.vtkRenderer()
@@ -221,6 +248,48 @@ class PyQtDemo(QMainWindow):
         
         slider_setup(self.ui.contour_slider, self.left, [-1100, 1100], 100)
         slider_setup(self.ui.y_slider, self.right, [-1100,1100], 100)
+        slider_setup(self.ui.time_slider, self.time_index, [0, len(self.file_paths) - 1], 10)
+        # follow the slider while it is dragged, the loads happen in the background
+        self.ui.time_slider.setTracking(True)
+        self.show_time_label()
+
+    def cell_values(self):
+        """numpy view of the temperature anomaly cell array the pipeline reads."""
+        return numpy_support.vtk_to_numpy(self.data.GetCellData().GetArray("temperature anomaly"))
+
+    def show_time_label(self):
+        self.ui.time_label.setText('Timestep {}'.format(os.path.basename(self.file_paths[self.time_index])))
+
+    def show_timestep(self, index, values):
+        """Copies (or decodes) a timestep into the existing grid; the threshold pipeline re-runs on the next render."""
+        self.loader.fill(values, self.cell_values())
+        self.data.GetCellData().GetArray("temperature anomaly").Modified()
+        self.data.Modified()
+        self.time_index = index
+        self.show_time_label()
+        self.ren.GetRenderWindow().Render()
+
+    def time_callback(self, val):
+        direction = 1 if val >= self.requested_index else -1
+        self.requested_index = val
+        values = self.loader.request(val, direction)
+        if values is not None:
+            self.show_timestep(val, values)
+            self.ui.log.insertPlainText('Timestep {} from cache ({})\n'.format(val, self.loader.stats()))
+        else:
+            self.ui.log.insertPlainText('Loading timestep {}...\n'.format(val))
+
+    def poll_loader(self):
+        arrived = self.loader.poll()
+        while self.loader.errors:
+            file_path, error = self.loader.errors.pop()
+            self.ui.log.insertPlainText('Could not load {}: {}\n'.format(file_path, error))
+        if arrived is None:
+            return
+        index, values, latency = arrived
+        if index == self.requested_index:
+            self.show_timestep(index, values)
+            self.ui.log.insertPlainText('Timestep {} loaded in {:.2f}s ({})\n'.format(index, latency, self.loader.stats()))
     def contour_callback(self, val):
         self.left = val
         new_otf = vtk.vtkPiecewiseFunction()
@@ -252,6 +321,8 @@ class PyQtDemo(QMainWindow):
         print_camera_settings(self.ren.GetActiveCamera(), self.ui.camera_info, self.ui.log, self.ren)
 
     def quit_callback(self):
+        self.loader.close()
+        frame_writer.close()
         sys.exit()
 
 if __name__=="__main__":
@@ -264,8 +335,18 @@ if __name__=="__main__":
     parser.add_argument('-v', '--verbose', action='store_true', help='Toggle on verbose output')
     parser.add_argument('-i', '--input', type=str, metavar='filename', help='Input file', required=True)
     parser.add_argument('--camera', type=str, metavar='filename', help='Camera settings file', default=None)
+    parser.add_argument('--format', type=str, choices=FORMATS, help='Screenshot format', default='png')
+    parser.add_argument('--compression', type=int, metavar='int', help='PNG compression level (0-9)', default=6)
+    parser.add_argument('--writers', type=int, metavar='int', help='Threads encoding screenshots', default=2)
+    parser.add_argument('--cache-mb', type=int, metavar='int', help='Memory budget of the timestep cache (MB)', default=1024)
+    parser.add_argument('--loaders', type=int, metavar='int', help='Background loader processes', default=2)
+    parser.add_argument('--prefetch', type=int, metavar='int', help='Timesteps prefetched in the slider direction', default=2)
+    parser.add_argument('--encoded', action='store_true',
+                        help='Scrub through the field_codec.py files of the timesteps (decoded into the pipeline array)')
     args = parser.parse_args()
 
+    frame_writer = FrameWriter(args.writers, file_format=args.format, compression=args.compression)
+
     app = QApplication(sys.argv)
     window = PyQtDemo()
     window.ui.vtkWidget.GetRenderWindow().SetSize(args.resolution[0], args.resolution[1])
@@ -277,6 +358,7 @@ if __name__=="__main__":
 
     window.ui.contour_slider.valueChanged.connect(window.contour_callback)
     window.ui.y_slider.valueChanged.connect(window.y_clip_callback)
+    window.ui.time_slider.valueChanged.connect(window.time_callback)
     window.ui.push_screenshot.clicked.connect(window.screenshot_callback)
     window.ui.push_camera.clicked.connect(window.camera_callback)
     window.ui.push_quit.clicked.connect(window.quit_callback)
@@ -1,190 +1,302 @@
-import vtk
-import sys
-
-# File path to your NetCDF file
-file_number = int(sys.argv[1])
-file_path = f"mantle_data/spherical{file_number:03d}.nc"
-print("Opening file:", file_path)
-
-# Step 1: Create a reader for NetCDF CF files
-reader = vtk.vtkNetCDFCFReader()
-reader.SetFileName(file_path)
-reader.UpdateMetaData()
-
-# Step 2: Select the "temperature anomaly" variable to read
-selected_variable = "temperature anomaly"
-reader.SetVariableArrayStatus(selected_variable, 1)
-reader.Update()  # Update the reader to load the data
-
-# Step 3: Check the dataset structure and ensure the variable is accessible
-data = reader.GetOutput()
-print(type(data))
-print(data)
-if data is None:
-    print("Reader output is empty. Check the file and variable selection.")
-else:
+import argparse
+import functools
+import time
+import mantle_vtk as vtk
+import numpy as np
+from vtkmodules.util import numpy_support
+from domain_decomposition import close_seam, parallel_filter
+from context_layer import MODES, IN_BETWEEN_MODES, context_layer
+from memory_report import MemoryReport
+from decimate import decimation_options, decimate_surface, pixel_size, print_decimation
+
+# Range the anomaly is scaled to and colored over
+TEMPERATURE_RANGE = (-200, 200)
+
+
+def read_anomaly(file_path, selected_variable, lean=False):
+    # Step 1: Create a reader for NetCDF CF files
+    reader = vtk.vtkNetCDFCFReader()
+    reader.SetFileName(file_path)
+    reader.UpdateMetaData()
+
+    # Step 2: Select the "temperature anomaly" variable to read
+    if lean:
+        # the reader enables every variable by default; lean mode only loads the one it draws
+        for i in range(reader.GetNumberOfVariableArrays()):
+            reader.SetVariableArrayStatus(reader.GetVariableArrayName(i), 0)
+    reader.SetVariableArrayStatus(selected_variable, 1)
+    reader.Update()  # Update the reader to load the data
+
+    # Step 3: Check the dataset structure and ensure the variable is accessible
+    data = reader.GetOutput()
+    if data is None:
+        raise ValueError("Reader output is empty. Check the file and variable selection.")
     print(f"Number of arrays in Cell Data: {data.GetCellData().GetNumberOfArrays()}")
     for i in range(data.GetCellData().GetNumberOfArrays()):
         print(f"Array {i}: {data.GetCellData().GetArrayName(i)}")
+    return data
+
+
+def scale_anomaly(data, selected_variable, min_temp, max_temp, lean=False):
+    """Rescales the variable linearly onto [min_temp, max_temp] and makes it the active cell scalars.
 
+    lean=True computes the scaled array in float32, without float64 temporaries.
+    """
     # Step 4: Retrieve the temperature array from Cell Data
     temperature_array = data.GetCellData().GetArray(selected_variable)
     if temperature_array is None:
-        print(f"Variable '{selected_variable}' not found in Cell Data.")
+        raise KeyError(f"Variable '{selected_variable}' not found in Cell Data.")
+
+    # Step 5: Scale the data to match the temperature range for visualization
+    scalar_range = temperature_array.GetRange()  # Get original range of the data
+    scale_factor = (max_temp - min_temp) / (scalar_range[1] - scalar_range[0])  # Scaling factor
+    shift_factor = min_temp - scalar_range[0] * scale_factor  # Shift factor to match min_temp
+
+    values = numpy_support.vtk_to_numpy(temperature_array)
+    if lean:
+        scaled = np.empty(values.shape, dtype=np.float32)
+        np.multiply(values, np.float32(scale_factor), out=scaled, dtype=np.float32)
+        scaled += np.float32(shift_factor)
     else:
-        min_temp, max_temp = -200, 200  # Shrink the range for visualization
-        print(f"Using temperature range: {min_temp} - {max_temp}")
-        
-        # Step 5: Scale the data to match the temperature range for visualization
-        scalar_range = temperature_array.GetRange()  # Get original range of the data
-        scale_factor = (max_temp - min_temp) / (scalar_range[1] - scalar_range[0])  # Scaling factor
-        shift_factor = min_temp - scalar_range[0] * scale_factor  # Shift factor to match min_temp
-
-        # Apply the scaling to the data
-        #Create dee copy of temperature array
-        
-        scaled_array = vtk.vtkDoubleArray()
-        scaled_array.SetNumberOfTuples(temperature_array.GetNumberOfTuples())
-        for i in range(temperature_array.GetNumberOfTuples()):
-            original_value = temperature_array.GetValue(i)
-            scaled_value = original_value * scale_factor + shift_factor
-            scaled_array.SetValue(i, scaled_value)
-
-        # Set the scaled array back to the data
-        data.GetCellData().SetScalars(scaled_array)
-        print(type(data))
-        
-        threshold_value = 50
-
-        # Lower threshold filter
-        lower_threshold = vtk.vtkThreshold()
-        lower_threshold.SetInputData(data)
-        lower_threshold.SetLowerThreshold(threshold_value)  # Adjust this as needed
-        lower_threshold.Update()
-
-
-        # Upper threshold filter
-        upper_threshold = vtk.vtkThreshold()
-        upper_threshold.SetInputData(data)
-        upper_threshold.SetUpperThreshold(-threshold_value)  # Adjust this as needed
-        upper_threshold.Update()
-        
-        # Combine both thresholded outputs
-        combine_threshold = vtk.vtkAppendFilter()
-        combine_threshold.AddInputData(lower_threshold.GetOutput())
-        combine_threshold.AddInputData(upper_threshold.GetOutput())
-        combine_threshold.Update()
-        print(type(combine_threshold.GetOutput()))
-        # In-between threshold filter (for values between 50 and 150)
-        in_between_threshold = vtk.vtkThreshold()
-        in_between_threshold.SetInputData(data)
-        in_between_threshold.SetLowerThreshold(-threshold_value)  # Lower bound of in-between range
-        in_between_threshold.SetUpperThreshold(threshold_value)  # Upper bound of in-between range
-        in_between_threshold.Update()
-
-        # Get the combined filtered data
-        data = combine_threshold.GetOutput()
-        
-        # Convert unstructured grid to polydata using vtkGeometryFilter
-        geometry_filter = vtk.vtkGeometryFilter()
-        geometry_filter.SetInputData(data)
-        geometry_filter.Update()
-
-        # Get the output polydata
-        polydata = geometry_filter.GetOutput()
-        
-        # Apply vtkSmoothPolyDataFilter to smooth the polydata
-        smooth_filter = vtk.vtkSmoothPolyDataFilter()
-        smooth_filter.SetInputData(polydata)
-        smooth_filter.SetNumberOfIterations(40)  # Number of smoothing iterations
-        smooth_filter.SetRelaxationFactor(0.1)   # Relaxation factor (default: 0.01)
-        smooth_filter.FeatureEdgeSmoothingOff()  # Disable feature edge smoothing
-        smooth_filter.BoundarySmoothingOn()      # Enable boundary smoothing
-        smooth_filter.Update()
-
-        # Get the smoothed polydata output
-        data = smooth_filter.GetOutput()
-
-
-
-        in_between_data = in_between_threshold.GetOutput()
-        
-        # Step 7: Set up a color transfer function for visualization
-        color_transfer_function = vtk.vtkColorTransferFunction()
-        color_transfer_function.AddRGBPoint(max_temp, 1.0, 0.0, 0.0)  # Red for max
-        color_transfer_function.AddRGBPoint(0.0, 1.0, 1.0, 1.0)       # White for neutral
-        color_transfer_function.AddRGBPoint(min_temp, 0.0, 0.0, 1.0)  # Blue for min
-
-        # Step 11: Set up the mapper and actor for the clipped data
-        mapper = vtk.vtkPolyDataMapper()
-        mapper.SetInputData(data)
-        mapper.SetScalarModeToUseCellFieldData()
-        mapper.SelectColorArray(selected_variable)
-        mapper.SetScalarRange(min_temp, max_temp)
-        mapper.SetLookupTable(color_transfer_function)
-
-        actor = vtk.vtkActor()
-        actor.SetMapper(mapper)
-        
-        # Set up a mapper and actor for the in-between data (with opacity of 0.1)
-        in_between_mapper = vtk.vtkDataSetMapper()
-        in_between_mapper.SetInputData(in_between_data)
-        in_between_mapper.SetScalarModeToUseCellFieldData()
-        in_between_mapper.SelectColorArray(selected_variable)
-        in_between_mapper.SetScalarRange(min_temp, max_temp)
-        in_between_mapper.SetLookupTable(color_transfer_function)
-
-        in_between_actor = vtk.vtkActor()
-        in_between_actor.SetMapper(in_between_mapper)
-        in_between_actor.GetProperty().SetOpacity(0.1)  # Set opacity for in-between data
-
-        # Step 12: Apply a transformation to rotate the dataset
-        transform = vtk.vtkTransform()
-        transform.RotateX(25)
-        transform.RotateY(-45)
-        actor.SetUserTransform(transform)
-
-        # Step 13: Set up the renderer, window, and interactor
-        renderer = vtk.vtkRenderer()
-        render_window = vtk.vtkRenderWindow()
-        render_window.AddRenderer(renderer)
-        interactor = vtk.vtkRenderWindowInteractor()
-        interactor.SetRenderWindow(render_window)
-
-        # Add the actor and scalar bar (color legend) to the renderer
-        renderer.AddActor(actor)
-        renderer.AddActor(in_between_actor)  # Actor for in-between data with opacity
-
-
-        scalar_bar = vtk.vtkScalarBarActor()
-        scalar_bar.SetLookupTable(color_transfer_function)
-        scalar_bar.SetTitle("Temperature Anomaly (K)")
-        scalar_bar.SetNumberOfLabels(5)
-        renderer.AddActor2D(scalar_bar)
-
-        renderer.SetBackground(0.1, 0.2, 0.4)  # Background color
-        render_window.SetSize(1600, 1200)
-        
-        renderer.ResetCamera()
-        renderer.GetActiveCamera().Zoom(2.5)
-
-        # Step 14: Start the visualization
+        scaled = values.astype(np.float64) * scale_factor + shift_factor
+    scaled_array = numpy_support.numpy_to_vtk(scaled, deep=1)
+    scaled_array.SetName("scaled " + selected_variable)
+
+    # Set the scaled array as the scalars the thresholds work on
+    data.GetCellData().SetScalars(scaled_array)
+    return data
+
+
+def threshold_surface(data, threshold_value=50, lean=False):
+    """Boundary polydata of the cells whose scaled anomaly is above threshold_value or below -threshold_value."""
+    if lean:
+        return _lean_threshold_surface(data, threshold_value)
+
+    # Lower threshold filter
+    lower_threshold = vtk.vtkThreshold()
+    lower_threshold.SetInputData(data)
+    lower_threshold.SetLowerThreshold(threshold_value)  # Adjust this as needed
+
+    # Upper threshold filter
+    upper_threshold = vtk.vtkThreshold()
+    upper_threshold.SetInputData(data)
+    upper_threshold.SetUpperThreshold(-threshold_value)  # Adjust this as needed
+
+    # Combine both thresholded outputs
+    combine_threshold = vtk.vtkAppendFilter()
+    combine_threshold.AddInputConnection(lower_threshold.GetOutputPort())
+    combine_threshold.AddInputConnection(upper_threshold.GetOutputPort())
+
+    combine_threshold.Update()
+
+    # Convert unstructured grid to polydata using vtkGeometryFilter, with the longitude seam closed
+    geometry_filter = vtk.vtkGeometryFilter()
+    geometry_filter.SetInputData(close_seam(combine_threshold.GetOutput()))
+    geometry_filter.Update()
+    return geometry_filter.GetOutput()
+
+
+def _lean_threshold_surface(data, threshold_value):
+    # One inverted threshold keeps the cells outside (-threshold_value, threshold_value), so there
+    # is a single unstructured grid instead of two thresholds and their appended copy
+    threshold = vtk.vtkThreshold()
+    threshold.SetInputData(data)
+    threshold.SetThresholdFunction(vtk.vtkThreshold.THRESHOLD_BETWEEN)
+    # just inside the open interval, so cells exactly at +-threshold_value are kept as before
+    threshold.SetLowerThreshold(np.nextafter(-threshold_value, 0.0))
+    threshold.SetUpperThreshold(np.nextafter(threshold_value, 0.0))
+    threshold.InvertOn()
+    threshold.Update()
+
+    geometry_filter = vtk.vtkGeometryFilter()
+    geometry_filter.SetInputData(close_seam(threshold.GetOutput()))
+    geometry_filter.Update()
+    return geometry_filter.GetOutput()
+
+
+def smooth_surface(surface, iterations=40, relaxation=0.1):
+    # Apply vtkSmoothPolyDataFilter to smooth the polydata
+    smooth_filter = vtk.vtkSmoothPolyDataFilter()
+    smooth_filter.SetInputData(surface)
+    smooth_filter.SetNumberOfIterations(iterations)  # Number of smoothing iterations
+    smooth_filter.SetRelaxationFactor(relaxation)    # Relaxation factor (default: 0.01)
+    smooth_filter.FeatureEdgeSmoothingOff()  # Disable feature edge smoothing
+    smooth_filter.BoundarySmoothingOn()      # Enable boundary smoothing
+    smooth_filter.Update()
+
+    # Get the smoothed polydata output
+    return smooth_filter.GetOutput()
+
+
+def anomaly_surface(data, threshold_value=50, iterations=40, relaxation=0.1, lean=False):
+    """Smoothed surface of the cells whose scaled anomaly is above threshold_value or below -threshold_value."""
+    return smooth_surface(threshold_surface(data, threshold_value, lean), iterations, relaxation)
+
+
+def in_between_region(data, threshold_value=50):
+    # In-between threshold filter (for values between -threshold_value and threshold_value)
+    in_between_threshold = vtk.vtkThreshold()
+    in_between_threshold.SetInputData(data)
+    in_between_threshold.SetLowerThreshold(-threshold_value)  # Lower bound of in-between range
+    in_between_threshold.SetUpperThreshold(threshold_value)  # Upper bound of in-between range
+    in_between_threshold.Update()
+    return in_between_threshold.GetOutput()
+
+
+def anomaly_colors(min_temp, max_temp):
+    # Step 7: Set up a color transfer function for visualization
+    color_transfer_function = vtk.vtkColorTransferFunction()
+    color_transfer_function.AddRGBPoint(max_temp, 1.0, 0.0, 0.0)  # Red for max
+    color_transfer_function.AddRGBPoint(0.0, 1.0, 1.0, 1.0)       # White for neutral
+    color_transfer_function.AddRGBPoint(min_temp, 0.0, 0.0, 1.0)  # Blue for min
+    return color_transfer_function
+
+
+def anomaly_scene(data, context, colors, selected_variable, min_temp, max_temp, interactive=True):
+    """Renderer, window and interactor with the surfaces, the context layer prop (or None) and a scalar bar."""
+    # Step 11: Set up the mapper and actor for the clipped data
+    mapper = vtk.vtkPolyDataMapper()
+    mapper.SetInputData(data)
+    mapper.SetScalarModeToUseCellFieldData()
+    mapper.SelectColorArray(selected_variable)
+    mapper.SetScalarRange(min_temp, max_temp)
+    mapper.SetLookupTable(colors)
+
+    actor = vtk.vtkActor()
+    actor.SetMapper(mapper)
+
+    # Step 12: Apply a transformation to rotate the dataset
+    transform = vtk.vtkTransform()
+    transform.RotateX(25)
+    transform.RotateY(-45)
+    actor.SetUserTransform(transform)
+
+    # Step 13: Set up the renderer, window, and interactor
+    renderer = vtk.vtkRenderer()
+    render_window = vtk.vtkRenderWindow()
+    render_window.AddRenderer(renderer)
+    if not interactive:
+        render_window.SetOffScreenRendering(1)
+    interactor = vtk.vtkRenderWindowInteractor()
+    interactor.SetRenderWindow(render_window)
+
+    # Add the actor and scalar bar (color legend) to the renderer
+    renderer.AddActor(actor)
+    if context is not None:
+        renderer.AddViewProp(context)  # Translucent context layer (see context_layer.py)
+
+    scalar_bar = vtk.vtkScalarBarActor()
+    scalar_bar.SetLookupTable(colors)
+    scalar_bar.SetTitle("Temperature Anomaly (K)")
+    scalar_bar.SetNumberOfLabels(5)
+    renderer.AddViewProp(scalar_bar)
+
+    renderer.SetBackground(0.1, 0.2, 0.4)  # Background color
+    render_window.SetSize(1600, 1200)
+
+    renderer.ResetCamera()
+    renderer.GetActiveCamera().Zoom(2.5)
+    return renderer, render_window, interactor
+
+
+def render_anomaly(data, context, colors, selected_variable, min_temp, max_temp, file_name, interactive=True):
+    renderer, render_window, interactor = anomaly_scene(data, context, colors, selected_variable,
+                                                        min_temp, max_temp, interactive)
+
+    # Step 14: Start the visualization
+    if interactive:
         interactor.Initialize()
-        render_window.Render()
-        
-        # Save the screen to a file
-        window_to_image_filter = vtk.vtkWindowToImageFilter()
-        window_to_image_filter.SetInput(render_window)
-        window_to_image_filter.SetInputBufferTypeToRGB()
-        window_to_image_filter.ReadFrontBufferOff()
-        window_to_image_filter.Update()
-
-        writer = vtk.vtkPNGWriter()
-        writer.SetFileName(f"output_images/mantle_output{file_number:03d}.png")
-        writer.SetInputConnection(window_to_image_filter.GetOutputPort())
-        writer.Write()
-
-        print(f"Saved current screen to 'mantle_output{file_number:03d}.png'")
-        
-        # Uncomment the next line to start interaction
+    start = time.perf_counter()
+    render_window.Render()
+    print(f"First frame rendered in {time.perf_counter() - start:.2f}s")
+
+    # Save the screen to a file
+    window_to_image_filter = vtk.vtkWindowToImageFilter()
+    window_to_image_filter.SetInput(render_window)
+    window_to_image_filter.SetInputBufferTypeToRGB()
+    window_to_image_filter.ReadFrontBufferOff()
+    window_to_image_filter.Update()
+
+    writer = vtk.vtkPNGWriter()
+    writer.SetFileName(file_name)
+    writer.SetInputConnection(window_to_image_filter.GetOutputPort())
+    writer.Write()
+
+    print(f"Saved current screen to '{file_name}'")
+
+    if interactive:
         interactor.Start()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Smoothed hot/cold temperature anomaly surfaces')
+    parser.add_argument('file_number', type=int, help='File number')
+    parser.add_argument('-t', '--threshold', type=float, help='Threshold on the scaled anomaly', default=50)
+    parser.add_argument('-w', '--workers', type=int, metavar='int',
+                        help='Processes for the filter chain (wedges of the shell); 1 runs it in this process', default=1)
+    parser.add_argument('--ghost', type=int, metavar='int', help='Ghost cell layers around each wedge', default=8)
+    parser.add_argument('--context', type=str, choices=MODES,
+                        help='Translucent layer around the surfaces: the in-between region or a cheaper proxy',
+                        default='full')
+    parser.add_argument('--reduction', type=float, help='Fraction of triangles removed by --context boundary',
+                        default=0.9)
+    parser.add_argument('--resolution', type=int, metavar='int', help='Samples per axis of --context volume',
+                        default=64)
+    decimation_options(parser)
+    parser.add_argument('--lean', action='store_true',
+                        help='Read only the drawn variable, keep scalars in float32 and drop intermediate datasets')
+    parser.add_argument('--no-interaction', action='store_true', help='Save the image and exit')
+    args = parser.parse_args()
+
+    # File path to your NetCDF file
+    file_path = f"mantle_data/spherical{args.file_number:03d}.nc"
+    print("Opening file:", file_path)
+    selected_variable = "temperature anomaly"
+    min_temp, max_temp = TEMPERATURE_RANGE  # Shrink the range for visualization
+    print(f"Using temperature range: {min_temp} - {max_temp}")
+
+    report = MemoryReport()
+    with report.stage("read"):
+        data = read_anomaly(file_path, selected_variable, args.lean)
+    with report.stage("scale"):
+        scale_anomaly(data, selected_variable, min_temp, max_temp, args.lean)
+
+    start = time.perf_counter()
+    if args.workers > 1:
+        with report.stage("surface"):
+            surface, wedge_times = parallel_filter(data, functools.partial(anomaly_surface, threshold_value=args.threshold,
+                                                                           lean=args.lean),
+                                                   args.workers, args.ghost)
+        print(f"Filtered {len(wedge_times)} wedges in {time.perf_counter() - start:.2f}s "
+              f"(slowest wedge {max(wedge_times):.2f}s)")
+    else:
+        with report.stage("threshold"):
+            surface = threshold_surface(data, args.threshold, args.lean)
+        with report.stage("smooth"):
+            surface = smooth_surface(surface)
+        print(f"Filtered in {time.perf_counter() - start:.2f}s")
+    if args.budget is not None or args.pixels is not None:
+        with report.stage("decimate"):
+            start = time.perf_counter()
+            # anomaly_scene's camera: ResetCamera + Zoom(2.5) in a 1600 x 1200 window
+            max_error = args.pixels * pixel_size(surface.GetBounds(), 1200, zoom=2.5) if args.pixels else None
+            surface, counts = decimate_surface(surface, selected_variable, args.budget, max_error,
+                                               args.decimate_workers)
+            print_decimation(counts, time.perf_counter() - start)
+    with report.stage("in-between"):
+        in_between_data = in_between_region(data, args.threshold) if args.context in IN_BETWEEN_MODES else None
+
+    with report.stage("context"):
+        start = time.perf_counter()
+        colors = anomaly_colors(min_temp, max_temp)
+        context = context_layer(args.context, data, colors, selected_variable, min_temp, max_temp, args.threshold,
+                                in_between_data, args.reduction, args.resolution)
+        print(f"Context layer '{args.context}' built in {time.perf_counter() - start:.2f}s")
+    if args.lean:
+        # the surfaces and the context layer hold everything that is drawn
+        del data, in_between_data
+
+    with report.stage("render"):
+        render_anomaly(surface, context, colors, selected_variable, min_temp, max_temp,
+                       f"output_images/mantle_output{args.file_number:03d}.png", not args.no_interaction)
+    report.print("Memory (lean)" if args.lean else "Memory")
@@ -0,0 +1,70 @@
+'''
+Color transfer functions used by the renderers, shared between the VTK
+pipelines and the numpy-only tools. A stop is (value, r, g, b) where value
+may be "min" or "max" to mean the ends of the data range.
+'''
+
+import mantle_vtk as vtk
+import numpy as np
+
+# mantle.py
+TEMPERATURE_STOPS = [
+    ("min", 0.0, 0.0, 1.0),
+    (500, 148/255, 0, 211/255),
+    (2000, 0.0, 1.0, 0.0),
+    (2200, 255/255, 192/255, 203/255),
+    (2300, 1.0, 1.0, 0.0),
+    (3400, 48/255, 25/255, 52/255),
+    ("max", 1.0, 0.0, 0.0),
+]
+
+# mantle2.py / mantle_anomoly.py: blue - white - red around zero
+ANOMALY_STOPS = [
+    ("max", 1.0, 0.0, 0.0),
+    (0.0, 1.0, 1.0, 1.0),
+    ("min", 0.0, 0.0, 1.0),
+]
+
+
+def resolve_stops(stops, vmin, vmax):
+    """Replaces "min"/"max" with the range and returns the stops sorted by value."""
+    resolved = []
+    for value, r, g, b in stops:
+        if value == "min":
+            value = vmin
+        elif value == "max":
+            value = vmax
+        resolved.append((float(value), r, g, b))
+    return sorted(resolved, key=lambda stop: stop[0])
+
+
+def make_color_transfer_function(stops, vmin, vmax):
+    ctf = vtk.vtkColorTransferFunction()
+    for value, r, g, b in resolve_stops(stops, vmin, vmax):
+        ctf.AddRGBPoint(value, r, g, b)
+    return ctf
+
+
+def map_colors(values, stops, vmin, vmax, nan_color=(0, 0, 0)):
+    """Same linear RGB interpolation as vtkColorTransferFunction, on a numpy array -> uint8 RGB."""
+    resolved = np.array(resolve_stops(stops, vmin, vmax))
+    values = np.asarray(values, dtype=np.float64)
+    missing = np.isnan(values)
+    values = np.where(missing, resolved[0, 0], values)
+    rgb = np.empty(values.shape + (3,), dtype=np.uint8)
+    for c in range(3):
+        rgb[..., c] = np.rint(255 * np.interp(values, resolved[:, 0], resolved[:, c + 1]))
+    rgb[missing] = nan_color
+    return rgb
+
+
+def stops_for_variable(name):
+    """Diverging map for the anomaly fields, the mantle.py temperature map otherwise."""
+    return ANOMALY_STOPS if "anomaly" in name else TEMPERATURE_STOPS
+
+
+# names usable in the render configs (render_config.py)
+NAMED_STOPS = {
+    "temperature": TEMPERATURE_STOPS,
+    "anomaly": ANOMALY_STOPS,
+}
@@ -0,0 +1,308 @@
+'''
+Helpers shared by the batch tools to read the spherical mantle files and
+get at their cell arrays as numpy arrays
+'''
+
+import os
+import mantle_vtk as vtk
+import numpy as np
+from vtkmodules.util import numpy_support
+
+VARIABLES = [
+    "spin transition-induced density anomaly",
+    "temperature",
+    "temperature anomaly",
+    "thermal conductivity",
+    "thermal expansivity",
+    "vx", "vy", "vz",
+]
+
+
+def data_path(file_number, data_dir="mantle_data"):
+    return os.path.join(data_dir, f"spherical{file_number:03d}.nc")
+
+
+def _split_derived(variables):
+    """Separates the names computed by derived_fields.py from the NetCDF variables."""
+    if variables is None:
+        return None, []
+    from derived_fields import DERIVED_FIELDS
+    derived = [name for name in variables if name in DERIVED_FIELDS]
+    return [name for name in variables if name not in DERIVED_FIELDS], derived
+
+
+def read_timestep(file_path, variables=None):
+    """Reads one NetCDF file, enabling only the requested variables (all if None).
+
+    Names from derived_fields.DERIVED_FIELDS are loaded from their cache (and
+    computed on first use) and added to the cell data like the others.
+    """
+    native, derived = _split_derived(variables)
+    reader = vtk.vtkNetCDFCFReader()
+    reader.SetFileName(file_path)
+    reader.UpdateMetaData()
+    if native is not None:
+        for i in range(reader.GetNumberOfVariableArrays()):
+            name = reader.GetVariableArrayName(i)
+            reader.SetVariableArrayStatus(name, 1 if name in native else 0)
+    reader.Update()
+    data = reader.GetOutput()
+    if data is None or data.GetNumberOfCells() == 0:
+        raise ValueError(f"Reader output is empty for {file_path}")
+    if derived:
+        from derived_fields import load_derived_fields
+        for name, values in load_derived_fields(file_path, derived).items():
+            array = numpy_support.numpy_to_vtk(np.ravel(values), deep=1)
+            array.SetName(name)
+            data.GetCellData().AddArray(array)
+    return data
+
+
+def cell_array(data, name):
+    """Returns a cell array of the dataset as a numpy array (no copy)."""
+    array = data.GetCellData().GetArray(name)
+    if array is None:
+        raise KeyError(f"Variable '{name}' not found in Cell Data.")
+    return numpy_support.vtk_to_numpy(array)
+
+
+def _axis_bounds(centers, clamp=None):
+    """Cell bounds halfway between the sample coordinates, like the NetCDF reader builds them."""
+    centers = np.asarray(centers, dtype=np.float64)
+    bounds = np.empty(centers.size + 1)
+    bounds[1:-1] = 0.5 * (centers[1:] + centers[:-1])
+    bounds[0] = centers[0] - 0.5 * (centers[1] - centers[0])
+    bounds[-1] = centers[-1] + 0.5 * (centers[-1] - centers[-2])
+    if clamp is not None:
+        bounds = np.clip(bounds, clamp[0], clamp[1])
+    return bounds
+
+
+def _nearest_index(bounds, values):
+    """Index of the cell holding each value along one axis, -1 when outside."""
+    values = np.asarray(values, dtype=np.float64)
+    ascending = bounds[-1] >= bounds[0]
+    edges = bounds if ascending else bounds[::-1]
+    index = np.searchsorted(edges, values, side="right") - 1
+    # values sitting exactly on the last bound still belong to the last cell
+    index = np.where(values == edges[-1], edges.size - 2, index)
+    outside = (index < 0) | (index > edges.size - 2)
+    if not ascending:
+        index = edges.size - 2 - index
+    return np.where(outside, -1, index)
+
+
+def fractional_index(centers, values, periodic=False):
+    """Position of values along an axis in units of cells (0 = center of the first cell).
+
+    Values past the first/last center are clamped; with periodic=True the
+    axis (longitude) wraps around after the last cell.
+    """
+    centers = np.asarray(centers, dtype=np.float64)
+    index = np.arange(centers.size, dtype=np.float64)
+    if centers[-1] < centers[0]:
+        centers, index = centers[::-1], index[::-1]
+    if periodic:
+        values = centers[0] + np.mod(values - centers[0], 360.0)
+        centers = np.append(centers, centers[0] + 360.0)
+        index = np.append(index, centers.size - 1)
+    return np.interp(values, centers, index)
+
+
+class SphericalGrid:
+    """Logical (r, lat, lon) layout of the cells of a spherical mantle file.
+
+    Cell arrays from the reader are ordered with lon varying fastest, then
+    lat, then r, so values.reshape(grid.shape) gives a [r, lat, lon] array.
+    Radii are in the file's units (km), angles in degrees.
+    """
+
+    def __init__(self, r_bounds, lat_bounds, lon_bounds):
+        self.r_bounds = np.asarray(r_bounds, dtype=np.float64)
+        self.lat_bounds = np.asarray(lat_bounds, dtype=np.float64)
+        self.lon_bounds = np.asarray(lon_bounds, dtype=np.float64)
+        self.r = 0.5 * (self.r_bounds[1:] + self.r_bounds[:-1])
+        self.lat = 0.5 * (self.lat_bounds[1:] + self.lat_bounds[:-1])
+        self.lon = 0.5 * (self.lon_bounds[1:] + self.lon_bounds[:-1])
+        self.shape = (self.r.size, self.lat.size, self.lon.size)
+
+    @classmethod
+    def from_axes(cls, r, lat, lon):
+        return cls(_axis_bounds(r), _axis_bounds(lat, (-90.0, 90.0)), _axis_bounds(lon))
+
+    @classmethod
+    def from_dataset(cls, data):
+        """Recovers the layout from the points of the reader's spherical structured grid."""
+        if not hasattr(data, "GetExtent") or data.GetPoints() is None:
+            raise ValueError("Expected the structured grid produced by vtkNetCDFCFReader")
+        extent = data.GetExtent()
+        dims = (extent[5] - extent[4] + 1, extent[3] - extent[2] + 1, extent[1] - extent[0] + 1)
+        points = numpy_support.vtk_to_numpy(data.GetPoints().GetData()).reshape(dims + (3,))
+        # only one line of points along r and one along lat are needed
+        r_bounds = np.linalg.norm(points[:, 0, 0], axis=-1)
+        meridian = points[0, :, 0]
+        lat_bounds = np.degrees(np.arcsin(np.clip(meridian[:, 2] / np.linalg.norm(meridian, axis=-1), -1.0, 1.0)))
+        equator = points[0, dims[1] // 2, :]
+        lon_bounds = np.degrees(np.unwrap(np.arctan2(equator[:, 1], equator[:, 0])))
+        return cls(r_bounds, lat_bounds, lon_bounds)
+
+    @property
+    def number_of_cells(self):
+        return self.r.size * self.lat.size * self.lon.size
+
+    @property
+    def outer_radius(self):
+        return self.r_bounds.max()
+
+    @property
+    def depth(self):
+        """Depth of every radial layer below the outer surface."""
+        return self.outer_radius - self.r
+
+    @property
+    def periodic(self):
+        """True when the cells go all the way around in longitude."""
+        return abs(abs(self.lon_bounds[-1] - self.lon_bounds[0]) - 360.0) < 1e-6
+
+    def cell_volumes(self):
+        """Exact volume of every spherical cell, as an [r, lat, lon] array (km^3 for radii in km)."""
+        r3 = np.abs(np.diff(self.r_bounds ** 3)) / 3.0
+        sin_lat = np.abs(np.diff(np.sin(np.radians(self.lat_bounds))))
+        dlon = np.abs(np.radians(np.diff(self.lon_bounds)))
+        return r3[:, None, None] * sin_lat[None, :, None] * dlon[None, None, :]
+
+    def reshape(self, values):
+        return np.asarray(values).reshape(self.shape + np.shape(values)[1:])
+
+    def r_index(self, r):
+        return _nearest_index(self.r_bounds, r)
+
+    def depth_index(self, depth):
+        return self.r_index(self.outer_radius - np.asarray(depth, dtype=np.float64))
+
+    def lat_index(self, lat):
+        return _nearest_index(self.lat_bounds, lat)
+
+    def lon_index(self, lon):
+        lon = np.asarray(lon, dtype=np.float64)
+        if self.periodic:
+            start = min(self.lon_bounds[0], self.lon_bounds[-1])
+            lon = start + np.mod(lon - start, 360.0)
+        return _nearest_index(self.lon_bounds, lon)
+
+    def interpolation_weights(self, r, lat, lon):
+        """Trilinear weights between cell centers in (r, lat, lon).
+
+        Returns flat cell ids (n, 8), weights (n, 8) and a mask of the points
+        inside the shell. The result only depends on the grid, so it can be
+        reused for every timestep (see interpolate()).
+        """
+        r, lat, lon = (np.ravel(np.asarray(a, dtype=np.float64)) for a in np.broadcast_arrays(r, lat, lon))
+        inside = (r >= self.r_bounds.min()) & (r <= self.r_bounds.max())
+        fk = fractional_index(self.r, r)
+        fj = fractional_index(self.lat, lat)
+        fi = fractional_index(self.lon, lon, self.periodic)
+        nr, nlat, nlon = self.shape
+
+        corners = []
+        for f, n, wrap in ((fk, nr, False), (fj, nlat, False), (fi, nlon, self.periodic)):
+            i0 = np.floor(f).astype(np.intp)
+            if wrap:
+                i0 = np.mod(i0, n)
+                i1 = np.mod(i0 + 1, n)
+            else:
+                i0 = np.clip(i0, 0, max(n - 2, 0))
+                i1 = np.minimum(i0 + 1, n - 1)
+            t = np.clip(f - np.floor(f) if wrap else f - i0, 0.0, 1.0)
+            corners.append((i0, i1, t))
+
+        (k0, k1, tk), (j0, j1, tj), (i0, i1, ti) = corners
+        ids = np.empty((r.size, 8), dtype=np.intp)
+        weights = np.empty((r.size, 8), dtype=np.float64)
+        n = 0
+        for k, wk in ((k0, 1 - tk), (k1, tk)):
+            for j, wj in ((j0, 1 - tj), (j1, tj)):
+                for i, wi in ((i0, 1 - ti), (i1, ti)):
+                    ids[:, n] = (k * nlat + j) * nlon + i
+                    weights[:, n] = wk * wj * wi
+                    n += 1
+        return ids, weights, inside
+
+    def interpolate(self, values, ids, weights):
+        """Applies interpolation_weights() to a cell array, [r, lat, lon] or flat, scalar or vector."""
+        flat = np.reshape(values, (self.number_of_cells, -1))
+        result = np.einsum("nc,ncd->nd", weights, flat[ids])
+        return result[:, 0] if np.size(values) == self.number_of_cells else result
+
+
+def to_spherical(points):
+    """Cartesian (n, 3) positions -> radius, latitude and longitude in degrees."""
+    points = np.asarray(points, dtype=np.float64)
+    r = np.linalg.norm(points, axis=-1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        lat = np.degrees(np.arcsin(np.clip(points[..., 2] / r, -1.0, 1.0)))
+    lon = np.degrees(np.arctan2(points[..., 1], points[..., 0]))
+    return r, np.nan_to_num(lat), lon
+
+
+def to_cartesian(r, lat, lon):
+    """Radius and latitude/longitude in degrees -> Cartesian (..., 3), the reader's convention."""
+    lat, lon = np.radians(lat), np.radians(lon)
+    return np.stack(np.broadcast_arrays(r * np.cos(lat) * np.cos(lon),
+                                        r * np.cos(lat) * np.sin(lon),
+                                        r * np.sin(lat)), axis=-1)
+
+
+def local_basis(lat, lon):
+    """East, north and up unit vectors (Cartesian, last axis) at lat/lon in degrees."""
+    lat, lon = np.radians(lat), np.radians(lon)
+    lat, lon = np.broadcast_arrays(lat, lon)
+    sin_lat, cos_lat = np.sin(lat), np.cos(lat)
+    sin_lon, cos_lon = np.sin(lon), np.cos(lon)
+    east = np.stack([-sin_lon, cos_lon, np.zeros_like(lon)], axis=-1)
+    north = np.stack([-sin_lat * cos_lon, -sin_lat * sin_lon, cos_lat], axis=-1)
+    up = np.stack([cos_lat * cos_lon, cos_lat * sin_lon, sin_lat], axis=-1)
+    return east, north, up
+
+
+def to_local_components(vx, vy, vz, grid):
+    """Splits Cartesian vx/vy/vz [r, lat, lon] arrays into east, north and radial components."""
+    east, north, up = local_basis(grid.lat[:, None], grid.lon[None, :])
+    return tuple(vx * e[..., 0] + vy * e[..., 1] + vz * e[..., 2] for e in (east, north, up))
+
+
+def read_fields(file_path, variables):
+    """Reads variables straight into [r, lat, lon] numpy arrays, skipping the spherical geometry.
+
+    Derived variable names are served from the derived_fields.py cache.
+    """
+    variables, derived = _split_derived(variables)
+    reader = vtk.vtkNetCDFCFReader()
+    reader.SetFileName(file_path)
+    reader.SphericalCoordinatesOff()
+    reader.UpdateMetaData()
+    for i in range(reader.GetNumberOfVariableArrays()):
+        name = reader.GetVariableArrayName(i)
+        reader.SetVariableArrayStatus(name, 1 if name in variables else 0)
+    reader.Update()
+    data = reader.GetOutput()
+
+    # x, y, z of the lat/lon image are lon, lat and r
+    if data.IsA("vtkRectilinearGrid"):
+        axes = [numpy_support.vtk_to_numpy(c) for c in
+                (data.GetXCoordinates(), data.GetYCoordinates(), data.GetZCoordinates())]
+    else:
+        dims, origin, spacing = data.GetDimensions(), data.GetOrigin(), data.GetSpacing()
+        axes = [origin[i] + spacing[i] * np.arange(dims[i]) for i in range(3)]
+    grid = SphericalGrid.from_axes(axes[2], axes[1], axes[0])
+
+    fields = {}
+    for name in variables:
+        array = data.GetPointData().GetArray(name)
+        if array is None:
+            raise KeyError(f"Variable '{name}' not found in {file_path}")
+        fields[name] = grid.reshape(numpy_support.vtk_to_numpy(array))
+    if derived:
+        from derived_fields import load_derived_fields
+        fields.update(load_derived_fields(file_path, derived))
+    return grid, fields
@@ -0,0 +1,60 @@
+'''
+Image helpers shared by the batch tools: (h, w, 3) uint8 numpy images read
+back from a render window, contact sheets of them, PNG output, and the
+frame timing used to compare renderings.
+'''
+
+import time
+import numpy as np
+import mantle_vtk as vtk
+from vtkmodules.util import numpy_support
+
+
+def write_png(rgb, filename):
+    """Writes an (h, w, 3) uint8 image, first row at the top."""
+    h, w = rgb.shape[:2]
+    image = vtk.vtkImageData()
+    image.SetDimensions(w, h, 1)
+    # VTK images start at the bottom row
+    pixels = numpy_support.numpy_to_vtk(np.ascontiguousarray(rgb[::-1]).reshape(-1, rgb.shape[2]), deep=1)
+    image.GetPointData().SetScalars(pixels)
+    writer = vtk.vtkPNGWriter()
+    writer.SetFileName(filename)
+    writer.SetInputData(image)
+    writer.Write()
+
+
+def capture(render_window):
+    """(h, w, 3) uint8 image of the window, first row at the top."""
+    window_to_image_filter = vtk.vtkWindowToImageFilter()
+    window_to_image_filter.SetInput(render_window)
+    window_to_image_filter.SetInputBufferTypeToRGB()
+    window_to_image_filter.ReadFrontBufferOff()
+    window_to_image_filter.Update()
+    image = window_to_image_filter.GetOutput()
+    w, h, _ = image.GetDimensions()
+    return numpy_support.vtk_to_numpy(image.GetPointData().GetScalars()).reshape(h, w, 3)[::-1].copy()
+
+
+def contact_sheet(images, columns, border=4):
+    """Tiles equally sized images row by row on a dark background."""
+    h, w, _ = images[0].shape
+    rows = -(-len(images) // columns)
+    sheet = np.full((rows * (h + border) + border, columns * (w + border) + border, 3), 20, dtype=np.uint8)
+    for i, image in enumerate(images):
+        y = border + (i // columns) * (h + border)
+        x = border + (i % columns) * (w + border)
+        sheet[y:y + h, x:x + w] = image
+    return sheet
+
+
+def time_frames(renderer, render_window, frames, degrees=2.0):
+    """Frame times of `frames` renders, turning the camera by `degrees` between them."""
+    times = []
+    for _ in range(frames):
+        renderer.GetActiveCamera().Azimuth(degrees)
+        start = time.perf_counter()
+        render_window.Render()
+        render_window.WaitForCompletion()
+        times.append(time.perf_counter() - start)
+    return times
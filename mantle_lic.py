@@ -1,4 +1,4 @@
-import vtk
+import mantle_vtk as vtk
 
 # Step 1: Read VTS file
 reader = vtk.vtkXMLStructuredGridReader()
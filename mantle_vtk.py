@@ -0,0 +1,113 @@
+'''
+Lazy stand-in for `import vtk`: `import mantle_vtk as vtk` and then
+vtk.vtkThreshold() etc. as before, but only the vtkmodules submodules that
+hold the classes a script actually touches are imported, on first use.
+`import vtk` loads every VTK module, which is most of the startup time of
+the per-frame scripts run by run_mantle.sh.
+
+Rendering classes also pull in the OpenGL, window/interactor and font
+modules that register the concrete implementations behind vtkRenderWindow,
+vtkRenderWindowInteractor and the text of the scalar bars. Names missing
+from CLASS_MODULES still work, through vtkmodules.all (the slow path).
+'''
+
+import importlib
+import sys
+
+CLASS_MODULES = {
+    "vtkPoints": "vtkCommonCore",
+    "vtkBox": "vtkCommonDataModel",
+    "vtkCellArray": "vtkCommonDataModel",
+    "vtkDataObject": "vtkCommonDataModel",
+    "vtkDataSetAttributes": "vtkCommonDataModel",
+    "vtkImageData": "vtkCommonDataModel",
+    "vtkPiecewiseFunction": "vtkCommonDataModel",
+    "vtkPolyData": "vtkCommonDataModel",
+    "vtkStructuredGrid": "vtkCommonDataModel",
+    "vtkUnstructuredGrid": "vtkCommonDataModel",
+    "vtkTransform": "vtkCommonTransforms",
+    "vtkAppendFilter": "vtkFiltersCore",
+    "vtkAppendPolyData": "vtkFiltersCore",
+    "vtkCellDataToPointData": "vtkFiltersCore",
+    "vtkCleanPolyData": "vtkFiltersCore",
+    "vtkDecimatePro": "vtkFiltersCore",
+    "vtkFeatureEdges": "vtkFiltersCore",
+    "vtkPointDataToCellData": "vtkFiltersCore",
+    "vtkPolyDataNormals": "vtkFiltersCore",
+    "vtkResampleToImage": "vtkFiltersCore",
+    "vtkSmoothPolyDataFilter": "vtkFiltersCore",
+    "vtkStaticCleanUnstructuredGrid": "vtkFiltersCore",
+    "vtkThreshold": "vtkFiltersCore",
+    "vtkTriangleFilter": "vtkFiltersCore",
+    "vtkTubeFilter": "vtkFiltersCore",
+    "vtkClipDataSet": "vtkFiltersGeneral",
+    "vtkGeometryFilter": "vtkFiltersGeometry",
+    "vtkArrowSource": "vtkFiltersSources",
+    "vtkNetCDFCFReader": "vtkIONetCDF",
+    "vtkJPEGWriter": "vtkIOImage",
+    "vtkPNGWriter": "vtkIOImage",
+    "vtkXMLImageDataWriter": "vtkIOXML",
+    "vtkXMLPolyDataWriter": "vtkIOXML",
+    "vtkXMLStructuredGridReader": "vtkIOXML",
+    "vtkXMLStructuredGridWriter": "vtkIOXML",
+    "vtkActor": "vtkRenderingCore",
+    "vtkCamera": "vtkRenderingCore",
+    "vtkColorTransferFunction": "vtkRenderingCore",
+    "vtkDataSetMapper": "vtkRenderingCore",
+    "vtkGlyph3DMapper": "vtkRenderingCore",
+    "vtkLight": "vtkRenderingCore",
+    "vtkLightCollection": "vtkRenderingCore",
+    "vtkPolyDataMapper": "vtkRenderingCore",
+    "vtkRenderWindow": "vtkRenderingCore",
+    "vtkRenderWindowInteractor": "vtkRenderingCore",
+    "vtkRenderer": "vtkRenderingCore",
+    "vtkTextActor": "vtkRenderingCore",
+    "vtkVolume": "vtkRenderingCore",
+    "vtkVolumeProperty": "vtkRenderingCore",
+    "vtkWindowToImageFilter": "vtkRenderingCore",
+    "vtkScalarBarActor": "vtkRenderingAnnotation",
+    "vtkSurfaceLICInterface": "vtkRenderingLICOpenGL2",
+    "vtkSurfaceLICMapper": "vtkRenderingLICOpenGL2",
+    "vtkUnstructuredGridVolumeRayCastMapper": "vtkRenderingVolume",
+    "vtkSmartVolumeMapper": "vtkRenderingVolumeOpenGL2",
+}
+
+# modules that only register factory overrides, imported with any vtkRendering* module
+RENDERING_BACKENDS = ("vtkRenderingOpenGL2", "vtkRenderingUI", "vtkInteractionStyle", "vtkRenderingFreeType")
+VOLUME_BACKENDS = ("vtkRenderingVolumeOpenGL2",)
+
+
+def load_rendering_backends():
+    """Registers the OpenGL render window and interactor; needed before code outside this module creates one."""
+    for backend in RENDERING_BACKENDS:
+        importlib.import_module("vtkmodules." + backend)
+
+
+def _import(module_name):
+    if module_name.startswith("vtkRendering"):
+        load_rendering_backends()
+        if module_name.startswith("vtkRenderingVolume"):
+            for backend in VOLUME_BACKENDS:
+                importlib.import_module("vtkmodules." + backend)
+    return importlib.import_module("vtkmodules." + module_name)
+
+
+def __getattr__(name):
+    if name.startswith("__"):
+        raise AttributeError(name)
+    if name in CLASS_MODULES:
+        value = getattr(_import(CLASS_MODULES[name]), name)
+    else:
+        try:
+            value = getattr(importlib.import_module("vtkmodules.all"), name)
+        except AttributeError:
+            raise AttributeError(f"module 'vtk' has no attribute '{name}'") from None
+    # cache it, so __getattr__ only runs on the first access
+    globals()[name] = value
+    return value
+
+
+def loaded_modules():
+    """Names of the vtkmodules submodules imported so far."""
+    return sorted(name[len("vtkmodules."):] for name in sys.modules
+                  if name.startswith("vtkmodules.vtk") and name.count(".") == 1)
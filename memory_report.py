@@ -0,0 +1,94 @@
+'''
+Resident memory per pipeline stage.
+
+On Linux the peak (VmHWM) is reset at the start of every stage through
+/proc/self/clear_refs, so each stage reports its own peak. Elsewhere, or
+when the reset is not allowed, the peak is the process peak so far
+(getrusage), and the report says so.
+
+    report = MemoryReport()
+    with report.stage("read"):
+        data = read_anomaly(...)
+    report.print()
+'''
+
+import resource
+import sys
+import time
+from contextlib import contextmanager
+
+
+def _status_mb(field):
+    """A VmXXX field of /proc/self/status in MB, None when unavailable."""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def current_rss_mb():
+    rss = _status_mb("VmRSS")
+    return rss if rss is not None else peak_rss_mb()
+
+
+def peak_rss_mb():
+    """Peak resident memory since the last reset_peak() (since the start without one)."""
+    peak = _status_mb("VmHWM")
+    if peak is not None:
+        return peak
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, KB on Linux
+    return maxrss / 2 ** 20 if sys.platform == "darwin" else maxrss / 1024
+
+
+def private_rss_mb():
+    """Resident memory only this process maps (no shared memory or shared library pages), None when unavailable."""
+    try:
+        with open("/proc/self/smaps_rollup") as rollup:
+            return sum(int(line.split()[1]) for line in rollup
+                       if line.startswith(("Private_Clean:", "Private_Dirty:"))) / 1024
+    except OSError:
+        return None
+
+
+def reset_peak():
+    """Starts a new peak at the current RSS; returns False when the OS does not allow it."""
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+        return True
+    except OSError:
+        return False
+
+
+class MemoryReport:
+    """Time, RSS after and peak RSS of named stages."""
+
+    def __init__(self):
+        self.stages = []
+        self.per_stage_peak = True
+
+    @contextmanager
+    def stage(self, name):
+        self.per_stage_peak = reset_peak() and self.per_stage_peak
+        before = current_rss_mb()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages.append((name, time.perf_counter() - start, before, current_rss_mb(), peak_rss_mb()))
+
+    @property
+    def peak(self):
+        return max((stage[4] for stage in self.stages), default=0.0)
+
+    def print(self, title="Memory"):
+        print(f"{title}: {'peak per stage' if self.per_stage_peak else 'peak since start (no per-stage reset)'}")
+        print(f"  {'stage':16s} {'time':>7s} {'RSS before':>11s} {'RSS after':>10s} {'peak':>9s}")
+        for name, elapsed, before, after, peak in self.stages:
+            print(f"  {name:16s} {elapsed:6.2f}s {before:8.0f} MB {after:7.0f} MB {peak:6.0f} MB")
+        print(f"  overall peak {self.peak:.0f} MB")
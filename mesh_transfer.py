@@ -0,0 +1,68 @@
+'''
+Packs vtkPolyData into plain numpy arrays and back, so meshes can be
+returned from worker processes (pickled) or stored without a VTK writer.
+'''
+
+import numpy as np
+import mantle_vtk as vtk
+from vtkmodules.util import numpy_support
+
+CELL_TYPES = ("verts", "lines", "polys", "strips")
+
+
+def _get_cells(polydata, kind):
+    return getattr(polydata, "Get" + kind.capitalize())()
+
+
+def _set_cells(polydata, kind, cells):
+    getattr(polydata, "Set" + kind.capitalize())(cells)
+
+
+def _pack_arrays(attributes):
+    arrays = {}
+    for i in range(attributes.GetNumberOfArrays()):
+        array = attributes.GetArray(i)
+        if array is not None and array.GetName():
+            arrays[array.GetName()] = numpy_support.vtk_to_numpy(array).copy()
+    scalars = attributes.GetScalars()
+    return arrays, scalars.GetName() if scalars is not None else None
+
+
+def pack_polydata(polydata):
+    """Dict of numpy arrays with the points, the four cell arrays and the point/cell data of a polydata."""
+    packed = {"points": numpy_support.vtk_to_numpy(polydata.GetPoints().GetData()).copy()
+              if polydata.GetPoints() is not None else np.zeros((0, 3), dtype=np.float32)}
+    for kind in CELL_TYPES:
+        cells = _get_cells(polydata, kind)
+        packed[kind] = (numpy_support.vtk_to_numpy(cells.GetOffsetsArray()).astype(np.int64),
+                        numpy_support.vtk_to_numpy(cells.GetConnectivityArray()).astype(np.int64))
+    packed["point_data"], packed["point_scalars"] = _pack_arrays(polydata.GetPointData())
+    packed["cell_data"], packed["cell_scalars"] = _pack_arrays(polydata.GetCellData())
+    return packed
+
+
+def _unpack_arrays(attributes, arrays, scalars):
+    for name, values in arrays.items():
+        array = numpy_support.numpy_to_vtk(np.ascontiguousarray(values), deep=1)
+        array.SetName(name)
+        attributes.AddArray(array)
+    if scalars is not None:
+        attributes.SetActiveScalars(scalars)
+
+
+def unpack_polydata(packed):
+    """vtkPolyData rebuilt from pack_polydata()'s dict."""
+    polydata = vtk.vtkPolyData()
+    points = vtk.vtkPoints()
+    points.SetData(numpy_support.numpy_to_vtk(np.ascontiguousarray(packed["points"]), deep=1))
+    polydata.SetPoints(points)
+    for kind in CELL_TYPES:
+        offsets, connectivity = packed[kind]
+        cells = vtk.vtkCellArray()
+        if len(offsets) > 1:
+            cells.SetData(numpy_support.numpy_to_vtkIdTypeArray(np.ascontiguousarray(offsets), deep=1),
+                          numpy_support.numpy_to_vtkIdTypeArray(np.ascontiguousarray(connectivity), deep=1))
+        _set_cells(polydata, kind, cells)
+    _unpack_arrays(polydata.GetPointData(), packed["point_data"], packed["point_scalars"])
+    _unpack_arrays(polydata.GetCellData(), packed["cell_data"], packed["cell_scalars"])
+    return polydata
@@ -1,4 +1,4 @@
-import vtk
+import mantle_vtk as vtk
 
 # Read the VTS file
 reader = vtk.vtkXMLStructuredGridReader()
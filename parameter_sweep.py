@@ -0,0 +1,244 @@
+'''
+Parameter sweep over the mantle_anomoly.py pipeline: every combination of
+the given scale ranges, thresholds, smoothing iterations, relaxation
+factors and transfer functions is rendered offscreen into one labeled
+contact sheet. Tiles are colored like mantle_anomoly.py: the raw variable
+over its fixed +/-200 range with anomaly_colors(), unless color maps or
+color ranges are given explicitly.
+
+The pipeline is split into stages (read -> scale -> threshold -> smooth,
+plus the in-between region, then render) and each stage output is
+memoized by its parameters and the key of its input, so the file is read
+once and e.g. a change of relaxation factor only reruns the smoothing and
+the rendering. The keys of every combination are known before anything
+runs, so an output is dropped as soon as no remaining combination uses it
+(one scaled grid and one in-between grid at a time, not one per value).
+
+Usage:
+    python parameter_sweep.py <file_number> -t 30 50 70 --iterations 20 40 --relaxation 0.05 0.1
+'''
+
+import argparse
+import itertools
+import os
+import time
+from collections import Counter, defaultdict
+import numpy as np
+import mantle_vtk as vtk
+from vtkmodules.util import numpy_support
+from mantle_grid import data_path, read_timestep
+from mantle_colors import NAMED_STOPS, make_color_transfer_function
+from mantle_anomoly import (TEMPERATURE_RANGE, anomaly_colors, scale_anomaly, threshold_surface, smooth_surface,
+                            in_between_region)
+from mantle_images import contact_sheet, write_png
+
+PARAMETERS = ("scale", "threshold", "iterations", "relaxation", "stops", "color_range")
+
+
+class StageCache:
+    """Stage outputs keyed by (stage, keys of the inputs, parameters)."""
+
+    def __init__(self):
+        self.outputs = {}
+        self.runs = Counter()
+        self.hits = Counter()
+        self.released = Counter()
+        self.times = defaultdict(float)
+
+    @staticmethod
+    def key(stage, input_keys, params):
+        return stage, tuple(input_keys), tuple(sorted(params.items()))
+
+    def run(self, stage, function, inputs, **params):
+        """(key, output) of function(*input outputs, **params); inputs are (key, output) pairs of earlier stages."""
+        key = self.key(stage, (input_key for input_key, _ in inputs), params)
+        if key in self.outputs:
+            self.hits[stage] += 1
+        else:
+            start = time.perf_counter()
+            self.outputs[key] = function(*(output for _, output in inputs), **params)
+            self.times[stage] += time.perf_counter() - start
+            self.runs[stage] += 1
+        return key, self.outputs[key]
+
+    def release(self, key):
+        """Drops an output that nothing will use again."""
+        if self.outputs.pop(key, None) is not None:
+            self.released[key[0]] += 1
+
+    def report(self):
+        lines = []
+        for stage in self.runs:
+            lines.append(f"  {stage:10s} ran {self.runs[stage]:3d}x, reused {self.hits[stage]:3d}x, "
+                         f"released {self.released[stage]:3d}x, {self.times[stage]:.2f}s")
+        return "\n".join(lines)
+
+
+def read_stage(file_path, variable):
+    return read_timestep(file_path, [variable])
+
+
+def scale_stage(data, variable, scale):
+    """scale_anomaly on a shallow copy, so the read output stays usable for the other scales."""
+    scaled = data.NewInstance()
+    scaled.ShallowCopy(data)
+    return scale_anomaly(scaled, variable, -scale, scale)
+
+
+class SweepRenderer:
+    """mantle_anomoly.py's scene in one offscreen window, reused for every combination."""
+
+    def __init__(self, variable, size=(400, 300)):
+        self.mapper = vtk.vtkPolyDataMapper()
+        self.mapper.SetScalarModeToUseCellFieldData()
+        self.mapper.SelectColorArray(variable)
+        self.actor = vtk.vtkActor()
+        self.actor.SetMapper(self.mapper)
+        transform = vtk.vtkTransform()
+        transform.RotateX(25)
+        transform.RotateY(-45)
+        self.actor.SetUserTransform(transform)
+
+        self.in_between_mapper = vtk.vtkDataSetMapper()
+        self.in_between_mapper.SetScalarModeToUseCellFieldData()
+        self.in_between_mapper.SelectColorArray(variable)
+        self.in_between_actor = vtk.vtkActor()
+        self.in_between_actor.SetMapper(self.in_between_mapper)
+        self.in_between_actor.GetProperty().SetOpacity(0.1)
+
+        self.label = vtk.vtkTextActor()
+        self.label.GetTextProperty().SetFontSize(14)
+        self.label.SetDisplayPosition(8, 8)
+
+        self.renderer = vtk.vtkRenderer()
+        self.renderer.AddActor(self.actor)
+        self.renderer.AddActor(self.in_between_actor)
+        self.renderer.AddViewProp(self.label)
+        self.renderer.SetBackground(0.1, 0.2, 0.4)
+        self.render_window = vtk.vtkRenderWindow()
+        self.render_window.SetOffScreenRendering(1)
+        self.render_window.AddRenderer(self.renderer)
+        self.render_window.SetSize(*size)
+        self.window_to_image_filter = vtk.vtkWindowToImageFilter()
+        self.window_to_image_filter.SetInput(self.render_window)
+        self.window_to_image_filter.SetInputBufferTypeToRGB()
+        self.window_to_image_filter.ReadFrontBufferOff()
+        self.camera_set = False
+
+    def render(self, surface, in_between, stops, color_range, label):
+        """(h, w, 3) uint8 image, first row at the top; stops=None uses mantle_anomoly.py's anomaly_colors()."""
+        if stops is None:
+            lut = anomaly_colors(-color_range, color_range)
+        else:
+            lut = make_color_transfer_function(NAMED_STOPS[stops], -color_range, color_range)
+        for mapper, data in ((self.mapper, surface), (self.in_between_mapper, in_between)):
+            mapper.SetInputData(data)
+            mapper.SetScalarRange(-color_range, color_range)
+            mapper.SetLookupTable(lut)
+        self.label.SetInput(label)
+        # the same camera for every tile, so they can be compared
+        if not self.camera_set:
+            self.renderer.ResetCamera()
+            self.renderer.GetActiveCamera().Zoom(2.5)
+            self.camera_set = True
+        self.render_window.Render()
+        self.window_to_image_filter.Modified()
+        self.window_to_image_filter.Update()
+        image = self.window_to_image_filter.GetOutput()
+        w, h, _ = image.GetDimensions()
+        rgb = numpy_support.vtk_to_numpy(image.GetPointData().GetScalars()).reshape(h, w, 3)
+        return rgb[::-1].copy()
+
+
+def parameter_label(params):
+    return (f"scale {params['scale']:g}  threshold {params['threshold']:g}\n"
+            f"iterations {params['iterations']}  relaxation {params['relaxation']:g}\n"
+            f"{params['stops'] or 'anomaly colors'} +/-{params['color_range']:g}")
+
+
+def combination_stages(file_path, variable, params, render):
+    """(stage, function, input stages, parameters) of one combination, in run order."""
+    return [
+        ("read", read_stage, (), dict(file_path=file_path, variable=variable)),
+        ("scale", scale_stage, ("read",), dict(variable=variable, scale=params["scale"])),
+        ("threshold", threshold_surface, ("scale",), dict(threshold_value=params["threshold"])),
+        ("smooth", smooth_surface, ("threshold",), dict(iterations=params["iterations"],
+                                                        relaxation=params["relaxation"])),
+        ("in-between", in_between_region, ("scale",), dict(threshold_value=params["threshold"])),
+        ("render", render, ("smooth", "in-between"), dict(stops=params["stops"], color_range=params["color_range"],
+                                                          label=parameter_label(params))),
+    ]
+
+
+def sweep(file_path, grid, variable="temperature anomaly", size=(400, 300), cache=None):
+    """Renders every combination of the grid ({parameter: list of values}); returns [(params, image)] and the cache.
+
+    Without "stops" or "color_range" entries the tiles are colored like
+    mantle_anomoly.py (anomaly_colors() over TEMPERATURE_RANGE).
+    """
+    cache = cache or StageCache()
+    renderer = SweepRenderer(variable, size)
+    axes = [name for name in PARAMETERS if grid.get(name) is not None]
+    plan = []
+    for values in itertools.product(*(grid[name] for name in axes)):
+        params = dict(zip(axes, values))
+        params.setdefault("stops", None)
+        params.setdefault("color_range", TEMPERATURE_RANGE[1])
+        stages = combination_stages(file_path, variable, params, renderer.render)
+        keys = {}
+        for stage, _, inputs, stage_params in stages:
+            keys[stage] = cache.key(stage, (keys[name] for name in inputs), stage_params)
+        plan.append((params, stages, keys))
+    # combinations left that use each output
+    uses = Counter(key for _, _, keys in plan for key in keys.values())
+
+    results = []
+    for params, stages, keys in plan:
+        outputs = {}
+        for stage, function, inputs, stage_params in stages:
+            _, outputs[stage] = cache.run(stage, function, [(keys[name], outputs[name]) for name in inputs],
+                                          **stage_params)
+        results.append((params, outputs["render"]))
+        for key in keys.values():
+            uses[key] -= 1
+            if uses[key] == 0:
+                cache.release(key)
+    return results, cache
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Render a grid of mantle_anomoly.py parameters into a contact sheet')
+    parser.add_argument('file_number', type=int, help='File number')
+    parser.add_argument('--scale', type=float, nargs='+', help='Ranges +/-scale the anomaly is rescaled to', default=[200])
+    parser.add_argument('-t', '--threshold', type=float, nargs='+', help='Thresholds on the scaled anomaly', default=[50])
+    parser.add_argument('--iterations', type=int, nargs='+', help='Smoothing iterations', default=[40])
+    parser.add_argument('--relaxation', type=float, nargs='+', help='Smoothing relaxation factors', default=[0.1])
+    parser.add_argument('--stops', type=str, nargs='+', choices=sorted(NAMED_STOPS),
+                        help="Color maps (default: mantle_anomoly.py's blue-white-red)", default=None)
+    parser.add_argument('--color-range', type=float, nargs='+',
+                        help=f'Color ranges +/-value (default: {TEMPERATURE_RANGE[1]}, as mantle_anomoly.py)',
+                        default=None)
+    parser.add_argument('--columns', type=int, metavar='int', help='Tiles per row of the contact sheet', default=None)
+    parser.add_argument('--size', type=int, nargs=2, metavar='int', help='Tile size in pixels', default=[400, 300])
+    parser.add_argument('-o', '--output', type=str, help='Contact sheet file name', default=None)
+    args = parser.parse_args()
+
+    grid = {"scale": args.scale, "threshold": args.threshold, "iterations": args.iterations,
+            "relaxation": args.relaxation, "stops": args.stops, "color_range": args.color_range}
+    axes = [name for name in PARAMETERS if grid[name] is not None]
+    combinations = int(np.prod([len(grid[name]) for name in axes]))
+    print(f"Sweeping {combinations} combinations of " + ", ".join(f"{name} {grid[name]}" for name in axes)
+          + ("" if args.color_range else f", color range +/-{TEMPERATURE_RANGE[1]}"))
+
+    start = time.perf_counter()
+    results, cache = sweep(data_path(args.file_number), grid, size=tuple(args.size))
+    if len(results) != combinations:
+        raise RuntimeError(f"Rendered {len(results)} tiles for {combinations} combinations")
+    print(f"Rendered {len(results)} combinations in {time.perf_counter() - start:.2f}s")
+    print(cache.report())
+
+    output = args.output or f"output_images/sweep{args.file_number:03d}.png"
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    columns = args.columns or int(np.ceil(np.sqrt(len(results))))
+    write_png(contact_sheet([image for _, image in results], columns), output)
+    print(f"Contact sheet saved as {output}")
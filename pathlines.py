@@ -0,0 +1,280 @@
+'''
+Pathlines: particles advected through the velocity (vx, vy, vz) of a series
+of spherical files, with the velocity interpolated linearly in time between
+neighbouring files.
+
+Only two timesteps are in memory at once: a window holds the cell arrays of
+files k and k + 1 side by side, the particles are integrated (RK4) across
+that interval in vectorized batches, then the window drops file k and reads
+file k + 2 into the freed slot. Positions are interpolated between cell
+centers with SphericalGrid.interpolation_weights; one set of weights serves
+both timesteps of the window.
+
+The files carry no time coordinate, so the time between two files is the
+--interval option, in the time unit of the velocity (velocity x interval is
+km). Without it, the interval is set so the fastest cell of the first file
+moves --travel km between files.
+
+Outputs the trajectories as a .vtp of polylines with "time" and the colored
+variable on the points, and with --render an animation of tubes growing
+along the trajectories (output_images/pathlines.NNNN.png).
+
+Usage:
+    python pathlines.py <start_file_number> <end_file_number> --depth 660 --seeds 500 --render
+    python pathlines.py <start_file_number> <end_file_number> --anomaly 150 --interval 2.5 --substeps 8
+'''
+
+import argparse
+import os
+import time
+import numpy as np
+import mantle_vtk as vtk
+from vtkmodules.util import numpy_support
+from mantle_grid import data_path, read_fields, to_spherical
+from mantle_colors import make_color_transfer_function, stops_for_variable
+from streamlines import seeds_on_shell, seeds_in_anomaly
+from frame_writer import FrameWriter
+
+VELOCITY = ["vx", "vy", "vz"]
+
+
+class VelocityWindow:
+    """Cell arrays of two consecutive files, side by side: values[:, 0] is file k, values[:, 1] file k + 1."""
+
+    def __init__(self, file_path, variable=None):
+        self.variables = VELOCITY + ([variable] if variable else [])
+        self.grid, fields = read_fields(file_path, self.variables)
+        self.values = np.empty((self.grid.number_of_cells, 2, len(self.variables)), dtype=np.float32)
+        self._store(1, fields)
+        self.values[:, 0] = self.values[:, 1]
+        self.read_time = 0.0
+
+    def _store(self, slot, fields):
+        for c, name in enumerate(self.variables):
+            self.values[:, slot, c] = np.ravel(fields[name])
+
+    def advance(self, file_path):
+        """Moves the window one file forward: the newer file becomes the older one, file_path the newer."""
+        start = time.perf_counter()
+        grid, fields = read_fields(file_path, self.variables)
+        if grid.shape != self.grid.shape:
+            raise ValueError(f"{file_path} has a {grid.shape} grid, the series started with {self.grid.shape}")
+        self.values[:, 0] = self.values[:, 1]
+        self._store(1, fields)
+        self.read_time += time.perf_counter() - start
+
+    def sample(self, points, fraction):
+        """Values (n, variables) at the points, `fraction` of the way from file k to k + 1, and the inside mask."""
+        ids, weights, inside = self.grid.interpolation_weights(*to_spherical(points))
+        both = np.einsum("nc,ncsv->nsv", weights, self.values[ids])
+        return (1.0 - fraction) * both[:, 0] + fraction * both[:, 1], inside
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes
+
+
+def advance_particles(window, positions, active, interval, substeps, batch_size=10000):
+    """RK4 steps of all active particles across the window's interval, updating positions/active in place.
+
+    Returns the positions at the end of every substep (substeps, n, 3), NaN
+    where a particle has left the shell, and the sampled variable there.
+    """
+    h = interval / substeps
+    path = np.full((substeps,) + positions.shape, np.nan, dtype=np.float32)
+    values = np.full((substeps, len(positions)), np.nan, dtype=np.float32)
+    has_variable = len(window.variables) > len(VELOCITY)
+    for start in range(0, len(positions), batch_size):
+        idx = start + np.flatnonzero(active[start:start + batch_size])
+        for step in range(substeps):
+            if idx.size == 0:
+                break
+            p = positions[idx]
+            s0, s1 = step / substeps, (step + 1) / substeps
+            k1, ok1 = window.sample(p, s0)
+            k2, ok2 = window.sample(p + 0.5 * h * k1[:, :3], 0.5 * (s0 + s1))
+            k3, ok3 = window.sample(p + 0.5 * h * k2[:, :3], 0.5 * (s0 + s1))
+            k4, ok4 = window.sample(p + h * k3[:, :3], s1)
+            p = p + h / 6.0 * (k1[:, :3] + 2 * k2[:, :3] + 2 * k3[:, :3] + k4[:, :3])
+            sampled, ok5 = window.sample(p, s1)
+            ok = ok1 & ok2 & ok3 & ok4 & ok5
+            active[idx[~ok]] = False
+            idx, p, sampled = idx[ok], p[ok], sampled[ok]
+            positions[idx] = p
+            path[step, idx] = p
+            if has_variable:
+                values[step, idx] = sampled[:, -1]
+    return path, values
+
+
+def trace_pathlines(file_paths, seeds, interval=None, substeps=4, variable="temperature", travel=None,
+                    batch_size=10000):
+    """Advects the seeds from the first file to the last.
+
+    Returns the trajectories (samples, n, 3), the sampled variable (samples,
+    n), the time of every sample and the interval used.
+    """
+    window = VelocityWindow(file_paths[0], variable)
+    if interval is None:
+        speed = np.linalg.norm(window.values[:, 1, :3], axis=1).max()
+        if travel is None:
+            travel = 5 * np.min(np.abs(np.diff(window.grid.r_bounds)))
+        interval = travel / speed if speed > 0 else 1.0
+    positions = np.array(seeds, dtype=np.float64)
+    active = np.ones(len(positions), dtype=bool)
+
+    first, _ = window.sample(positions, 1.0)
+    paths = [positions[None].astype(np.float32)]
+    values = [first[None, :, -1] if variable else np.full((1, len(positions)), np.nan, dtype=np.float32)]
+    for file_path in file_paths[1:]:
+        window.advance(file_path)
+        path, sampled = advance_particles(window, positions, active, interval, substeps, batch_size)
+        paths.append(path)
+        values.append(sampled)
+    times = interval * np.arange(1 + substeps * (len(file_paths) - 1)) / substeps
+    print(f"Window of two timesteps: {window.nbytes / 2 ** 20:.1f} MB, reads {window.read_time:.2f}s")
+    return np.concatenate(paths), np.concatenate(values), times, interval
+
+
+def trajectory_polylines(trajectories, values, times, variable, samples=None):
+    """Polydata with one polyline per particle, over its first `samples` positions (all if None)."""
+    trajectories = trajectories[:samples]
+    values = values[:samples]
+    # a particle's trajectory ends at its first NaN
+    lengths = np.argmin(np.isfinite(trajectories[..., 0]), axis=0)
+    lengths[np.isfinite(trajectories[-1, :, 0])] = len(trajectories)
+    keep = np.flatnonzero(lengths > 1)
+    lengths = lengths[keep]
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+    particle = np.repeat(keep, lengths)
+    step = np.arange(offsets[-1]) - np.repeat(offsets[:-1], lengths)
+
+    polydata = vtk.vtkPolyData()
+    vtk_points = vtk.vtkPoints()
+    vtk_points.SetData(numpy_support.numpy_to_vtk(np.ascontiguousarray(trajectories[step, particle]), deep=1))
+    polydata.SetPoints(vtk_points)
+    lines = vtk.vtkCellArray()
+    lines.SetData(numpy_support.numpy_to_vtkIdTypeArray(offsets, deep=1),
+                  numpy_support.numpy_to_vtkIdTypeArray(np.arange(offsets[-1], dtype=np.int64), deep=1))
+    polydata.SetLines(lines)
+    for name, array in (("time", times[step].astype(np.float32)), (variable, values[step, particle])):
+        if name is None:
+            continue
+        vtk_array = numpy_support.numpy_to_vtk(np.ascontiguousarray(array), deep=1)
+        vtk_array.SetName(name)
+        polydata.GetPointData().AddArray(vtk_array)
+    return polydata
+
+
+def render_growing_tubes(trajectories, values, times, variable, vmin, vmax, pattern, radius, size=(1600, 1200),
+                         workers=2):
+    """One frame per sample, with the tubes drawn up to that sample; returns the number of frames."""
+    lut = make_color_transfer_function(stops_for_variable(variable), vmin, vmax)
+    tubes = vtk.vtkTubeFilter()
+    tubes.SetRadius(radius)
+    tubes.SetNumberOfSides(8)
+    tubes.CappingOn()
+    mapper = vtk.vtkPolyDataMapper()
+    mapper.SetInputConnection(tubes.GetOutputPort())
+    mapper.SetScalarModeToUsePointFieldData()
+    mapper.SelectColorArray(variable)
+    mapper.SetScalarRange(vmin, vmax)
+    mapper.SetLookupTable(lut)
+    actor = vtk.vtkActor()
+    actor.SetMapper(mapper)
+    transform = vtk.vtkTransform()
+    transform.RotateX(25)
+    transform.RotateY(-45)
+    actor.SetUserTransform(transform)
+
+    renderer = vtk.vtkRenderer()
+    renderer.AddActor(actor)
+    scalar_bar = vtk.vtkScalarBarActor()
+    scalar_bar.SetLookupTable(lut)
+    scalar_bar.SetTitle(variable)
+    scalar_bar.SetNumberOfLabels(5)
+    renderer.AddViewProp(scalar_bar)
+    label = vtk.vtkTextActor()
+    label.GetTextProperty().SetFontSize(24)
+    label.SetDisplayPosition(20, 20)
+    renderer.AddViewProp(label)
+    renderer.SetBackground(0.1, 0.2, 0.4)
+
+    render_window = vtk.vtkRenderWindow()
+    render_window.SetOffScreenRendering(1)
+    render_window.AddRenderer(renderer)
+    render_window.SetSize(*size)
+    # the camera is fitted to the complete trajectories, so it stays put while the tubes grow
+    tubes.SetInputData(trajectory_polylines(trajectories, values, times, variable))
+    tubes.Update()
+    renderer.ResetCamera()
+    renderer.GetActiveCamera().Zoom(1.3)
+
+    frames = 0
+    with FrameWriter(workers=workers) as writer:
+        for n in range(2, len(trajectories) + 1):
+            tubes.SetInputData(trajectory_polylines(trajectories, values, times, variable, n))
+            label.SetInput(f"t = {times[n - 1]:.3g}")
+            render_window.Render()
+            writer.submit(render_window, pattern.format(frames + 1))
+            frames += 1
+    render_window.Finalize()
+    return frames
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Pathlines of the mantle velocity through a series of files')
+    parser.add_argument('start', type=int, help='First file number')
+    parser.add_argument('end', type=int, help='Last file number')
+    seeding = parser.add_mutually_exclusive_group()
+    seeding.add_argument('--depth', type=float, help='Seed on the shell at this depth (km)', default=660.0)
+    seeding.add_argument('--anomaly', type=float, help='Seed where |temperature anomaly| is above this value',
+                         default=None)
+    parser.add_argument('--seeds', type=int, metavar='int', help='Number of particles', default=500)
+    parser.add_argument('--interval', type=float, help='Time between two files, in the time unit of the velocity',
+                        default=None)
+    parser.add_argument('--travel', type=float,
+                        help='Without --interval: distance (km) the fastest cell moves between files', default=None)
+    parser.add_argument('--substeps', type=int, metavar='int', help='RK4 steps (and trajectory samples) per file',
+                        default=4)
+    parser.add_argument('--batch', type=int, metavar='int', help='Particles advanced together', default=10000)
+    parser.add_argument('-v', '--variable', type=str, help='Variable sampled along the trajectories',
+                        default='temperature')
+    parser.add_argument('--render', action='store_true', help='Also render the growing tubes, one frame per sample')
+    parser.add_argument('--tube-radius', type=float, help='Tube radius (km)', default=15.0)
+    parser.add_argument('-o', '--output', type=str, metavar='dirname', help='Output directory for the .vtp',
+                        default='output_pathlines')
+    args = parser.parse_args()
+
+    file_paths = [data_path(n) for n in range(args.start, args.end + 1)]
+    if len(file_paths) < 2:
+        parser.error("pathlines need at least two files")
+    grid, fields = read_fields(file_paths[0], ["temperature anomaly"])
+    if args.anomaly is not None:
+        seeds = seeds_in_anomaly(grid, fields["temperature anomaly"], args.anomaly, args.seeds)
+    else:
+        seeds = seeds_on_shell(grid, args.depth, args.seeds)
+    del fields
+
+    start = time.perf_counter()
+    trajectories, values, times, interval = trace_pathlines(file_paths, seeds, args.interval, args.substeps,
+                                                           args.variable, args.travel, args.batch)
+    alive = np.isfinite(trajectories[-1, :, 0]).sum()
+    print(f"Advected {len(seeds)} particles over {len(file_paths)} files (interval {interval:.4g}, "
+          f"{args.substeps} substeps) in {time.perf_counter() - start:.2f}s; {alive} still inside the shell")
+
+    os.makedirs(args.output, exist_ok=True)
+    output_file = os.path.join(args.output, f"pathlines{args.start:03d}_{args.end:03d}.vtp")
+    writer = vtk.vtkXMLPolyDataWriter()
+    writer.SetFileName(output_file)
+    writer.SetInputData(trajectory_polylines(trajectories, values, times, args.variable))
+    writer.Write()
+    print(f"Saved {output_file}")
+
+    if args.render:
+        os.makedirs("output_images", exist_ok=True)
+        start = time.perf_counter()
+        frames = render_growing_tubes(trajectories, values, times, args.variable,
+                                      float(np.nanmin(values)), float(np.nanmax(values)),
+                                      "output_images/pathlines.{:04d}.png", args.tube_radius)
+        print(f"Rendered {frames} frames in {time.perf_counter() - start:.2f}s")
@@ -0,0 +1,184 @@
+'''
+Labels hot (plume) and cold (slab) temperature anomaly regions in every
+timestep and links them over time.
+
+Connected regions are found with scipy.ndimage.label on the [r, lat, lon]
+arrays (face neighbours), then regions touching across the longitude seam
+are merged. Volume, centroid and peak values come from bincount-style
+reductions, and regions of consecutive timesteps are linked by the volume
+they share.
+
+Usage:
+    python plume_tracking.py <start_file_number> <end_file_number> --threshold 100
+'''
+
+import argparse
+import csv
+import os
+import time
+import numpy as np
+import scipy.ndimage
+import scipy.sparse
+import scipy.sparse.csgraph
+from mantle_grid import data_path, read_fields, to_spherical
+
+HOT, COLD = 1, -1
+
+REGION_COLUMNS = ["step", "region", "kind", "track", "parent", "cells", "volume",
+                  "depth", "lat", "lon", "peak", "mean"]
+LINK_COLUMNS = ["step", "previous_region", "region", "overlap_volume"]
+
+
+def label_regions(mask, periodic=True):
+    """Connected components of a [r, lat, lon] mask, glued across the longitude seam.
+
+    Returns the label array (0 = background, 1..n) and n.
+    """
+    labels, n = scipy.ndimage.label(mask)
+    if n == 0 or not periodic:
+        return labels, n
+    first, last = labels[:, :, 0], labels[:, :, -1]
+    touching = (first > 0) & (last > 0)
+    if not touching.any():
+        return labels, n
+    # union the labels facing each other over the seam
+    graph = scipy.sparse.coo_matrix((np.ones(touching.sum()), (first[touching], last[touching])),
+                                    shape=(n + 1, n + 1))
+    _, component = scipy.sparse.csgraph.connected_components(graph, directed=False)
+    # renumber so the background stays 0 and regions are 1..m
+    _, renumbered = np.unique(component[1:], return_inverse=True)
+    lookup = np.concatenate([[0], renumbered + 1])
+    return lookup[labels], int(renumbered.max()) + 1
+
+
+def region_statistics(grid, labels, n, anomaly, volumes):
+    """Per-region cell count, volume, volume-weighted centroid, peak and mean anomaly."""
+    flat = labels.reshape(-1)
+    index = np.arange(1, n + 1)
+    cells = np.bincount(flat, minlength=n + 1)[1:]
+    volume = np.bincount(flat, weights=volumes.reshape(-1), minlength=n + 1)[1:]
+    # Cartesian cell centers one component at a time, to keep a single full-size temporary
+    lat, lon = np.radians(grid.lat)[None, :, None], np.radians(grid.lon)[None, None, :]
+    r = grid.r[:, None, None]
+    components = (lambda: r * np.cos(lat) * np.cos(lon),
+                  lambda: r * np.cos(lat) * np.sin(lon),
+                  lambda: r * np.sin(lat) + 0 * lon)
+    centroid = np.stack([np.bincount(flat, weights=(volumes * component()).reshape(-1), minlength=n + 1)[1:]
+                         for component in components], axis=1) / volume[:, None]
+    mean = np.bincount(flat, weights=(anomaly * volumes).reshape(-1), minlength=n + 1)[1:] / volume
+    peak_max = scipy.ndimage.maximum(anomaly, labels, index)
+    peak_min = scipy.ndimage.minimum(anomaly, labels, index)
+    peak = np.where(mean >= 0, peak_max, peak_min)
+    return cells, volume, centroid, peak, mean
+
+
+class PlumeTracker:
+    """Labels each timestep and links its regions to the ones of the previous timestep."""
+
+    def __init__(self, grid, threshold, min_cells=1):
+        self.grid = grid
+        self.threshold = threshold
+        self.min_cells = min_cells
+        self.volumes = grid.cell_volumes()
+        self.previous = None
+        self.previous_kinds = None
+        self.previous_tracks = None
+        self.next_track = 0
+
+    def label(self, anomaly):
+        """One label array for both kinds: hot regions first, then cold ones."""
+        hot, n_hot = label_regions(anomaly > self.threshold, self.grid.periodic)
+        cold, n_cold = label_regions(anomaly < -self.threshold, self.grid.periodic)
+        labels = np.where(cold > 0, cold + n_hot, hot)
+        kinds = np.concatenate([np.full(n_hot, HOT), np.full(n_cold, COLD)])
+        n = n_hot + n_cold
+
+        cells = np.bincount(labels.reshape(-1), minlength=n + 1)[1:]
+        keep = cells >= self.min_cells
+        if not keep.all():
+            # drop the small regions and renumber the others
+            lookup = np.zeros(n + 1, dtype=labels.dtype)
+            lookup[1:][keep] = np.arange(1, keep.sum() + 1)
+            labels = lookup[labels]
+            kinds = kinds[keep]
+            n = int(keep.sum())
+        return labels, n, kinds
+
+    def link(self, labels, n, kinds):
+        """Overlap volumes with the previous regions of the same kind, as (previous, current, volume) rows."""
+        if self.previous is None:
+            return np.zeros((0, 3))
+        both = (self.previous > 0) & (labels > 0)
+        previous_labels, current_labels = self.previous[both], labels[both]
+        pairs = scipy.sparse.coo_matrix((self.volumes[both], (previous_labels, current_labels)),
+                                        shape=(self.previous.max() + 1, n + 1)).tocsr()
+        pairs.sum_duplicates()
+        pairs = pairs.tocoo()
+        same_kind = self.previous_kinds[pairs.row - 1] == kinds[pairs.col - 1]
+        return np.stack([pairs.row, pairs.col, pairs.data], axis=1)[same_kind]
+
+    def update(self, step, anomaly):
+        """Processes one timestep; returns its region rows and link rows."""
+        labels, n, kinds = self.label(anomaly)
+        cells, volume, centroid, peak, mean = region_statistics(self.grid, labels, n, anomaly, self.volumes)
+        links = self.link(labels, n, kinds)
+
+        # each region follows the previous region it overlaps most; if several
+        # regions follow the same one (a split), the largest overlap keeps the track
+        parent = np.zeros(n + 1, dtype=np.int64)
+        tracks = np.full(n + 1, -1, dtype=np.int64)
+        if len(links):
+            order = np.lexsort((-links[:, 2], links[:, 1]))
+            best = links[order][np.unique(links[order][:, 1], return_index=True)[1]]
+            current, previous, overlap = best[:, 1].astype(int), best[:, 0].astype(int), best[:, 2]
+            parent[current] = previous
+            order = np.lexsort((-overlap, previous))
+            heir = current[order][np.unique(previous[order], return_index=True)[1]]
+            tracks[heir] = self.previous_tracks[parent[heir]]
+        new = np.flatnonzero(tracks[1:] < 0) + 1
+        tracks[new] = self.next_track + np.arange(new.size)
+        self.next_track += new.size
+
+        r, lat, lon = to_spherical(centroid)
+        rows = [[step, region + 1, "hot" if kinds[region] == HOT else "cold", int(tracks[region + 1]),
+                 int(parent[region + 1]), int(cells[region]), float(volume[region]),
+                 float(self.grid.outer_radius - r[region]), float(lat[region]), float(lon[region]),
+                 float(peak[region]), float(mean[region])] for region in range(n)]
+        link_rows = [[step, int(a), int(b), float(v)] for a, b, v in links]
+
+        self.previous = labels
+        self.previous_kinds = kinds
+        self.previous_tracks = tracks
+        return rows, link_rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Label and track hot/cold anomaly regions over a run')
+    parser.add_argument('start', type=int, help='First file number')
+    parser.add_argument('end', type=int, help='Last file number')
+    parser.add_argument('-t', '--threshold', type=float, help='|temperature anomaly| threshold (K)', default=100.0)
+    parser.add_argument('--min-cells', type=int, metavar='int', help='Ignore regions with fewer cells', default=8)
+    parser.add_argument('-o', '--output', type=str, metavar='dirname', help='Output directory', default='mantle_data/plumes')
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    regions_file = os.path.join(args.output, "regions.csv")
+    links_file = os.path.join(args.output, "links.csv")
+    tracker = None
+    with open(regions_file, "w", newline="") as regions_out, open(links_file, "w", newline="") as links_out:
+        regions_writer = csv.writer(regions_out)
+        links_writer = csv.writer(links_out)
+        regions_writer.writerow(REGION_COLUMNS)
+        links_writer.writerow(LINK_COLUMNS)
+        for file_number in range(args.start, args.end + 1):
+            grid, fields = read_fields(data_path(file_number), ["temperature anomaly"])
+            if tracker is None:
+                tracker = PlumeTracker(grid, args.threshold, args.min_cells)
+            start = time.perf_counter()
+            rows, link_rows = tracker.update(file_number, fields["temperature anomaly"])
+            regions_writer.writerows(rows)
+            links_writer.writerows(link_rows)
+            n_hot = sum(1 for row in rows if row[2] == "hot")
+            print(f"File {file_number:03d}: {n_hot} hot and {len(rows) - n_hot} cold regions, "
+                  f"{len(link_rows)} links ({time.perf_counter() - start:.2f}s)")
+    print(f"Saved {regions_file} and {links_file}")
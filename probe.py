@@ -0,0 +1,156 @@
+'''
+Values of the mantle variables at arbitrary (lat, lon, depth) locations,
+e.g. station lists or the samples of a line plot.
+
+A location maps straight to structured cell indices of the spherical grid,
+and values are interpolated trilinearly in (r, lat, lon) between cell
+centers (mantle_grid.SphericalGrid.interpolation_weights), vectorized over
+all points. The indices and weights only depend on the grid, so they are
+computed once and applied to every timestep as a gather + weighted sum.
+
+Usage:
+    python probe.py stations.csv <start_file_number> <end_file_number> -v temperature "temperature anomaly"
+    python probe.py --random 1000000 <start_file_number> <end_file_number>
+
+A station file has the columns name, lat, lon, depth (km below the surface).
+'''
+
+import argparse
+import csv
+import time
+import numpy as np
+from mantle_grid import data_path, read_fields
+
+COLUMNS = ["file_number", "station", "lat", "lon", "depth"]
+
+
+class Probe:
+    """Interpolation of cell arrays at fixed (lat, lon, depth) points of one grid layout."""
+
+    def __init__(self, grid, lat, lon, depth):
+        self.lat, self.lon, self.depth = (np.ravel(a).astype(np.float64) for a in np.broadcast_arrays(lat, lon, depth))
+        self.grid = grid
+        start = time.perf_counter()
+        self.ids, self.weights, self.inside = grid.interpolation_weights(grid.outer_radius - self.depth,
+                                                                         self.lat, self.lon)
+        self.index_time = time.perf_counter() - start
+
+    def __len__(self):
+        return self.lat.size
+
+    def matches(self, grid):
+        """True when the weights are valid for `grid` (same cells as the grid they were computed on)."""
+        return all(np.array_equal(a, b) for a, b in ((self.grid.r_bounds, grid.r_bounds),
+                                                     (self.grid.lat_bounds, grid.lat_bounds),
+                                                     (self.grid.lon_bounds, grid.lon_bounds)))
+
+    def sample(self, values):
+        """Interpolated values at the points (NaN outside the shell) of an [r, lat, lon] or flat cell array."""
+        flat = np.ravel(values)
+        result = np.einsum("nc,nc->n", self.weights, np.take(flat, self.ids))
+        result[~self.inside] = np.nan
+        return result
+
+
+def line_points(start, end, n):
+    """n (lat, lon, depth) samples from start to end: along the great circle, with depth changing linearly."""
+    (lat0, lon0, depth0), (lat1, lon1, depth1) = start, end
+    a = np.array([np.cos(np.radians(lat0)) * np.cos(np.radians(lon0)),
+                  np.cos(np.radians(lat0)) * np.sin(np.radians(lon0)), np.sin(np.radians(lat0))])
+    b = np.array([np.cos(np.radians(lat1)) * np.cos(np.radians(lon1)),
+                  np.cos(np.radians(lat1)) * np.sin(np.radians(lon1)), np.sin(np.radians(lat1))])
+    angle = np.arccos(np.clip(a @ b, -1.0, 1.0))
+    t = np.linspace(0.0, 1.0, n)
+    if angle < 1e-12:
+        points = np.repeat(a[None], n, axis=0)
+    else:
+        points = (np.sin((1 - t) * angle)[:, None] * a + np.sin(t * angle)[:, None] * b) / np.sin(angle)
+    lat = np.degrees(np.arcsin(np.clip(points[:, 2], -1.0, 1.0)))
+    lon = np.degrees(np.arctan2(points[:, 1], points[:, 0]))
+    return lat, lon, depth0 + t * (depth1 - depth0)
+
+
+class ProbeSeries:
+    """Probes the same points in many files, reusing the weights while the grid stays the same."""
+
+    def __init__(self, lat, lon, depth):
+        self.points = (lat, lon, depth)
+        self.probe = None
+        self.index_time = 0.0
+        self.read_time = 0.0
+        self.sample_time = 0.0
+
+    def sample_file(self, file_path, variables):
+        """{variable: values at the points} for one file."""
+        start = time.perf_counter()
+        grid, fields = read_fields(file_path, variables)
+        self.read_time += time.perf_counter() - start
+        if self.probe is None or not self.probe.matches(grid):
+            self.probe = Probe(grid, *self.points)
+            self.index_time += self.probe.index_time
+        start = time.perf_counter()
+        samples = {name: self.probe.sample(fields[name]) for name in variables}
+        self.sample_time += time.perf_counter() - start
+        return samples
+
+
+def read_stations(file_name):
+    """Names and lat, lon, depth arrays from a CSV with the columns name, lat, lon, depth."""
+    with open(file_name, newline="") as stations_file:
+        rows = list(csv.DictReader(stations_file))
+    if not rows:
+        raise ValueError(f"No stations in {file_name}")
+    return ([row["name"] for row in rows],
+            *(np.array([float(row[column]) for row in rows]) for column in ("lat", "lon", "depth")))
+
+
+def random_points(n, max_depth, seed=0):
+    """n points spread uniformly over the sphere and in depth, for benchmarking."""
+    rng = np.random.default_rng(seed)
+    lat = np.degrees(np.arcsin(rng.uniform(-1.0, 1.0, n)))
+    return lat, rng.uniform(-180.0, 180.0, n), rng.uniform(0.0, max_depth, n)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Sample variables at (lat, lon, depth) points over many timesteps')
+    parser.add_argument('stations', type=str, nargs='?', help='CSV with name, lat, lon, depth columns', default=None)
+    parser.add_argument('start', type=int, help='First file number')
+    parser.add_argument('end', type=int, help='Last file number')
+    parser.add_argument('-v', '--variables', type=str, nargs='+', help='Variables to sample',
+                        default=['temperature', 'temperature anomaly'])
+    parser.add_argument('--random', type=int, metavar='int',
+                        help='Probe this many random points instead of stations (no CSV output)', default=None)
+    parser.add_argument('-o', '--output', type=str, help='Output CSV', default='probes.csv')
+    args = parser.parse_args()
+    if (args.stations is None) == (args.random is None):
+        parser.error("give either a station file or --random")
+
+    file_numbers = range(args.start, args.end + 1)
+    if args.random:
+        grid, _ = read_fields(data_path(args.start), args.variables[:1])
+        names = None
+        lat, lon, depth = random_points(args.random, grid.r_bounds.max() - grid.r_bounds.min())
+    else:
+        names, lat, lon, depth = read_stations(args.stations)
+    series = ProbeSeries(lat, lon, depth)
+
+    out = None
+    if names is not None:
+        out = open(args.output, "w", newline="")
+        writer = csv.writer(out)
+        writer.writerow(COLUMNS + args.variables)
+    for file_number in file_numbers:
+        samples = series.sample_file(data_path(file_number), args.variables)
+        if out is not None:
+            columns = [samples[name] for name in args.variables]
+            writer.writerows([file_number, name, lat[i], lon[i], depth[i]] + [column[i] for column in columns]
+                             for i, name in enumerate(names))
+    if out is not None:
+        out.close()
+        print(f"Samples saved to {args.output}")
+
+    n, steps = len(series.probe), len(file_numbers)
+    sampled = n * steps * len(args.variables)
+    print(f"{n} points x {steps} files x {len(args.variables)} variables: indices {series.index_time:.2f}s "
+          f"(once), reads {series.read_time:.2f}s, interpolation {series.sample_time:.2f}s "
+          f"({sampled / max(series.sample_time, 1e-9) / 1e6:.1f} M values/s)")
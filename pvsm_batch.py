@@ -0,0 +1,232 @@
+'''
+Headless batch rendering of the saved ParaView states (paraview/*.pvsm) over
+a range of timesteps.
+
+The driver (plain python or pvpython) splits the file numbers over worker
+processes running pvbatch. Each worker loads the state once, with its
+netCDFReader proxies pointed at the worker's first file, and then for every
+file only rebinds the readers' FileName and saves a screenshot of every
+render view:
+
+    output_images/<state>_<view>_<file_number>.png
+
+File number N stands for the state's first saved file: every reader keeps
+its own saved files (a single file or a series) shifted by N minus that
+first number, so a state comparing spherical001.nc with spherical002.nc
+renders N next to N + 1, and a 90-file series stays a 90-file series
+starting at N.
+
+Usage:
+    python pvsm_batch.py paraview/mantle_lic.pvsm <start_file_number> <end_file_number> -j 4
+
+The repo has a paraview.py script, which would shadow ParaView's own
+`paraview` package since pvbatch puts this directory first on sys.path; the
+worker leaves the directory out of the path only while importing
+paraview.simple.
+'''
+
+import argparse
+import os
+import re
+import shutil
+import subprocess
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+READER_TYPE = "netCDFReader"
+FILE_NUMBER = re.compile(r"(\d+)\.nc$")
+
+
+def state_readers(state_file):
+    """(proxy id, file names) of every NetCDF reader saved in a state file."""
+    readers = []
+    for proxy in ET.parse(state_file).getroot().iter("Proxy"):
+        if proxy.get("group") == "sources" and proxy.get("type") == READER_TYPE:
+            file_names = [element.get("value") for prop in proxy.findall("Property") if prop.get("name") == "FileName"
+                          for element in prop.findall("Element")]
+            readers.append((int(proxy.get("id")), file_names))
+    return readers
+
+
+def saved_number(file_name):
+    match = FILE_NUMBER.search(os.path.basename(file_name))
+    if match is None:
+        raise ValueError(f"{file_name}: no file number to shift")
+    return int(match.group(1))
+
+
+def first_saved_number(readers):
+    """The file number the state was saved at: the lowest one over all readers."""
+    return min(saved_number(name) for _, file_names in readers for name in file_names)
+
+
+def shifted_files(readers, file_number, data_dir="mantle_data"):
+    """{proxy id: file paths} of every reader for one file number, series kept as series."""
+    offset = file_number - first_saved_number(readers)
+    return {proxy_id: [os.path.abspath(data_path(saved_number(name) + offset, data_dir)) for name in file_names]
+            for proxy_id, file_names in readers}
+
+
+def output_name(pattern, state_file, view_name, file_number):
+    state = os.path.splitext(os.path.basename(state_file))[0].replace(" ", "_")
+    return pattern.format(state=state, view=view_name.replace(" ", "_"), file_number=file_number)
+
+
+def import_paraview():
+    """paraview.simple and servermanager, only importable under pvpython/pvbatch.
+
+    The directory of this script is left out of sys.path for the import, so
+    the repo's paraview.py does not shadow ParaView's package.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    saved_path = sys.path
+    sys.path = [path for path in sys.path if os.path.abspath(path or os.curdir) != here]
+    try:
+        import paraview.simple as pvs
+        from paraview import servermanager
+    finally:
+        sys.path = saved_path
+    return pvs, servermanager
+
+
+class StateRenderer:
+    """A state loaded once in pvbatch, re-rendered for other files by swapping the readers' FileName."""
+
+    def __init__(self, state_file, file_number, data_dir="mantle_data", resolution=None):
+        pvs, servermanager = import_paraview()
+        self.pvs = pvs
+        self.state_file = state_file
+        self.data_dir = data_dir
+        self.resolution = resolution
+        self.saved = state_readers(state_file)
+        start = time.perf_counter()
+        files = shifted_files(self.saved, file_number, data_dir)
+        pvs.LoadState(state_file, filenames=[{"id": proxy_id, "FileName": paths} for proxy_id, paths in files.items()])
+        # the loaded proxies get new ids, so they are matched back to the saved readers by the files given to them
+        by_files = {tuple(paths): proxy_id for proxy_id, paths in files.items()}
+        self.readers = []
+        for source in pvs.GetSources().values():
+            if source.GetXMLName() != READER_TYPE:
+                continue
+            loaded = tuple(source.FileName) if not isinstance(source.FileName, str) else (source.FileName,)
+            if loaded not in by_files:
+                raise RuntimeError(f"{state_file}: a {READER_TYPE} was not rebound ({loaded[:1]})")
+            self.readers.append((by_files[loaded], source))
+        if len(self.readers) != len(self.saved):
+            raise RuntimeError(f"{state_file}: {len(self.saved)} readers saved, {len(self.readers)} loaded")
+        self.views = sorted((name, view) for (name, _), view in
+                            servermanager.ProxyManager().GetProxiesInGroup("views").items()
+                            if view.GetXMLName() == "RenderView")
+        self.scene = pvs.GetAnimationScene()
+        # the saved time step, as an index, so a shifted series shows the same step of the new files
+        times = self.times()
+        self.time_index = min(range(len(times)), key=lambda i: abs(times[i] - self.scene.AnimationTime)) if times else 0
+        self.load_time = time.perf_counter() - start
+        self.file_number = file_number
+
+    def times(self):
+        values = self.scene.TimeKeeper.TimestepValues
+        return list(values) if hasattr(values, "__len__") else [values]
+
+    def rebind(self, file_number):
+        """Points every reader at its own files shifted to `file_number` and restores the saved time step."""
+        if file_number == self.file_number:
+            return
+        files = shifted_files(self.saved, file_number, self.data_dir)
+        for proxy_id, reader in self.readers:
+            reader.FileName = files[proxy_id]
+            reader.UpdatePipelineInformation()
+        self.scene.UpdateAnimationUsingDataTimeSteps()
+        times = self.times()
+        if times:
+            self.scene.AnimationTime = times[min(self.time_index, len(times) - 1)]
+        self.file_number = file_number
+
+    def render(self, file_number, pattern):
+        """Saves every render view for one file number; returns the image names."""
+        self.rebind(file_number)
+        file_names = []
+        for name, view in self.views:
+            file_name = output_name(pattern, self.state_file, name, file_number)
+            os.makedirs(os.path.dirname(file_name) or ".", exist_ok=True)
+            self.pvs.Render(view)
+            if self.resolution:
+                self.pvs.SaveScreenshot(file_name, view, ImageResolution=self.resolution)
+            else:
+                self.pvs.SaveScreenshot(file_name, view)
+            file_names.append(file_name)
+        return file_names
+
+
+def run_worker(args, file_numbers):
+    """Runs inside pvbatch: renders the given file numbers with one loaded state."""
+    renderer = StateRenderer(args.state, file_numbers[0], args.data_dir, args.resolution)
+    print(f"[worker {args.worker}] loaded {args.state} in {renderer.load_time:.2f}s "
+          f"({len(renderer.readers)} readers, {len(renderer.views)} views)", flush=True)
+    for file_number in file_numbers:
+        start = time.perf_counter()
+        file_names = renderer.render(file_number, args.output)
+        print(f"[worker {args.worker}] file {file_number:03d}: {len(file_names)} views in "
+              f"{time.perf_counter() - start:.2f}s", flush=True)
+
+
+def worker_command(args, index):
+    command = [args.pvbatch, os.path.abspath(__file__), args.state, str(args.start), str(args.end),
+               "--data-dir", args.data_dir, "-o", args.output, "-j", str(args.jobs), "--worker", str(index)]
+    if args.resolution:
+        command += ["--resolution"] + [str(n) for n in args.resolution]
+    return command
+
+
+def data_path(file_number, data_dir="mantle_data"):
+    # mantle_grid.data_path, without importing VTK into the driver
+    return os.path.join(data_dir, f"spherical{file_number:03d}.nc")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Render a ParaView state for a range of timesteps with pvbatch workers')
+    parser.add_argument('state', type=str, help='ParaView state file (.pvsm)')
+    parser.add_argument('start', type=int, help='First file number')
+    parser.add_argument('end', type=int, help='Last file number')
+    parser.add_argument('-j', '--jobs', type=int, metavar='int', help='pvbatch worker processes', default=2)
+    parser.add_argument('--data-dir', type=str, help='Directory of the spherical NetCDF files', default='mantle_data')
+    parser.add_argument('-o', '--output', type=str, metavar='pattern',
+                        help='Output pattern with {state}, {view} and {file_number}',
+                        default='output_images/{state}_{view}_{file_number:03d}.png')
+    parser.add_argument('--resolution', type=int, nargs=2, metavar='int', help='Image size (default: the view size)',
+                        default=None)
+    parser.add_argument('--pvbatch', type=str, help='pvbatch (or pvpython) executable', default='pvbatch')
+    parser.add_argument('--worker', type=int, help=argparse.SUPPRESS, default=None)
+    args = parser.parse_args()
+
+    file_numbers = list(range(args.start, args.end + 1))
+    if args.worker is not None:
+        # interleaved, so every worker gets early and late timesteps
+        run_worker(args, file_numbers[args.worker::args.jobs])
+        sys.exit(0)
+
+    if shutil.which(args.pvbatch) is None:
+        parser.error(f"{args.pvbatch} not found; point --pvbatch at ParaView's pvbatch or pvpython")
+    readers = state_readers(args.state)
+    if not readers:
+        parser.error(f"{args.state} has no {READER_TYPE} to rebind")
+    try:
+        files = [shifted_files(readers, n, args.data_dir) for n in file_numbers]
+    except ValueError as error:
+        parser.error(str(error))
+    # every reader of every file number, series included
+    missing = sorted({path for step in files for paths in step.values() for path in paths if not os.path.exists(path)})
+    if missing:
+        parser.error(f"{len(missing)} missing data files: {', '.join(missing[:5])}")
+    series = max(len(file_names) for _, file_names in readers)
+    print(f"{args.state}: {len(readers)} readers, {series} files in the longest series, "
+          f"{len(file_numbers)} file numbers over {args.jobs} workers")
+
+    start = time.perf_counter()
+    jobs = min(args.jobs, len(file_numbers))
+    workers = [subprocess.Popen(worker_command(args, index)) for index in range(jobs)]
+    failed = [index for index, worker in enumerate(workers) if worker.wait() != 0]
+    print(f"Rendered {len(file_numbers)} files in {time.perf_counter() - start:.2f}s")
+    if failed:
+        sys.exit(f"workers {failed} failed")
@@ -0,0 +1,141 @@
+'''
+Radial profiles over a whole run: for every timestep and every radial layer,
+the area-weighted mean, standard deviation and percentiles of temperature
+and temperature anomaly.
+
+Cells are binned by their radial index (the [r, lat, lon] layout of
+mantle_grid), so every statistic is a row-wise reduction over the
+(lat, lon) cells of a layer. Timesteps are processed in parallel and the
+result is saved as one compact (time, variable, statistic, depth) array,
+with a heatmap of a chosen statistic against time and depth.
+
+Usage:
+    python radial_profiles.py <start_file_number> <end_file_number> --workers 8 --plot
+'''
+
+import argparse
+import os
+import time
+import numpy as np
+from multiprocessing import Pool
+from mantle_grid import data_path, read_fields
+
+PROFILE_VARIABLES = ["temperature", "temperature anomaly"]
+
+
+def statistic_names(percentiles):
+    return ["mean", "std"] + [f"p{q:g}" for q in percentiles]
+
+
+def layer_profiles(values, area, percentiles):
+    """Area-weighted statistics of every radial layer of a [r, lat, lon] array, as (n_statistics, n_r)."""
+    layers = values.reshape(values.shape[0], -1).astype(np.float64)
+    w = np.broadcast_to(area.reshape(-1), layers.shape)
+    total = w[0].sum()
+    mean = layers @ w[0] / total
+    std = np.sqrt(np.maximum((layers - mean[:, None]) ** 2 @ w[0] / total, 0.0))
+
+    # weighted percentiles: sort each layer, accumulate its weights and
+    # interpolate between the midpoints of the cumulative weights
+    order = np.argsort(layers, axis=1)
+    sorted_values = np.take_along_axis(layers, order, axis=1)
+    sorted_weights = np.take_along_axis(w, order, axis=1)
+    midpoints = (np.cumsum(sorted_weights, axis=1) - 0.5 * sorted_weights) / total
+    rows = np.arange(layers.shape[0])
+    result = [mean, std]
+    for q in percentiles:
+        upper = np.clip((midpoints < q / 100.0).sum(axis=1), 1, layers.shape[1] - 1)
+        lower = upper - 1
+        x0, x1 = midpoints[rows, lower], midpoints[rows, upper]
+        t = np.clip((q / 100.0 - x0) / np.where(x1 > x0, x1 - x0, 1.0), 0.0, 1.0)
+        result.append(sorted_values[rows, lower] * (1 - t) + sorted_values[rows, upper] * t)
+    return np.stack(result)
+
+
+def file_profiles(job):
+    """(variable, statistic, r) profiles of one file."""
+    file_number, variables, percentiles = job
+    grid, fields = read_fields(data_path(file_number), variables)
+    # every cell of a layer has the same radial extent, so its area is its weight
+    area = grid.cell_volumes()[0]
+    profiles = np.stack([layer_profiles(fields[name], area, percentiles) for name in variables])
+    return file_number, grid, profiles.astype(np.float32)
+
+
+def compute_profiles(start, end, variables, percentiles, workers=None):
+    """Profiles of every file of the run; returns (file_numbers, grid, profiles[time, variable, statistic, r])."""
+    jobs = [(n, variables, percentiles) for n in range(start, end + 1)]
+    results = {}
+    grid = None
+    with Pool(workers) as pool:
+        for file_number, file_grid, profiles in pool.imap_unordered(file_profiles, jobs):
+            results[file_number] = profiles
+            if grid is None:
+                grid = file_grid
+    file_numbers = np.array(sorted(results))
+    return file_numbers, grid, np.stack([results[n] for n in file_numbers])
+
+
+def save_profiles(file_name, file_numbers, grid, profiles, variables, percentiles):
+    np.savez_compressed(file_name, file_numbers=file_numbers, depth=grid.depth, radius=grid.r,
+                        variables=np.array(variables), statistics=np.array(statistic_names(percentiles)),
+                        profiles=profiles)
+
+
+def plot_profiles(file_name, variable="temperature anomaly", statistic="mean", output=None):
+    """Heatmap of one statistic against time (x) and depth (y) from a saved profiles file."""
+    data = np.load(file_name)
+    variables = list(data["variables"])
+    statistics = list(data["statistics"])
+    if variable not in variables or statistic not in statistics:
+        raise KeyError(f"Expected a variable in {variables} and a statistic in {statistics}")
+    image = data["profiles"][:, variables.index(variable), statistics.index(statistic), :].T
+    depth, file_numbers = data["depth"], data["file_numbers"]
+    # rows of the image go from the surface down
+    if depth[0] > depth[-1]:
+        image, depth = image[::-1], depth[::-1]
+
+    # only needed with --plot, and slow to import
+    import matplotlib.pyplot as plt
+
+    anomaly = "anomaly" in variable and statistic != "std"
+    limit = np.nanmax(np.abs(image))
+    fig, ax = plt.subplots(figsize=(10, 6))
+    mesh = ax.imshow(image, aspect="auto", interpolation="nearest", origin="upper",
+                     extent=(file_numbers[0] - 0.5, file_numbers[-1] + 0.5, depth[-1], depth[0]),
+                     cmap="RdBu_r" if anomaly else "inferno",
+                     vmin=-limit if anomaly else None, vmax=limit if anomaly else None)
+    fig.colorbar(mesh, ax=ax, label=f"{variable} ({statistic})")
+    ax.set_title(f"{variable} {statistic} per radial layer")
+    ax.set_xlabel("File number")
+    ax.set_ylabel("Depth (km)")
+
+    if output is None:
+        output = os.path.splitext(file_name)[0] + f"_{variable.replace(' ', '_')}_{statistic}.png"
+    fig.savefig(output, dpi=120)
+    plt.close(fig)
+    print(f"Heatmap saved as {output}")
+    return output
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Radial profiles of temperature statistics over a run')
+    parser.add_argument('start', type=int, help='First file number')
+    parser.add_argument('end', type=int, help='Last file number')
+    parser.add_argument('--variables', type=str, nargs='+', help='Variables to profile', default=PROFILE_VARIABLES)
+    parser.add_argument('--percentiles', type=float, nargs='+', help='Percentiles per layer', default=[5, 50, 95])
+    parser.add_argument('-w', '--workers', type=int, metavar='int', help='Number of processes', default=os.cpu_count())
+    parser.add_argument('-o', '--output', type=str, metavar='filename', help='Output .npz file',
+                        default='mantle_data/radial_profiles.npz')
+    parser.add_argument('--plot', action='store_true', help='Also save a heatmap')
+    parser.add_argument('--plot-variable', type=str, help='Variable of the heatmap', default='temperature anomaly')
+    parser.add_argument('--statistic', type=str, help='Statistic of the heatmap (mean, std, p50, ...)', default='mean')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    file_numbers, grid, profiles = compute_profiles(args.start, args.end, args.variables, args.percentiles, args.workers)
+    print(f"Computed profiles of {len(file_numbers)} files ({grid.shape[0]} layers) in {time.perf_counter() - start:.2f}s")
+    save_profiles(args.output, file_numbers, grid, profiles, args.variables, args.percentiles)
+    print(f"Saved {args.output}")
+    if args.plot:
+        plot_profiles(args.output, args.plot_variable, args.statistic)
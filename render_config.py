@@ -0,0 +1,244 @@
+'''
+Config-driven replacement for mantle.py / mantle2.py / mantle3.py: renders
+every variable x view combination of a config file, reading each timestep
+once with all the needed variables enabled and clipping it once.
+
+A config (JSON, or YAML when PyYAML is installed) looks like
+render_configs/mantle.json:
+
+    {
+        "size": [800, 600],
+        "clip": "octant",
+        "output": "output_images/{variable}_{view}_{file_number:03d}.png",
+        "variables": [
+            {"name": "temperature", "title": "Temperature (K)", "stops": "temperature"},
+            {"name": "temperature anomaly", "stops": "anomaly", "range": [-200, 200]}
+        ],
+        "views": [
+            {"name": "front", "zoom": 2.5},
+            {"name": "saved", "camera": "camera.json"}
+        ]
+    }
+
+An optional "decimate": {"budget": 500000} and/or {"pixels": 1.0} (plus
+"workers" and "levels") renders the outer surface of the clipped data
+decimated by decimate.py for each variable, to a triangle budget or to an
+error of that many pixels in the finest view.
+
+"stops" is a name from mantle_colors.NAMED_STOPS or a list of
+[value, r, g, b] stops, where value may be "min"/"max". "range" defaults to
+the range of the variable in the timestep. A view either loads a camera file
+saved with vtk_camera.save_camera or resets the camera and zooms.
+
+Usage:
+    python render_config.py render_configs/mantle.json <start_file_number> <end_file_number>
+'''
+
+import argparse
+import json
+import os
+import time
+import mantle_vtk as vtk
+from mantle_grid import data_path, read_timestep
+from mantle_colors import NAMED_STOPS, make_color_transfer_function
+from vtk_camera import load_camera
+from frame_writer import FORMATS, FrameWriter
+
+
+def load_config(file_name):
+    """Reads a render config from a .json or .yaml/.yml file."""
+    with open(file_name) as config_file:
+        if os.path.splitext(file_name)[1].lower() in (".yaml", ".yml"):
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError(f"PyYAML is needed to read {file_name}; use a .json config instead")
+            config = yaml.safe_load(config_file)
+        else:
+            config = json.load(config_file)
+    if not config.get("variables") or not config.get("views"):
+        raise ValueError(f"{file_name} needs at least one entry in 'variables' and in 'views'")
+    return config
+
+
+def config_variables(config):
+    return [variable["name"] for variable in config["variables"]]
+
+
+def _stops(variable):
+    stops = variable.get("stops", "anomaly" if "anomaly" in variable["name"] else "temperature")
+    if isinstance(stops, str):
+        return NAMED_STOPS[stops]
+    return [tuple(stop) for stop in stops]
+
+
+def clip_octant(data):
+    """mantle.py's cutaway: removes the box from (0, 0, 0) to the upper bounds."""
+    x_min, x_max, y_min, y_max, z_min, z_max = data.GetBounds()
+    box = vtk.vtkBox()
+    box.SetBounds(0, x_max, 0, y_max, 0, z_max)
+    clip_filter = vtk.vtkClipDataSet()
+    clip_filter.SetInputData(data)
+    clip_filter.SetClipFunction(box)
+    clip_filter.Update()
+    return clip_filter.GetOutput()
+
+
+class ConfigRenderer:
+    """One offscreen pipeline (mapper, actor, scalar bar, window) reused for every frame."""
+
+    def __init__(self, config, writer=None):
+        self.config = config
+        # frame_writer.FrameWriter; frames are written synchronously when None
+        self.writer = writer
+        self.mapper = vtk.vtkDataSetMapper()
+        self.mapper.SetScalarModeToUseCellFieldData()
+        self.actor = vtk.vtkActor()
+        self.actor.SetMapper(self.mapper)
+
+        self.scalar_bar = vtk.vtkScalarBarActor()
+        self.scalar_bar.SetNumberOfLabels(5)
+        self.renderer = vtk.vtkRenderer()
+        self.renderer.AddActor(self.actor)
+        self.renderer.AddViewProp(self.scalar_bar)
+        self.renderer.SetBackground(*config.get("background", (0.1, 0.2, 0.4)))
+
+        self.render_window = vtk.vtkRenderWindow()
+        self.render_window.SetOffScreenRendering(1)
+        self.render_window.AddRenderer(self.renderer)
+        self.render_window.SetSize(*config.get("size", (800, 600)))
+
+        self.window_to_image_filter = vtk.vtkWindowToImageFilter()
+        self.window_to_image_filter.SetInput(self.render_window)
+        self.window_to_image_filter.SetInputBufferTypeToRGB()
+        self.window_to_image_filter.ReadFrontBufferOff()
+        self.png_writer = vtk.vtkPNGWriter()
+        self.png_writer.SetInputConnection(self.window_to_image_filter.GetOutputPort())
+
+        # camera files are read once, not once per frame
+        self.cameras = {view["name"]: load_camera(view["camera"]) for view in config["views"] if "camera" in view}
+
+    def set_variable(self, variable, data):
+        """Colors the actor by one cell array, with the range taken from `data` unless the config fixes it."""
+        name = variable["name"]
+        array = data.GetCellData().GetArray(name)
+        if array is None:
+            raise KeyError(f"Variable '{name}' not found in Cell Data.")
+        vmin, vmax = variable.get("range") or array.GetRange()
+        lut = make_color_transfer_function(_stops(variable), vmin, vmax)
+        self.mapper.SelectColorArray(name)
+        self.mapper.SetScalarRange(vmin, vmax)
+        self.mapper.SetLookupTable(lut)
+        self.scalar_bar.SetLookupTable(lut)
+        self.scalar_bar.SetTitle(variable.get("title", name))
+
+    def set_view(self, view):
+        transform = vtk.vtkTransform()
+        rotate_x, rotate_y = view.get("rotate", (25, -45))
+        transform.RotateX(rotate_x)
+        transform.RotateY(rotate_y)
+        self.actor.SetUserTransform(transform)
+        if view["name"] in self.cameras:
+            self.renderer.GetActiveCamera().DeepCopy(self.cameras[view["name"]])
+        else:
+            self.renderer.ResetCamera()
+            self.renderer.GetActiveCamera().Zoom(view.get("zoom", 2.5))
+
+    def save(self, file_name):
+        self.render_window.Render()
+        if self.writer is not None:
+            file_name = os.path.splitext(file_name)[0] + self.writer.extension
+            self.writer.submit(self.render_window, file_name)
+            return file_name
+        self.window_to_image_filter.Modified()
+        self.png_writer.SetFileName(file_name)
+        self.png_writer.Write()
+        return file_name
+
+    def render(self, data, geometry, file_number, output=None):
+        """Writes every variable x view frame of one timestep; returns the file names.
+
+        `data` is the full dataset (for the color ranges) and `geometry` what
+        is drawn, usually the clipped data, or a dict of what is drawn per
+        variable (decimate_geometry).
+        """
+        output = output or self.config.get("output", "output_images/{variable}_{view}_{file_number:03d}.png")
+        file_names = []
+        for variable in self.config["variables"]:
+            self.mapper.SetInputData(geometry[variable["name"]] if isinstance(geometry, dict) else geometry)
+            self.set_variable(variable, data)
+            for view in self.config["views"]:
+                self.set_view(view)
+                file_name = output.format(variable=variable["name"].replace(" ", "_"), view=view["name"],
+                                          file_number=file_number)
+                os.makedirs(os.path.dirname(file_name) or ".", exist_ok=True)
+                file_names.append(self.save(file_name))
+        return file_names
+
+
+def decimate_geometry(geometry, config, cameras=None):
+    """{variable: outer surface of the geometry, decimated for that variable's colors} as "decimate" says."""
+    from decimate import decimate_surface, pixel_size, print_decimation
+    options = config["decimate"]
+    start = time.perf_counter()
+    geometry_filter = vtk.vtkGeometryFilter()
+    geometry_filter.SetInputData(geometry)
+    geometry_filter.Update()
+    surface = geometry_filter.GetOutput()
+    max_error = None
+    if options.get("pixels") is not None:
+        height = config.get("size", (800, 600))[1]
+        cameras = cameras or {}
+        # the view with the smallest pixels sets the bound
+        max_error = options["pixels"] * min(pixel_size(surface.GetBounds(), height, view.get("zoom", 2.5),
+                                                       camera=cameras.get(view["name"]))
+                                            for view in config["views"])
+    # each variable has its own color bands to keep, so each gets its own surface
+    decimated = {}
+    for variable in config["variables"]:
+        name = variable["name"]
+        decimated[name], counts = decimate_surface(surface, name, options.get("budget"), max_error,
+                                                   options.get("workers", 1), levels=options.get("levels", 32),
+                                                   ranges={name: variable.get("range")})
+        print(f"{name}: ", end="")
+        print_decimation(counts, time.perf_counter() - start)
+        start = time.perf_counter()
+    return decimated
+
+
+def render_dataset(data, config, file_number, renderer=None, output=None):
+    """Renders an already loaded dataset with a config (clipping and decimating it as the config says)."""
+    renderer = renderer or ConfigRenderer(config)
+    geometry = clip_octant(data) if config.get("clip", "octant") == "octant" else data
+    if config.get("decimate"):
+        geometry = decimate_geometry(geometry, config, renderer.cameras)
+    return renderer.render(data, geometry, file_number, output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Render every variable x view of a config, reading each file once')
+    parser.add_argument('config', type=str, help='Render config (.json, .yaml)')
+    parser.add_argument('start', type=int, help='First file number')
+    parser.add_argument('end', type=int, help='Last file number')
+    parser.add_argument('-o', '--output', type=str, metavar='pattern',
+                        help='Output file pattern with {variable}, {view} and {file_number}', default=None)
+    parser.add_argument('--writers', type=int, metavar='int', help='Threads encoding frames (0 = write on the render thread)', default=2)
+    parser.add_argument('--format', type=str, choices=FORMATS, help='Frame format', default='png')
+    parser.add_argument('--compression', type=int, metavar='int', help='PNG compression level (0-9)', default=6)
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    writer = FrameWriter(args.writers, file_format=args.format, compression=args.compression) if args.writers else None
+    renderer = ConfigRenderer(config, writer)
+    for file_number in range(args.start, args.end + 1):
+        start = time.perf_counter()
+        data = read_timestep(data_path(file_number), config_variables(config))
+        read_time = time.perf_counter() - start
+        file_names = render_dataset(data, config, file_number, renderer, args.output)
+        print(f"File {file_number:03d}: read in {read_time:.2f}s, {len(file_names)} frames "
+              f"in {time.perf_counter() - start - read_time:.2f}s")
+    if writer is not None:
+        start = time.perf_counter()
+        writer.close()
+        print(f"Wrote {writer.written} frames, waited {writer.wait_time:.2f}s for free buffers, "
+              f"{time.perf_counter() - start:.2f}s to flush")
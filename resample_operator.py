@@ -0,0 +1,184 @@
+'''
+Precomputed spherical -> Cartesian resampling.
+
+ResampleToImage (see paraview.py) locates every voxel in the spherical mesh
+again for every file, although the mesh is the same for the whole run. Here
+the voxel -> cell mapping is computed once, stored as a sparse matrix, and
+each timestep is then resampled with one sparse mat-vec per variable.
+
+Usage:
+    python resample_operator.py <start_file_number> <end_file_number>
+'''
+
+import argparse
+import os
+import time
+import mantle_vtk as vtk
+import numpy as np
+import scipy.sparse
+from vtkmodules.util import numpy_support
+from mantle_grid import VARIABLES, data_path, read_timestep, cell_array
+
+CELL_ID_ARRAY = "resample cell id"
+
+
+class ResampleOperator:
+    """Sparse voxel <- cell interpolation matrix plus the target image geometry."""
+
+    def __init__(self, matrix, dimensions, origin, spacing, valid_mask, ghost=None):
+        self.matrix = matrix.tocsr()
+        self.dimensions = tuple(int(d) for d in dimensions)
+        self.origin = tuple(float(o) for o in origin)
+        self.spacing = tuple(float(s) for s in spacing)
+        self.valid_mask = valid_mask
+        self.ghost = ghost
+
+    @property
+    def number_of_cells(self):
+        return self.matrix.shape[1]
+
+    def save(self, filename):
+        np.savez(filename,
+                 data=self.matrix.data, indices=self.matrix.indices, indptr=self.matrix.indptr,
+                 shape=np.array(self.matrix.shape), dimensions=np.array(self.dimensions),
+                 origin=np.array(self.origin), spacing=np.array(self.spacing),
+                 valid_mask=self.valid_mask,
+                 ghost=self.ghost if self.ghost is not None else np.zeros(0, dtype=np.uint8))
+        print(f"Saved resampling operator in {filename}")
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as f:
+            matrix = scipy.sparse.csr_matrix((f["data"], f["indices"], f["indptr"]), shape=tuple(f["shape"]))
+            ghost = f["ghost"] if f["ghost"].size else None
+            return cls(matrix, f["dimensions"], f["origin"], f["spacing"], f["valid_mask"], ghost)
+
+    def apply(self, values):
+        """Resamples one cell array (n_cells or n_cells x n_components)."""
+        if values.shape[0] != self.number_of_cells:
+            raise ValueError(f"Operator was built for {self.number_of_cells} cells, got {values.shape[0]}")
+        return self.matrix @ values
+
+    def resample(self, data, variables):
+        """Builds the vtkImageData ResampleToImage would produce for these cell arrays."""
+        image = vtk.vtkImageData()
+        image.SetDimensions(self.dimensions)
+        image.SetOrigin(self.origin)
+        image.SetSpacing(self.spacing)
+        for name in variables:
+            values = cell_array(data, name)
+            resampled = self.apply(values).astype(values.dtype, copy=False)
+            array = numpy_support.numpy_to_vtk(resampled, deep=1)
+            array.SetName(name)
+            image.GetPointData().AddArray(array)
+        mask = numpy_support.numpy_to_vtk(self.valid_mask, deep=1)
+        mask.SetName("vtkValidPointMask")
+        image.GetPointData().AddArray(mask)
+        if self.ghost is not None:
+            ghost = numpy_support.numpy_to_vtk(self.ghost, deep=1)
+            ghost.SetName(vtk.vtkDataSetAttributes.GhostArrayName())
+            image.GetPointData().AddArray(ghost)
+        return image
+
+
+def sampling_dimensions(data):
+    """Same automatic choice as paraview.py: one sample per point of the input extent."""
+    if not hasattr(data, "GetExtent"):
+        raise ValueError("Cannot derive sampling dimensions, pass them explicitly")
+    extent = data.GetExtent()
+    return [extent[1] - extent[0] + 1, extent[3] - extent[2] + 1, extent[5] - extent[4] + 1]
+
+
+def build_operator(data, dimensions=None):
+    """Runs ResampleToImage once on a cell id array and turns the result into a sparse matrix."""
+    if dimensions is None:
+        dimensions = sampling_dimensions(data)
+
+    # Probe a copy that only carries the cell ids, so nothing else gets resampled
+    probe_input = data.NewInstance()
+    probe_input.CopyStructure(data)
+    n_cells = data.GetNumberOfCells()
+    # float64 holds the ids exactly; cell data is copied (not interpolated) by the probe
+    ids = numpy_support.numpy_to_vtk(np.arange(n_cells, dtype=np.float64), deep=1)
+    ids.SetName(CELL_ID_ARRAY)
+    probe_input.GetCellData().AddArray(ids)
+
+    resample = vtk.vtkResampleToImage()
+    resample.SetInputDataObject(probe_input)
+    resample.SetSamplingDimensions(dimensions)
+    resample.Update()
+    image = resample.GetOutput()
+
+    point_data = image.GetPointData()
+    cell_ids = numpy_support.vtk_to_numpy(point_data.GetArray(CELL_ID_ARRAY))
+    valid_mask = numpy_support.vtk_to_numpy(point_data.GetArray("vtkValidPointMask")).copy()
+    ghost_array = point_data.GetArray(vtk.vtkDataSetAttributes.GhostArrayName())
+    ghost = numpy_support.vtk_to_numpy(ghost_array).copy() if ghost_array is not None else None
+
+    # Voxels outside the shell keep an empty row, which resamples to 0 like the probe does
+    rows = np.flatnonzero(valid_mask)
+    cols = cell_ids[rows].astype(np.int64)
+    matrix = scipy.sparse.csr_matrix((np.ones(rows.size, dtype=np.float32), (rows, cols)),
+                                     shape=(cell_ids.size, n_cells))
+    return ResampleOperator(matrix, image.GetDimensions(), image.GetOrigin(), image.GetSpacing(),
+                            valid_mask, ghost)
+
+
+def load_or_build_operator(filename, data, dimensions=None):
+    if os.path.exists(filename):
+        operator = ResampleOperator.load(filename)
+        if operator.number_of_cells == data.GetNumberOfCells() and \
+                (dimensions is None or tuple(dimensions) == operator.dimensions):
+            return operator
+        print(f"{filename} does not match this mesh, rebuilding it")
+    start = time.perf_counter()
+    operator = build_operator(data, dimensions)
+    print(f"Built resampling operator in {time.perf_counter() - start:.2f}s "
+          f"({operator.matrix.nnz} weights)")
+    operator.save(filename)
+    return operator
+
+
+def verify(data, operator, variables):
+    """Compares the operator against a direct ResampleToImage run on the same data."""
+    resample = vtk.vtkResampleToImage()
+    resample.SetInputDataObject(data)
+    resample.SetSamplingDimensions(operator.dimensions)
+    resample.Update()
+    reference = resample.GetOutput().GetPointData()
+    for name in variables:
+        expected = numpy_support.vtk_to_numpy(reference.GetArray(name))
+        actual = operator.apply(cell_array(data, name))
+        print(f"{name}: max abs difference {np.abs(expected - actual).max()}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Resample spherical files to image data with a cached operator')
+    parser.add_argument('start', type=int, help='First file number')
+    parser.add_argument('end', type=int, help='Last file number')
+    parser.add_argument('-d', '--dimensions', type=int, nargs=3, metavar='int', help='Sampling dimensions', default=None)
+    parser.add_argument('--operator', type=str, metavar='filename', help='Operator cache file', default='mantle_data/resample_operator.npz')
+    parser.add_argument('--variables', type=str, nargs='+', help='Variables to resample', default=VARIABLES)
+    parser.add_argument('-o', '--output', type=str, metavar='dirname', help='Output directory', default='mantle_resampled')
+    parser.add_argument('--verify', action='store_true', help='Check the first file against ResampleToImage')
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    operator = None
+    for file_number in range(args.start, args.end + 1):
+        data = read_timestep(data_path(file_number), args.variables)
+        if operator is None:
+            operator = load_or_build_operator(args.operator, data, args.dimensions)
+            if args.verify:
+                verify(data, operator, args.variables)
+
+        start = time.perf_counter()
+        image = operator.resample(data, args.variables)
+        elapsed = time.perf_counter() - start
+
+        output_file = os.path.join(args.output, f"spherical{file_number:03d}.vti")
+        writer = vtk.vtkXMLImageDataWriter()
+        writer.SetFileName(output_file)
+        writer.SetInputData(image)
+        writer.Write()
+        print(f"Resampled {len(args.variables)} variables in {elapsed:.3f}s, saved {output_file}")
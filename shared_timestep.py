@@ -0,0 +1,251 @@
+'''
+Hands one decoded timestep to several worker processes through shared
+memory, instead of every process decoding its own copy with
+vtkNetCDFCFReader.
+
+The coordinator publishes a timestep once: the points and each cell
+variable go into their own named multiprocessing.shared_memory segment,
+described by a small picklable manifest. Workers attach to the manifest
+and get numpy views of the segments and a vtkStructuredGrid whose arrays
+point straight at them (numpy_to_vtk with deep=0, no copy).
+
+Every published timestep has a reference count in one more segment,
+changed under a multiprocessing lock: publishing counts the coordinator,
+each attach adds one, each release() removes one, and whoever releases
+last unlinks all the segments. The coordinator may drop a timestep while
+workers still use it.
+
+    lock = multiprocessing.get_context("spawn").Lock()
+    timestep = SharedTimestep.publish(data_path(1), ["temperature"], lock)
+    # in a worker started with (timestep.manifest, lock):
+    with SharedTimestep.attach(manifest, lock) as shared:
+        render(shared.dataset)
+
+Workers have to be started by the coordinator (multiprocessing), so they
+share its resource tracker, which cleans up the segments if everything
+crashes. A worker drops its own references to the dataset (and to the
+filters using it) before release(): mapped memory cannot be closed under
+live arrays.
+
+Usage (memory per worker count, shared vs. every worker reading the file):
+    python shared_timestep.py <file_number> -w 1 2 4
+'''
+
+import argparse
+import multiprocessing
+import time
+import numpy as np
+import mantle_vtk as vtk
+from multiprocessing import shared_memory
+from vtkmodules.util import numpy_support
+from mantle_grid import data_path, read_timestep
+from memory_report import private_rss_mb
+
+DEFAULT_VARIABLES = ["spin transition-induced density anomaly", "temperature", "temperature anomaly"]
+
+
+def _create_segment(values):
+    """A new segment holding a copy of `values`, and its manifest entry (name, shape, dtype)."""
+    segment = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+    np.ndarray(values.shape, values.dtype, buffer=segment.buf)[...] = values
+    return segment, (segment.name, values.shape, values.dtype.str)
+
+
+def _view(segment, entry):
+    """Array over a segment; frombuffer keeps the buffer exported, so the segment cannot be closed under it."""
+    _, shape, dtype = entry
+    dtype = np.dtype(dtype)
+    return np.frombuffer(segment.buf, dtype, int(np.prod(shape))).reshape(shape)
+
+
+def _segment_entries(manifest):
+    return [manifest["points"]] + list(manifest["cells"].values())
+
+
+class SharedTimestep:
+    """One published timestep, as seen by the coordinator or a worker."""
+
+    def __init__(self, manifest, lock, segments, count):
+        self.manifest = manifest
+        self.lock = lock
+        self.segments = segments
+        self.count = count
+        self.points = _view(segments[0], manifest["points"])
+        self.arrays = {name: _view(segment, entry)
+                       for segment, (name, entry) in zip(segments[1:], manifest["cells"].items())}
+        self._dataset = None
+
+    @classmethod
+    def publish(cls, file_path, variables, lock):
+        """Reads a file once into new segments; the coordinator holds the first reference."""
+        data = read_timestep(file_path, variables)
+        points = numpy_support.vtk_to_numpy(data.GetPoints().GetData())
+        segments = []
+        point_segment, point_entry = _create_segment(points)
+        segments.append(point_segment)
+        cells = {}
+        for name in variables:
+            segment, cells[name] = _create_segment(numpy_support.vtk_to_numpy(data.GetCellData().GetArray(name)))
+            segments.append(segment)
+        count = shared_memory.SharedMemory(create=True, size=8)
+        np.ndarray(1, np.int64, buffer=count.buf)[0] = 1
+        manifest = {"file_path": file_path, "extent": data.GetExtent(), "count": count.name,
+                    "points": point_entry, "cells": cells}
+        return cls(manifest, lock, segments, count)
+
+    @classmethod
+    def attach(cls, manifest, lock):
+        """Maps the segments of a published timestep and takes a reference on them."""
+        with lock:
+            # under the lock, so the last release cannot unlink between the check and the mapping
+            count = shared_memory.SharedMemory(manifest["count"])
+            references = np.ndarray(1, np.int64, buffer=count.buf)
+            if references[0] <= 0:
+                del references
+                count.close()
+                raise FileNotFoundError(f"{manifest['file_path']} has already been released")
+            references[0] += 1
+            del references
+            segments = [shared_memory.SharedMemory(name) for name, _, _ in _segment_entries(manifest)]
+        return cls(manifest, lock, segments, count)
+
+    @property
+    def dataset(self):
+        """vtkStructuredGrid over the segments (built on first use, nothing copied)."""
+        if self._dataset is None:
+            grid = vtk.vtkStructuredGrid()
+            grid.SetExtent(self.manifest["extent"])
+            points = vtk.vtkPoints()
+            points.SetData(numpy_support.numpy_to_vtk(self.points, deep=0))
+            grid.SetPoints(points)
+            for name, values in self.arrays.items():
+                array = numpy_support.numpy_to_vtk(values, deep=0)
+                array.SetName(name)
+                grid.GetCellData().AddArray(array)
+            self._dataset = grid
+        return self._dataset
+
+    @property
+    def nbytes(self):
+        return self.points.nbytes + sum(values.nbytes for values in self.arrays.values())
+
+    def release(self):
+        """Drops this reference; the last one unlinks the segments."""
+        if self.segments is None:
+            return
+        self._dataset = None
+        self.points = None
+        self.arrays = {}
+        for segment in self.segments:
+            try:
+                segment.close()
+            except BufferError:
+                raise BufferError(f"{self.manifest['file_path']}: arrays over the shared memory are still "
+                                  f"referenced (drop the dataset and its filters before release())") from None
+        with self.lock:
+            references = np.ndarray(1, np.int64, buffer=self.count.buf)
+            references[0] -= 1
+            last = references[0] == 0
+            del references
+            if last:
+                for segment in self.segments:
+                    segment.unlink()
+                self.count.unlink()
+        self.count.close()
+        self.segments = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def analyze(data, variable):
+    """The worker's job in the demo: range of a variable and the number of cells above its mean."""
+    array = data.GetCellData().GetArray(variable)
+    low, high = array.GetRange()
+    mean = float(np.mean(numpy_support.vtk_to_numpy(array)))
+    threshold = vtk.vtkThreshold()
+    threshold.SetInputData(data)
+    threshold.SetInputArrayToProcess(0, 0, 0, vtk.vtkDataObject.FIELD_ASSOCIATION_CELLS, variable)
+    threshold.SetThresholdFunction(vtk.vtkThreshold.THRESHOLD_UPPER)
+    threshold.SetUpperThreshold(mean)
+    threshold.Update()
+    return low, high, threshold.GetOutput().GetNumberOfCells()
+
+
+def _demo_worker(source, lock, variable, barrier, results):
+    """Attaches to the manifest (or reads the file when `source` is a path), analyzes and reports memory."""
+    before = private_rss_mb()
+    start = time.perf_counter()
+    if isinstance(source, dict):
+        shared = SharedTimestep.attach(source, lock)
+        data = shared.dataset
+    else:
+        shared = None
+        data = read_timestep(source, [variable])
+    loaded = time.perf_counter() - start
+    data_private = private_rss_mb() - before
+    low, high, above = analyze(data, variable)
+    private = private_rss_mb() - before
+    # every worker holds its data at the same time, as when rendering side by side
+    barrier.wait()
+    del data
+    if shared is not None:
+        shared.release()
+    results.put((variable, low, high, above, loaded, data_private, private))
+
+
+def run_workers(context, source, lock, variables, workers):
+    """Starts `workers` processes on the timestep.
+
+    Returns their (variable, low, high, above, load time, private MB after
+    loading, private MB after the analysis).
+    """
+    barrier = context.Barrier(workers)
+    results = context.Queue()
+    processes = [context.Process(target=_demo_worker,
+                                 args=(source, lock, variables[i % len(variables)], barrier, results))
+                 for i in range(workers)]
+    for process in processes:
+        process.start()
+    collected = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return collected
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Share one decoded timestep between worker processes')
+    parser.add_argument('file_number', type=int, help='File number')
+    parser.add_argument('-v', '--variables', type=str, nargs='+', help='Variables to publish',
+                        default=DEFAULT_VARIABLES)
+    parser.add_argument('-w', '--workers', type=int, nargs='+', metavar='int', help='Worker counts to compare',
+                        default=[1, 2, 4])
+    args = parser.parse_args()
+
+    file_path = data_path(args.file_number)
+    # spawn: workers start without a copy of the coordinator's memory
+    context = multiprocessing.get_context("spawn")
+    lock = context.Lock()
+    start = time.perf_counter()
+    timestep = SharedTimestep.publish(file_path, args.variables, lock)
+    shared_mb = timestep.nbytes / 2 ** 20
+    print(f"Published {file_path} in {time.perf_counter() - start:.2f}s: "
+          f"{len(timestep.segments)} segments, {shared_mb:.0f} MB")
+
+    print("Private memory per worker after loading its data and after the analysis; the total adds the segments once")
+    print(f"{'workers':>7s} {'mode':>7s} {'load':>7s} {'loaded':>9s} {'analyzed':>9s} {'total':>9s}")
+    for workers in args.workers:
+        for mode, source in (("shared", timestep.manifest), ("read", file_path)):
+            results = run_workers(context, source, lock, args.variables, workers)
+            loaded = np.mean([result[5] for result in results])
+            analyzed = [result[6] for result in results]
+            total = sum(analyzed) + (shared_mb if mode == "shared" else 0.0)
+            load = max(result[4] for result in results)
+            print(f"{workers:7d} {mode:>7s} {load:6.2f}s {loaded:6.0f} MB {np.mean(analyzed):6.0f} MB {total:6.0f} MB")
+    for variable, low, high, above, *_ in {result[0]: result for result in results}.values():
+        print(f"  {variable}: range [{low:.4g}, {high:.4g}], {above} cells above the mean")
+
+    timestep.release()
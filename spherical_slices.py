@@ -0,0 +1,170 @@
+'''
+Depth shells, meridional cross-sections and constant-latitude cones taken
+straight out of the [r, lat, lon] arrays by index, and drawn as flat
+equirectangular or polar images without any 3D pipeline.
+
+The pixel -> cell lookup of a SliceRenderer only depends on the grid, so it
+is computed once and reused for every timestep.
+
+Usage:
+    python spherical_slices.py <start_file_number> <end_file_number> --depths 100 660 2000
+'''
+
+import argparse
+import os
+import time
+import numpy as np
+from mantle_grid import data_path, read_fields
+from mantle_colors import map_colors, stops_for_variable
+from mantle_images import write_png
+
+KINDS = ("shell", "meridian", "cone")
+PROJECTIONS = ("equirectangular", "polar")
+
+
+def extract_shell(field, grid, depth):
+    """Constant-depth layer as a [lat, lon] array."""
+    k = int(grid.depth_index(depth))
+    if k < 0:
+        raise ValueError(f"Depth {depth} is outside the mantle")
+    return field[k]
+
+
+def extract_meridian(field, grid, lon):
+    """Constant-longitude cross-section as a [r, lat] array."""
+    i = int(grid.lon_index(lon))
+    if i < 0:
+        raise ValueError(f"Longitude {lon} is outside the grid")
+    return field[:, :, i]
+
+
+def extract_cone(field, grid, lat):
+    """Constant-latitude cone as a [r, lon] array."""
+    j = int(grid.lat_index(lat))
+    if j < 0:
+        raise ValueError(f"Latitude {lat} is outside the grid")
+    return field[:, j, :]
+
+
+def _pixel_centers(n, start, stop):
+    step = (stop - start) / n
+    return start + step * (np.arange(n) + 0.5)
+
+
+class SliceRenderer:
+    """Precomputed pixel -> cell lookup for one slice and one projection."""
+
+    def __init__(self, grid, kind, value, projection="equirectangular", size=256):
+        if kind not in KINDS:
+            raise ValueError(f"Unknown slice kind '{kind}', expected one of {KINDS}")
+        if projection not in PROJECTIONS:
+            raise ValueError(f"Unknown projection '{projection}', expected one of {PROJECTIONS}")
+        self.grid = grid
+        self.kind = kind
+        self.value = value
+        self.projection = projection
+
+        if projection == "polar":
+            self.shape = (size, size)
+            k, j, i = self._polar_coordinates(size)
+        else:
+            self.shape = (size, 2 * size) if kind != "meridian" else (size, size)
+            k, j, i = self._equirectangular_coordinates()
+
+        k, j, i = (np.broadcast_to(a, self.shape) for a in (k, j, i))
+        valid = (k >= 0) & (j >= 0) & (i >= 0)
+        self.valid = valid
+        self.flat_index = np.ravel_multi_index((k[valid], j[valid], i[valid]), grid.shape)
+
+    def _equirectangular_coordinates(self):
+        grid = self.grid
+        h, w = self.shape
+        # rows run north -> south or surface -> core, so the image is the right way up
+        rows = (slice(None), None)
+        cols = (None, slice(None))
+        lon0 = min(grid.lon_bounds[0], grid.lon_bounds[-1])
+        if self.kind == "shell":
+            k = grid.depth_index(self.value)
+            j = grid.lat_index(_pixel_centers(h, 90.0, -90.0))[rows]
+            i = grid.lon_index(_pixel_centers(w, lon0, lon0 + 360.0))[cols]
+        else:
+            k = grid.r_index(_pixel_centers(h, grid.r_bounds.max(), grid.r_bounds.min()))[rows]
+            if self.kind == "meridian":
+                j = grid.lat_index(_pixel_centers(w, -90.0, 90.0))[cols]
+                i = grid.lon_index(self.value)
+            else:
+                j = grid.lat_index(self.value)
+                i = grid.lon_index(_pixel_centers(w, lon0, lon0 + 360.0))[cols]
+        return k, j, i
+
+    def _polar_coordinates(self, size):
+        grid = self.grid
+        x = _pixel_centers(size, -1.0, 1.0)[None, :]
+        y = _pixel_centers(size, 1.0, -1.0)[:, None]
+        rho = np.hypot(x, y)
+        angle = np.degrees(np.arctan2(y, x))
+        outside = rho > 1.0
+
+        if self.kind == "shell":
+            # azimuthal equidistant about the north pole, the south pole on the rim
+            k = grid.depth_index(self.value)
+            j = grid.lat_index(90.0 - 180.0 * np.minimum(rho, 1.0))
+            i = grid.lon_index(angle)
+        else:
+            k = grid.r_index(rho * grid.r_bounds.max())
+            if self.kind == "meridian":
+                # full great circle: the right half is the requested longitude,
+                # the left half the opposite one
+                right = x >= 0
+                lat = np.where(right, angle, np.where(angle > 0, 180.0 - angle, -180.0 - angle))
+                j = grid.lat_index(lat)
+                i = np.where(right, grid.lon_index(self.value), grid.lon_index(self.value + 180.0))
+            else:
+                j = grid.lat_index(self.value)
+                i = grid.lon_index(angle)
+        k = np.where(outside, -1, k)
+        return k, j, i
+
+    def sample(self, field):
+        """Values of the slice in image layout, NaN where the pixel is off the grid."""
+        image = np.full(self.shape, np.nan, dtype=np.float32)
+        image[self.valid] = field.reshape(-1)[self.flat_index]
+        return image
+
+    def render(self, field, stops, vmin, vmax, background=(0, 0, 0)):
+        return map_colors(self.sample(field), stops, vmin, vmax, nan_color=background)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Render depth maps and cross-sections without a 3D pipeline')
+    parser.add_argument('start', type=int, help='First file number')
+    parser.add_argument('end', type=int, help='Last file number')
+    parser.add_argument('--variable', type=str, help='Variable to render', default='temperature')
+    parser.add_argument('--kind', type=str, choices=KINDS, help='Type of slice', default='shell')
+    parser.add_argument('--depths', type=float, nargs='+', help='Depths (km) of the shells', default=[100.0])
+    parser.add_argument('--longitudes', type=float, nargs='+', help='Longitudes of the meridians', default=[0.0])
+    parser.add_argument('--latitudes', type=float, nargs='+', help='Latitudes of the cones', default=[0.0])
+    parser.add_argument('--projection', type=str, choices=PROJECTIONS, help='Map projection', default='equirectangular')
+    parser.add_argument('--size', type=int, metavar='int', help='Image height in pixels', default=256)
+    parser.add_argument('--range', type=float, nargs=2, metavar='float', help='Color range (default: data range)', default=None)
+    parser.add_argument('-o', '--output', type=str, metavar='dirname', help='Output directory', default='output_images/slices')
+    args = parser.parse_args()
+
+    values = {"shell": args.depths, "meridian": args.longitudes, "cone": args.latitudes}[args.kind]
+    stops = stops_for_variable(args.variable)
+    os.makedirs(args.output, exist_ok=True)
+
+    renderers = None
+    count = 0
+    start = time.perf_counter()
+    for file_number in range(args.start, args.end + 1):
+        grid, fields = read_fields(data_path(file_number), [args.variable])
+        field = fields[args.variable]
+        if renderers is None:
+            renderers = [SliceRenderer(grid, args.kind, value, args.projection, args.size) for value in values]
+        vmin, vmax = args.range if args.range is not None else (float(field.min()), float(field.max()))
+        for renderer in renderers:
+            file_name = os.path.join(args.output, f"{args.kind}_{renderer.value:g}_{file_number:03d}.png")
+            write_png(renderer.render(field, stops, vmin, vmax), file_name)
+            count += 1
+    print(f"Saved {count} images in {time.perf_counter() - start:.2f}s to {args.output}")
@@ -0,0 +1,239 @@
+'''
+Streamlines of the mantle velocity (vx, vy, vz), traced in parallel.
+
+Velocities are looked up directly in the [r, lat, lon] arrays
+(SphericalGrid.interpolation_weights), so no cell locator is ever built.
+Seeds are split across worker processes, which inherit the velocity arrays
+once instead of receiving them with every batch. The output is a .vtp file
+of polylines with temperature and speed on the points.
+
+Usage:
+    python streamlines.py <file_number> --depth 660 --seeds 2000
+    python streamlines.py <file_number> --anomaly 150 --seeds 2000 --render
+'''
+
+import argparse
+import os
+import time
+import mantle_vtk as vtk
+import numpy as np
+from multiprocessing import Pool
+from vtkmodules.util import numpy_support
+from mantle_grid import data_path, read_fields, to_cartesian, to_spherical
+from mantle_colors import TEMPERATURE_STOPS, make_color_transfer_function
+
+STREAMLINE_VARIABLES = ["temperature", "temperature anomaly", "vx", "vy", "vz"]
+
+# set in each worker by _init_worker
+_grid = None
+_velocity = None
+
+
+def seeds_on_shell(grid, depth, count):
+    """Evenly spread seeds (Fibonacci sphere) on the shell at the given depth."""
+    k = int(grid.depth_index(depth))
+    if k < 0:
+        raise ValueError(f"Depth {depth} is outside the mantle")
+    n = np.arange(count) + 0.5
+    lat = np.degrees(np.arcsin(1 - 2 * n / count))
+    lon = np.degrees(np.pi * (1 + 5 ** 0.5) * n) % 360.0
+    return to_cartesian(grid.r[k], lat, lon)
+
+
+def seeds_in_anomaly(grid, anomaly, threshold, count, seed=0):
+    """Seeds at random positions inside the cells where |temperature anomaly| > threshold."""
+    cells = np.flatnonzero(np.abs(anomaly).reshape(-1) > threshold)
+    if cells.size == 0:
+        raise ValueError(f"No cell has |temperature anomaly| above {threshold}")
+    rng = np.random.default_rng(seed)
+    chosen = rng.choice(cells, size=min(count, cells.size), replace=False)
+    k, j, i = np.unravel_index(chosen, grid.shape)
+    # jitter inside the cell so seeds do not line up on the cell centers
+    r = grid.r_bounds[k] + rng.random(k.size) * (grid.r_bounds[k + 1] - grid.r_bounds[k])
+    lat = grid.lat_bounds[j] + rng.random(j.size) * (grid.lat_bounds[j + 1] - grid.lat_bounds[j])
+    lon = grid.lon_bounds[i] + rng.random(i.size) * (grid.lon_bounds[i + 1] - grid.lon_bounds[i])
+    return to_cartesian(r, lat, lon)
+
+
+def _init_worker(grid, velocity):
+    global _grid, _velocity
+    _grid = grid
+    _velocity = velocity
+
+
+def _direction(points):
+    """Unit velocity at the points, plus a mask of the points where tracing can go on."""
+    r, lat, lon = to_spherical(points)
+    ids, weights, inside = _grid.interpolation_weights(r, lat, lon)
+    v = _grid.interpolate(_velocity, ids, weights)
+    speed = np.linalg.norm(v, axis=1)
+    ok = inside & (speed > 0)
+    return np.where(ok[:, None], v / np.where(ok, speed, 1.0)[:, None], 0.0), ok
+
+
+def trace(seeds, step, max_steps, direction=1.0):
+    """RK4 integration of all seeds of the batch at once; returns (max_steps + 1, n, 3) with NaN after the end."""
+    path = np.full((max_steps + 1,) + seeds.shape, np.nan)
+    path[0] = seeds
+    position = seeds.copy()
+    active = np.ones(len(seeds), dtype=bool)
+    h = step * direction
+    for n in range(1, max_steps + 1):
+        idx = np.flatnonzero(active)
+        if idx.size == 0:
+            break
+        p = position[idx]
+        k1, ok1 = _direction(p)
+        k2, ok2 = _direction(p + 0.5 * h * k1)
+        k3, ok3 = _direction(p + 0.5 * h * k2)
+        k4, ok4 = _direction(p + h * k3)
+        ok = ok1 & ok2 & ok3 & ok4
+        p = p + h / 6.0 * (k1 + 2 * k2 + 2 * k3 + k4)
+        active[idx[~ok]] = False
+        position[idx[ok]] = p[ok]
+        path[n, idx[ok]] = p[ok]
+    return path
+
+
+def trace_batch(job):
+    seeds, step, max_steps, both_directions = job
+    lines = []
+    forward = trace(seeds, step, max_steps, 1.0)
+    backward = trace(seeds, step, max_steps, -1.0) if both_directions else None
+    for s in range(len(seeds)):
+        line = forward[:, s][~np.isnan(forward[:, s, 0])]
+        if backward is not None:
+            back = backward[1:, s][~np.isnan(backward[1:, s, 0])]
+            line = np.concatenate([back[::-1], line])
+        if len(line) > 1:
+            lines.append(line.astype(np.float32))
+    return lines
+
+
+def trace_streamlines(grid, velocity, seeds, step=None, max_steps=500, both_directions=True,
+                      workers=None, batch_size=500):
+    """Traces every seed, splitting them in batches over a process pool."""
+    if step is None:
+        step = 0.5 * np.min(np.abs(np.diff(grid.r_bounds)))
+    jobs = [(seeds[i:i + batch_size], step, max_steps, both_directions)
+            for i in range(0, len(seeds), batch_size)]
+    lines = []
+    with Pool(workers, initializer=_init_worker, initargs=(grid, velocity)) as pool:
+        for batch in pool.imap(trace_batch, jobs):
+            lines.extend(batch)
+    return lines
+
+
+def make_polylines(lines, grid, fields):
+    """Polydata with one polyline per streamline and temperature/speed/anomaly on its points."""
+    points = np.concatenate(lines)
+    counts = np.array([len(line) for line in lines])
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+
+    polydata = vtk.vtkPolyData()
+    vtk_points = vtk.vtkPoints()
+    vtk_points.SetData(numpy_support.numpy_to_vtk(points, deep=1))
+    polydata.SetPoints(vtk_points)
+    cells = vtk.vtkCellArray()
+    cells.SetData(numpy_support.numpy_to_vtkIdTypeArray(offsets.astype(np.int64), deep=1),
+                  numpy_support.numpy_to_vtkIdTypeArray(np.arange(len(points), dtype=np.int64), deep=1))
+    polydata.SetLines(cells)
+
+    ids, weights, inside = grid.interpolation_weights(*to_spherical(points))
+    velocity = grid.interpolate(np.stack([fields["vx"], fields["vy"], fields["vz"]], axis=-1), ids, weights)
+    for name, values in (("temperature", grid.interpolate(fields["temperature"], ids, weights)),
+                         ("temperature anomaly", grid.interpolate(fields["temperature anomaly"], ids, weights)),
+                         ("velocity", velocity),
+                         ("velocity magnitude", np.linalg.norm(velocity, axis=1))):
+        array = numpy_support.numpy_to_vtk(values.astype(np.float32), deep=1)
+        array.SetName(name)
+        polydata.GetPointData().AddArray(array)
+    return polydata
+
+
+def render_streamlines(polydata, file_name, min_temp, max_temp):
+    """Draws the polylines colored by temperature like mantle.py and saves a PNG."""
+    lut = make_color_transfer_function(TEMPERATURE_STOPS, min_temp, max_temp)
+    mapper = vtk.vtkPolyDataMapper()
+    mapper.SetInputData(polydata)
+    mapper.SetScalarModeToUsePointFieldData()
+    mapper.SelectColorArray("temperature")
+    mapper.SetScalarRange(min_temp, max_temp)
+    mapper.SetLookupTable(lut)
+
+    actor = vtk.vtkActor()
+    actor.SetMapper(mapper)
+    transform = vtk.vtkTransform()
+    transform.RotateX(25)
+    transform.RotateY(-45)
+    actor.SetUserTransform(transform)
+
+    renderer = vtk.vtkRenderer()
+    renderer.AddActor(actor)
+    scalar_bar = vtk.vtkScalarBarActor()
+    scalar_bar.SetLookupTable(lut)
+    scalar_bar.SetTitle("Temperature (K)")
+    scalar_bar.SetNumberOfLabels(5)
+    renderer.AddViewProp(scalar_bar)
+    renderer.SetBackground(0.1, 0.2, 0.4)
+
+    render_window = vtk.vtkRenderWindow()
+    render_window.SetOffScreenRendering(1)
+    render_window.AddRenderer(renderer)
+    render_window.SetSize(1600, 1200)
+    renderer.ResetCamera()
+    renderer.GetActiveCamera().Zoom(1.5)
+    render_window.Render()
+
+    window_to_image_filter = vtk.vtkWindowToImageFilter()
+    window_to_image_filter.SetInput(render_window)
+    window_to_image_filter.SetInputBufferTypeToRGB()
+    window_to_image_filter.ReadFrontBufferOff()
+    window_to_image_filter.Update()
+    writer = vtk.vtkPNGWriter()
+    writer.SetFileName(file_name)
+    writer.SetInputConnection(window_to_image_filter.GetOutputPort())
+    writer.Write()
+    print(f"Saved current screen to '{file_name}'")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Parallel streamlines of the mantle velocity')
+    parser.add_argument('file_number', type=int, help='File number')
+    seeding = parser.add_mutually_exclusive_group()
+    seeding.add_argument('--depth', type=float, help='Seed on the shell at this depth (km)', default=660.0)
+    seeding.add_argument('--anomaly', type=float, help='Seed where |temperature anomaly| is above this value', default=None)
+    parser.add_argument('--seeds', type=int, metavar='int', help='Number of seeds', default=1000)
+    parser.add_argument('--step', type=float, help='Integration step (km)', default=None)
+    parser.add_argument('--max-steps', type=int, metavar='int', help='Maximum number of steps', default=500)
+    parser.add_argument('--forward', action='store_true', help='Only trace downstream of the seeds')
+    parser.add_argument('-w', '--workers', type=int, metavar='int', help='Number of processes', default=os.cpu_count())
+    parser.add_argument('--render', action='store_true', help='Also save a PNG of the streamlines')
+    parser.add_argument('-o', '--output', type=str, metavar='dirname', help='Output directory', default='output_streamlines')
+    args = parser.parse_args()
+
+    grid, fields = read_fields(data_path(args.file_number), STREAMLINE_VARIABLES)
+    if args.anomaly is not None:
+        seeds = seeds_in_anomaly(grid, fields["temperature anomaly"], args.anomaly, args.seeds)
+    else:
+        seeds = seeds_on_shell(grid, args.depth, args.seeds)
+    velocity = np.stack([fields["vx"], fields["vy"], fields["vz"]], axis=-1)
+
+    start = time.perf_counter()
+    lines = trace_streamlines(grid, velocity, seeds, args.step, args.max_steps, not args.forward, args.workers)
+    print(f"Traced {len(lines)} streamlines from {len(seeds)} seeds in {time.perf_counter() - start:.2f}s")
+    if not lines:
+        raise SystemExit("No streamline left the seeds")
+
+    polydata = make_polylines(lines, grid, fields)
+    os.makedirs(args.output, exist_ok=True)
+    output_file = os.path.join(args.output, f"streamlines{args.file_number:03d}.vtp")
+    writer = vtk.vtkXMLPolyDataWriter()
+    writer.SetFileName(output_file)
+    writer.SetInputData(polydata)
+    writer.Write()
+    print(f"Saved {output_file}")
+
+    if args.render:
+        render_streamlines(polydata, os.path.join(args.output, f"streamlines{args.file_number:03d}.png"),
+                           float(fields["temperature"].min()), float(fields["temperature"].max()))
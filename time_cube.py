@@ -0,0 +1,227 @@
+'''
+Time-major data cube of one variable over a range of timesteps, for
+per-cell temporal statistics without reopening every NetCDF file.
+
+The build job reads each file once (all requested variables together) and
+writes its values into a memory-mapped .npy per variable, out-of-core:
+
+    mantle_data/cube/<variable>/cube.npy   (chunks, steps, chunk) float32
+    mantle_data/cube/<variable>/meta.json  file numbers, cells, chunk size, grid bounds
+
+Cells are split in chunks of `chunk` consecutive cells (reader order, the
+last chunk padded), and each chunk stores all its timesteps contiguously,
+so a query reads one (steps, chunk) block at a time. Queries reduce those
+blocks with vectorized numpy: mean, variance, least-squares trend (per
+step) and the number of steps above (or below) a threshold.
+
+The results are ordinary cell arrays, rendered through render_config.py's
+cutaway renderer (clip, views, colors from a config).
+
+Usage:
+    python time_cube.py <start_file_number> <end_file_number> -v "temperature anomaly" --threshold 100 --render
+    python time_cube.py <start_file_number> <end_file_number> --last 200 --threshold 100 --config render_configs/mantle.json
+'''
+
+import argparse
+import json
+import os
+import time
+import numpy as np
+from numpy.lib.format import open_memmap
+from vtkmodules.util import numpy_support
+from mantle_grid import data_path, read_fields, read_timestep
+
+STATISTICS = ("mean", "variance", "trend", "exceedance")
+SEQUENTIAL_STOPS = [["min", 1.0, 1.0, 1.0], ["max", 1.0, 0.0, 0.0]]
+
+
+def cube_dir(variable, data_dir="mantle_data"):
+    return os.path.join(data_dir, "cube", variable.replace(" ", "_"))
+
+
+def build_cubes(file_numbers, variables, chunk=1 << 16, data_dir="mantle_data"):
+    """Writes the cube of every variable over the files, reading each file once; returns the TimeCubes."""
+    file_numbers = list(file_numbers)
+    if not file_numbers:
+        raise ValueError("No files to build the cubes from")
+    cubes = {}
+    start = time.perf_counter()
+    for step, file_number in enumerate(file_numbers):
+        grid, fields = read_fields(data_path(file_number, data_dir), variables)
+        if not cubes:
+            cells = grid.number_of_cells
+            chunks = -(-cells // chunk)
+            for name in variables:
+                os.makedirs(cube_dir(name, data_dir), exist_ok=True)
+                cubes[name] = open_memmap(os.path.join(cube_dir(name, data_dir), "cube.npy.tmp"), mode="w+",
+                                          dtype=np.float32, shape=(chunks, len(file_numbers), chunk))
+            row = np.zeros(chunks * chunk, dtype=np.float32)
+        elif grid.number_of_cells != cells:
+            raise ValueError(f"File {file_number} has {grid.number_of_cells} cells, the first file {cells}")
+        for name in variables:
+            row[:cells] = np.ravel(fields[name])
+            # one strided write of `chunk` contiguous values per chunk
+            cubes[name][:, step, :] = row.reshape(chunks, chunk)
+        print(f"File {file_number:03d} -> cube ({time.perf_counter() - start:.2f}s)")
+
+    meta = {"file_numbers": file_numbers, "cells": cells, "chunk": chunk,
+            "bounds": [grid.r_bounds.tolist(), grid.lat_bounds.tolist(), grid.lon_bounds.tolist()]}
+    for cube in cubes.values():
+        cube.flush()
+    cubes.clear()
+    for name in variables:
+        directory = cube_dir(name, data_dir)
+        # the cube only replaces an older one once it is complete
+        os.replace(os.path.join(directory, "cube.npy.tmp"), os.path.join(directory, "cube.npy"))
+        with open(os.path.join(directory, "meta.json"), "w") as meta_file:
+            json.dump(meta, meta_file)
+    return {name: TimeCube(name, data_dir) for name in variables}
+
+
+class TimeCube:
+    """Read-only view of a built cube, with vectorized per-cell reductions over its chunks."""
+
+    def __init__(self, variable, data_dir="mantle_data"):
+        directory = cube_dir(variable, data_dir)
+        with open(os.path.join(directory, "meta.json")) as meta_file:
+            meta = json.load(meta_file)
+        self.variable = variable
+        self.file_numbers = meta["file_numbers"]
+        self.cells = meta["cells"]
+        self.chunk = meta["chunk"]
+        self.bounds = meta["bounds"]
+        self.values = np.load(os.path.join(directory, "cube.npy"), mmap_mode="r")
+
+    def covers(self, file_numbers):
+        return set(file_numbers) <= set(self.file_numbers)
+
+    def steps(self, file_numbers):
+        """Cube steps (in time order) of the given file numbers."""
+        index = {file_number: step for step, file_number in enumerate(self.file_numbers)}
+        return np.array(sorted(index[n] for n in file_numbers))
+
+    def series(self, cell):
+        """All the values of one (flat) cell, in time order."""
+        return np.array(self.values[cell // self.chunk, :, cell % self.chunk])
+
+    def statistics(self, file_numbers=None, threshold=None, below=False):
+        """Per-cell mean, variance, trend (per step) and exceedance count over the files (all if None).
+
+        The exceedance counts the steps above `threshold` (below it with
+        below=True) and is only computed with a threshold.
+        """
+        steps = self.steps(file_numbers if file_numbers is not None else self.file_numbers)
+        if steps.size == 0:
+            raise ValueError("No steps selected for the statistics")
+        contiguous = steps.size > 0 and np.all(np.diff(steps) == 1)
+        t = steps.astype(np.float64)
+        t -= t.mean()
+        t_norm = max(np.dot(t, t), 1e-12)
+        results = {name: np.empty(self.cells, dtype=np.float32) for name in STATISTICS
+                   if name != "exceedance" or threshold is not None}
+        for c in range(self.values.shape[0]):
+            first, last = c * self.chunk, min((c + 1) * self.chunk, self.cells)
+            block = self.values[c, steps[0]:steps[-1] + 1] if contiguous else self.values[c, steps]
+            block = np.asarray(block[:, :last - first], dtype=np.float64)
+            mean = block.mean(axis=0)
+            results["mean"][first:last] = mean
+            results["variance"][first:last] = block.var(axis=0)
+            results["trend"][first:last] = t @ block / t_norm
+            if threshold is not None:
+                exceed = block < threshold if below else block > threshold
+                results["exceedance"][first:last] = exceed.sum(axis=0)
+        return results
+
+
+def statistic_name(variable, statistic):
+    return f"{variable} {statistic}"
+
+
+def statistics_dataset(file_path, variable, results):
+    """The spherical grid of a file with the statistics added as cell arrays."""
+    data = read_timestep(file_path, [variable])
+    for statistic, values in results.items():
+        array = numpy_support.numpy_to_vtk(values, deep=1)
+        array.SetName(statistic_name(variable, statistic))
+        data.GetCellData().AddArray(array)
+    return data
+
+
+def statistics_config(variable, results, steps):
+    """Default render config: one entry per statistic, a front and a back view."""
+    entries = []
+    for statistic in results:
+        entry = {"name": statistic_name(variable, statistic), "title": f"{statistic} of {variable}"}
+        if statistic == "mean":
+            entry["stops"] = "anomaly" if "anomaly" in variable else "temperature"
+        elif statistic == "trend":
+            # diverging, centered on zero
+            limit = float(np.abs(results[statistic]).max()) or 1.0
+            entry.update({"stops": "anomaly", "range": [-limit, limit], "title": f"{variable} trend per step"})
+        else:
+            # counts and spreads: white (none) to red
+            entry["stops"] = SEQUENTIAL_STOPS
+            if statistic == "exceedance":
+                entry.update({"range": [0, steps], "title": f"steps past threshold (of {steps})"})
+        entries.append(entry)
+    return {"size": [800, 600], "clip": "octant",
+            "output": "output_images/{variable}_{view}_{file_number:03d}.png", "variables": entries,
+            "views": [{"name": "front", "rotate": [25, -45], "zoom": 2.5},
+                      {"name": "back", "rotate": [25, 135], "zoom": 2.5}]}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Per-cell temporal statistics from a time-major cube')
+    parser.add_argument('start', type=int, help='First file number')
+    parser.add_argument('end', type=int, help='Last file number')
+    parser.add_argument('-v', '--variables', type=str, nargs='+', help='Variables to put in cubes',
+                        default=['temperature anomaly'])
+    parser.add_argument('--last', type=int, metavar='int', help='Only use the last N files of the range',
+                        default=None)
+    parser.add_argument('--threshold', type=float, help='Count the steps above this value', default=None)
+    parser.add_argument('--below', action='store_true', help='Count the steps below the threshold instead')
+    parser.add_argument('--chunk', type=int, metavar='int', help='Cells per chunk', default=1 << 16)
+    parser.add_argument('--rebuild', action='store_true', help='Rebuild the cubes even if they cover the range')
+    parser.add_argument('--render', action='store_true', help='Render the statistics with the cutaway renderer')
+    parser.add_argument('--config', type=str, help='Render config for --render (default: one entry per statistic)',
+                        default=None)
+    args = parser.parse_args()
+    if args.end < args.start:
+        parser.error(f"the end file number ({args.end}) is before the start ({args.start})")
+    if args.last is not None and args.last < 1:
+        parser.error("--last needs at least one file")
+
+    file_numbers = list(range(args.start, args.end + 1))
+    cubes = {}
+    for name in args.variables:
+        try:
+            cube = TimeCube(name)
+        except FileNotFoundError:
+            continue
+        if cube.covers(file_numbers) and not args.rebuild:
+            cubes[name] = cube
+    missing = [name for name in args.variables if name not in cubes]
+    if missing:
+        start = time.perf_counter()
+        cubes.update(build_cubes(file_numbers, missing, args.chunk))
+        print(f"Built {len(missing)} cubes of {len(file_numbers)} steps in {time.perf_counter() - start:.2f}s")
+
+    query_numbers = file_numbers[-args.last:] if args.last else file_numbers
+    for name in args.variables:
+        start = time.perf_counter()
+        results = cubes[name].statistics(query_numbers, args.threshold, args.below)
+        print(f"{name}: statistics over {len(query_numbers)} steps x {cubes[name].cells} cells "
+              f"in {time.perf_counter() - start:.2f}s")
+        if "exceedance" in results:
+            always = int(np.count_nonzero(results["exceedance"] == len(query_numbers)))
+            print(f"  {always} cells {'below' if args.below else 'above'} {args.threshold:g} in every step")
+        output = os.path.join(cube_dir(name), f"statistics{query_numbers[0]:03d}_{query_numbers[-1]:03d}.npz")
+        np.savez(output, **results)
+        print(f"  saved {output}")
+
+        if args.render:
+            from render_config import load_config, render_dataset
+            config = load_config(args.config) if args.config else statistics_config(name, results, len(query_numbers))
+            data = statistics_dataset(data_path(query_numbers[-1]), name, results)
+            file_names = render_dataset(data, config, query_numbers[-1])
+            print(f"  rendered {len(file_names)} images")
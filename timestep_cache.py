@@ -0,0 +1,168 @@
+'''
+Background timestep loading for the interactive viewers: a pool of loader
+processes reads cell arrays, and an LRU cache bounded in bytes keeps the
+decoded timesteps around for scrubbing back and forth.
+
+The viewer asks for a timestep with request(); if it is not cached the
+read is queued and poll() hands it over once it is done, so the UI thread
+never waits on the reader. Timesteps next to the requested one are
+prefetched in the direction the user is moving, and queued reads that are
+no longer wanted (the slider has moved past them) are cancelled, so the
+last requested timestep does not wait behind them.
+
+With encoded=True the loaders read field_codec.py's encoded files instead
+of the NetCDF files, the cache keeps them compressed (several times more
+timesteps in the same budget) and fill() decodes a timestep straight into
+the array the VTK pipeline reads.
+'''
+
+import multiprocessing
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from mantle_grid import read_fields
+from field_codec import decode, read_encoded
+
+
+def load_cell_values(file_path, variable):
+    """Runs in a loader process: one variable of one file as a flat float32 array (reader cell order), with the read time."""
+    start = time.perf_counter()
+    # no spherical geometry: only the values are handed to the viewer
+    _, fields = read_fields(file_path, [variable])
+    values = np.ravel(fields[variable]).astype(np.float32, copy=False)
+    return values, time.perf_counter() - start
+
+
+def load_encoded(file_path, variable):
+    """Runs in a loader process: the encoded file of one variable, with the read time."""
+    start = time.perf_counter()
+    blob = read_encoded(file_path, variable)
+    return blob, time.perf_counter() - start
+
+
+class LRUCache:
+    """Arrays by key, dropping the least recently used ones past a byte budget."""
+
+    def __init__(self, budget_bytes):
+        self.budget = budget_bytes
+        self.items = OrderedDict()
+        self.nbytes = 0
+
+    def get(self, key):
+        if key not in self.items:
+            return None
+        self.items.move_to_end(key)
+        return self.items[key]
+
+    def put(self, key, values):
+        if key in self.items:
+            self.nbytes -= self.items.pop(key).nbytes
+        self.items[key] = values
+        self.nbytes += values.nbytes
+        # always keep the newest entry, even if it alone is over budget
+        while self.nbytes > self.budget and len(self.items) > 1:
+            _, evicted = self.items.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def __len__(self):
+        return len(self.items)
+
+
+class TimestepLoader:
+    """Cached, asynchronous access to one variable of a list of files."""
+
+    def __init__(self, file_paths, variable, budget_bytes=1 << 30, workers=2, prefetch=2, encoded=False):
+        self.file_paths = list(file_paths)
+        self.variable = variable
+        self.prefetch = prefetch
+        self.encoded = encoded
+        self.load = load_encoded if encoded else load_cell_values
+        self.cache = LRUCache(budget_bytes)
+        # spawn: the viewer process runs Qt threads, which fork does not copy safely
+        self.executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+        self.pending = {}
+        self.wanted = None
+        self.errors = []
+        self.hits = 0
+        self.misses = 0
+        self.cancelled = 0
+        self.load_times = []
+
+    def _schedule(self, index):
+        if 0 <= index < len(self.file_paths) and index not in self.cache and index not in self.pending:
+            self.pending[index] = (time.perf_counter(),
+                                   self.executor.submit(self.load, self.file_paths[index], self.variable))
+
+    def _cancel_stale(self, keep):
+        """Cancels queued reads outside `keep`; reads already running finish into the cache."""
+        for index, (_, future) in list(self.pending.items()):
+            if index not in keep and future.cancel():
+                del self.pending[index]
+                self.cancelled += 1
+
+    def request(self, index, direction=1):
+        """Cached values of a timestep, or None if it has been queued (see poll()).
+
+        Also queues the next `prefetch` timesteps in `direction` and cancels
+        the queued reads of any other timestep.
+        """
+        step = 1 if direction >= 0 else -1
+        self._cancel_stale({index + i * step for i in range(self.prefetch + 1)})
+        values = self.cache.get(index)
+        if values is not None:
+            self.hits += 1
+            self.wanted = None
+        else:
+            self.misses += 1
+            self.wanted = index
+            self._schedule(index)
+        for i in range(1, self.prefetch + 1):
+            self._schedule(index + i * step)
+        return values
+
+    def poll(self):
+        """Moves finished reads into the cache; returns (index, values, latency) if the wanted timestep arrived.
+
+        Failed reads are collected in self.errors as (file_path, exception).
+        """
+        arrived = None
+        for index, (queued, future) in list(self.pending.items()):
+            if not future.done():
+                continue
+            del self.pending[index]
+            if future.exception() is not None:
+                self.errors.append((self.file_paths[index], future.exception()))
+                if index == self.wanted:
+                    self.wanted = None
+                continue
+            values, _ = future.result()
+            latency = time.perf_counter() - queued
+            self.cache.put(index, values)
+            if index == self.wanted:
+                self.load_times.append(latency)
+                self.wanted = None
+                arrived = (index, values, latency)
+        return arrived
+
+    def fill(self, values, out):
+        """Writes cached values (from request() or poll()) into `out`, the float32 array the pipeline reads."""
+        if self.encoded:
+            decode(values, out)
+        else:
+            out[:] = values
+
+    @property
+    def hit_rate(self):
+        return self.hits / max(self.hits + self.misses, 1)
+
+    def stats(self):
+        mean_latency = np.mean(self.load_times) if self.load_times else 0.0
+        return (f"hit rate {100 * self.hit_rate:.0f}%, mean load {mean_latency:.2f}s, "
+                f"{self.cancelled} stale reads cancelled, cache {len(self.cache)} steps / {self.cache.nbytes / 2 ** 20:.0f} MB")
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
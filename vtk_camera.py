@@ -1,4 +1,4 @@
-import vtk
+import mantle_vtk as vtk
 import json
 import os
 import time